@@ -0,0 +1,272 @@
+"""
+Backups programados en disco
+Tarea en segundo plano (iniciada en startup_event) que escribe backups
+completos comprimidos en un directorio local según una expresión tipo cron
+y aplica retención: se conservan N diarios y M semanales.
+
+Variables de entorno:
+    BACKUP_SCHEDULE      expresión cron de 5 campos (por defecto "0 3 * * *");
+                         vacía desactiva los backups programados
+    BACKUP_TIMEZONE      zona horaria de la expresión (por defecto UTC)
+    BACKUP_DIR           directorio de destino (por defecto backend/backups)
+    BACKUP_KEEP_DAILY    backups diarios a conservar (por defecto 7)
+    BACKUP_KEEP_WEEKLY   backups semanales a conservar (por defecto 4)
+"""
+import asyncio
+import logging
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from backup_service import stream_backup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCHEDULE = "0 3 * * *"
+DEFAULT_DIR = Path(__file__).parent / "backups"
+SNAPSHOT_PREFIX = "snapshot_"
+SNAPSHOT_SUFFIX = ".ndjson.gz"
+SNAPSHOT_PATTERN = re.compile(rf"^{SNAPSHOT_PREFIX}(\d{{8}}_\d{{6}}){re.escape(SNAPSHOT_SUFFIX)}$")
+# Un solo backup a la vez (programado o manual): el resto del proceso sigue atendiendo la API
+MAX_CONCURRENT_SNAPSHOTS = 1
+
+
+# ============ EXPRESIONES CRON ============
+
+CRON_FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 6)]
+
+
+def _parse_cron_field(expression: str, low: int, high: int) -> Set[int]:
+    """Soporta *, valores, rangos a-b, listas a,b y pasos */n o a-b/n"""
+    values: Set[int] = set()
+    for part in expression.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(value) for value in part.split("-", 1))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Valor fuera de rango en '{expression}' ({low}-{high})")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+@dataclass(frozen=True)
+class CronSchedule:
+    """
+    Expresión cron de 5 campos: minuto hora día mes día_semana (0 = domingo).
+    A diferencia de cron, día y día_semana se combinan con AND.
+    """
+    expression: str
+    minutes: Tuple[int, ...]
+    hours: Tuple[int, ...]
+    days: frozenset
+    months: frozenset
+    weekdays: frozenset
+
+    @classmethod
+    def parse(cls, expression: str) -> "CronSchedule":
+        parts = expression.split()
+        if len(parts) != len(CRON_FIELDS):
+            raise ValueError(f"La expresión cron debe tener 5 campos: '{expression}'")
+        fields = [_parse_cron_field(part, low, high) for part, (_, low, high) in zip(parts, CRON_FIELDS)]
+        return cls(
+            expression=expression,
+            minutes=tuple(sorted(fields[0])),
+            hours=tuple(sorted(fields[1])),
+            days=frozenset(fields[2]),
+            months=frozenset(fields[3]),
+            weekdays=frozenset(fields[4]),
+        )
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Primera ejecución estrictamente posterior a moment (misma zona horaria)"""
+        start = moment.replace(second=0, microsecond=0)
+        for offset in range(366 * 5):
+            day = (start + timedelta(days=offset)).replace(hour=0, minute=0)
+            # isoweekday: lunes=1 ... domingo=7 -> cron: domingo=0
+            if day.day not in self.days or day.month not in self.months or day.isoweekday() % 7 not in self.weekdays:
+                continue
+            for hour in self.hours:
+                for minute in self.minutes:
+                    candidate = day.replace(hour=hour, minute=minute)
+                    if candidate > moment:
+                        return candidate
+        raise ValueError(f"La expresión cron nunca se cumple: '{self.expression}'")
+
+
+# ============ RETENCIÓN ============
+
+def snapshot_time(path: Path) -> Optional[datetime]:
+    match = SNAPSHOT_PATTERN.match(path.name)
+    if not match:
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").replace(tzinfo=timezone.utc)
+
+
+def select_retained(snapshots: Iterable[Tuple[Path, datetime]], keep_daily: int, keep_weekly: int) -> Set[Path]:
+    """
+    El más reciente de cada uno de los últimos keep_daily días y de cada una
+    de las últimas keep_weekly semanas ISO que tengan backups
+    """
+    retained: Set[Path] = set()
+    days: Dict[Any, Path] = {}
+    weeks: Dict[Any, Path] = {}
+    for path, created in sorted(snapshots, key=lambda item: item[1], reverse=True):
+        days.setdefault(created.date(), path)
+        weeks.setdefault(created.isocalendar()[:2], path)
+    retained.update(list(days.values())[:keep_daily])
+    retained.update(list(weeks.values())[:keep_weekly])
+    return retained
+
+
+# ============ PROGRAMADOR ============
+
+class BackupScheduler:
+    def __init__(self):
+        self.directory = Path(os.environ.get("BACKUP_DIR") or DEFAULT_DIR)
+        self.expression = os.environ.get("BACKUP_SCHEDULE", DEFAULT_SCHEDULE).strip()
+        self.timezone = ZoneInfo(os.environ.get("BACKUP_TIMEZONE", "UTC"))
+        self.keep_daily = int(os.environ.get("BACKUP_KEEP_DAILY", "7"))
+        self.keep_weekly = int(os.environ.get("BACKUP_KEEP_WEEKLY", "4"))
+        self.schedule: Optional[CronSchedule] = None
+        self.error: Optional[str] = None
+        try:
+            self.schedule = CronSchedule.parse(self.expression) if self.expression else None
+        except ValueError as e:
+            # Una expresión inválida desactiva los backups programados, no el arranque
+            self.error = str(e)
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_SNAPSHOTS)
+        self.next_run: Optional[datetime] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._manual_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.semaphore.locked()
+
+    def start(self, db: AsyncIOMotorDatabase):
+        if self.error:
+            logger.error(f"❌ BACKUP_SCHEDULE inválido, backups programados desactivados: {self.error}")
+            return
+        if self.schedule is None:
+            logger.info("💾 Backups programados desactivados (BACKUP_SCHEDULE vacío)")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(db))
+            logger.info(f"💾 Backups programados: '{self.expression}' ({self.timezone.key}) en {self.directory}")
+
+    async def stop(self):
+        for task in (self._task, self._manual_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = None
+        self._manual_task = None
+
+    def trigger(self, db: AsyncIOMotorDatabase) -> bool:
+        """Backup inmediato en segundo plano. False si ya hay uno en curso"""
+        if self.running or (self._manual_task is not None and not self._manual_task.done()):
+            return False
+        self._manual_task = asyncio.create_task(self._run_logged(db))
+        return True
+
+    async def _run_logged(self, db: AsyncIOMotorDatabase):
+        try:
+            await self.run_snapshot(db)
+        except Exception as e:
+            # El error queda en last_run; el siguiente turno se intenta igual
+            logger.error(f"❌ Backup programado falló: {e}")
+
+    async def _loop(self, db: AsyncIOMotorDatabase):
+        while True:
+            self.next_run = self.schedule.next_after(datetime.now(self.timezone))
+            delay = (self.next_run - datetime.now(self.timezone)).total_seconds()
+            await asyncio.sleep(max(delay, 0))
+            await self._run_logged(db)
+
+    async def run_snapshot(self, db: AsyncIOMotorDatabase) -> Dict[str, Any]:
+        """Escribe un backup completo (archivo temporal + rename) y aplica la retención"""
+        async with self.semaphore:
+            started = datetime.now(timezone.utc)
+            path = self.directory / f"{SNAPSHOT_PREFIX}{started.strftime('%Y%m%d_%H%M%S')}{SNAPSHOT_SUFFIX}"
+            partial = path.with_name(path.name + ".partial")
+            self.last_run = {"status": "running", "started_at": started.isoformat(), "file": path.name,
+                             "size": None, "finished_at": None, "removed": [], "error": None}
+            try:
+                await asyncio.to_thread(self.directory.mkdir, parents=True, exist_ok=True)
+                handle = await asyncio.to_thread(open, partial, "wb")
+                try:
+                    # Sin record: no mueve la marca de agua de los incrementales descargados
+                    async for chunk in stream_backup(db, record=False):
+                        # La escritura a disco no bloquea el event loop
+                        await asyncio.to_thread(handle.write, chunk)
+                finally:
+                    await asyncio.to_thread(handle.close)
+                await asyncio.to_thread(os.replace, partial, path)
+                removed = await asyncio.to_thread(self.apply_retention)
+                self.last_run.update(
+                    status="completed",
+                    size=path.stat().st_size,
+                    removed=removed,
+                    finished_at=datetime.now(timezone.utc).isoformat()
+                )
+                logger.info(f"💾 Backup programado: {path.name} ({self.last_run['size']} bytes), {len(removed)} eliminados")
+            except Exception as e:
+                await asyncio.to_thread(partial.unlink, missing_ok=True)
+                self.last_run.update(status="failed", error=str(e), finished_at=datetime.now(timezone.utc).isoformat())
+                raise
+            return dict(self.last_run)
+
+    def list_snapshots(self) -> List[Tuple[Path, datetime]]:
+        if not self.directory.is_dir():
+            return []
+        snapshots = []
+        for path in self.directory.iterdir():
+            created = snapshot_time(path)
+            if created is not None:
+                snapshots.append((path, created))
+        return sorted(snapshots, key=lambda item: item[1], reverse=True)
+
+    def apply_retention(self) -> List[str]:
+        snapshots = self.list_snapshots()
+        retained = select_retained(snapshots, self.keep_daily, self.keep_weekly)
+        removed = []
+        for path, _ in snapshots:
+            if path not in retained:
+                path.unlink(missing_ok=True)
+                removed.append(path.name)
+        return removed
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.schedule is not None,
+            "schedule": self.expression or None,
+            "error": self.error,
+            "timezone": self.timezone.key,
+            "directory": str(self.directory),
+            "retention": {"daily": self.keep_daily, "weekly": self.keep_weekly},
+            "running": self.running,
+            "next_run": self.next_run.isoformat() if self.next_run else None,
+            "last_run": self.last_run,
+            "snapshots": [
+                {"file": path.name, "created_at": created.isoformat(), "size": path.stat().st_size}
+                for path, created in self.list_snapshots()
+            ],
+        }
+
+
+backup_scheduler = BackupScheduler()
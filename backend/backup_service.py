@@ -0,0 +1,642 @@
+"""
+Servicio de Backup
+Formato NDJSON comprimido con gzip, generado en streaming: los cursores se
+recorren por lotes y cada documento es una línea, así que la memoria usada
+no depende del tamaño de la base de datos.
+
+Formato (una línea JSON extendido de BSON por registro):
+    {"__backup__": {...metadatos...}}
+    {"__collection__": "customers"}
+    {...documento...}
+    {"__end__": "customers", "count": 120, "checksum": "..."}
+
+La restauración lee el archivo por lotes, inserta en colecciones de
+staging, las verifica (conteo y checksum) y solo entonces las intercambia
+con renameCollection: un fallo nunca deja colecciones a medio llenar.
+
+Incrementales: cada backup guarda una marca de agua; el incremental
+exporta lo modificado después de la anterior (updated_at) más las
+eliminaciones registradas en backup_tombstones. Se restauran aplicando el
+completo y luego cada incremental en orden.
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterator, List, Optional, Tuple
+from bson import json_util
+from pymongo import IndexModel, ReplaceOne
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from index_service import get_index_registry, ID_COLLECTIONS
+from database import TOMBSTONES_COLLECTION, TOMBSTONE_RETENTION_DAYS
+from date_service import migrate_dates_to_bson
+
+logger = logging.getLogger(__name__)
+
+BACKUP_FORMAT = "espacios-ndjson"
+BACKUP_FORMAT_VERSION = 2
+APP_VERSION = "1.0"
+
+# Colecciones a respaldar
+BACKUP_COLLECTIONS = [
+    "users", "customers", "categories", "expense_categories",
+    "villas", "extra_services", "reservations", "villa_owners", "owner_payments",
+    "expenses", "reservation_abonos", "expense_abonos", "commissions",
+    "quotations", "conduces", "quotation_terms",
+    "invoice_counter", "invoice_numbers", "invoice_templates", "logo_config",
+    "website_content", "website_images", "public_services", "chatbot_questions",
+    "client_quotations", "quote_requests",
+    "media", "media_files.files", "media_files.chunks",
+]
+
+# GridFS enlaza archivos y bloques por _id: se conserva solo en estas
+GRIDFS_FILES = "media_files.files"
+GRIDFS_CHUNKS = "media_files.chunks"
+KEEP_OBJECT_ID = {GRIDFS_FILES, GRIDFS_CHUNKS}
+
+# En un incremental las colecciones con "id" llevan solo lo modificado y
+# GridFS (inmutable) solo los archivos nuevos: se aplican como upsert.
+# El resto (contadores y configuración, pocos documentos) va completo.
+DELTA_COLLECTIONS = [name for name in BACKUP_COLLECTIONS if name in ID_COLLECTIONS]
+UPSERT_COLLECTIONS = set(DELTA_COLLECTIONS) | KEEP_OBJECT_ID
+
+# Historial de backups generados/restaurados (marcas de agua)
+SNAPSHOTS_COLLECTION = "backup_snapshots"
+# Margen para escrituras en curso: lo modificado en ese intervalo sale en dos
+# incrementales seguidos, y aplicarlo dos veces no cambia el resultado
+WATERMARK_LAG = timedelta(seconds=60)
+
+CURSOR_BATCH_SIZE = 500
+RESTORE_BATCH_SIZE = 1000
+RESTORE_BATCH_BYTES = 8 * 1024 * 1024
+STAGING_PREFIX = "_restore_"
+STREAM_CHUNK_SIZE = 64 * 1024
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware=True, tzinfo=timezone.utc)
+
+
+def backup_filename(kind: str = "full") -> str:
+    suffix = "" if kind == "full" else f"_{kind}"
+    return f"espacios_backup{suffix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson.gz"
+
+
+def _dumps(document: dict) -> str:
+    return json_util.dumps(document, json_options=JSON_OPTIONS, ensure_ascii=False)
+
+
+def _line(document: dict) -> bytes:
+    return (_dumps(document) + "\n").encode("utf-8")
+
+
+def document_checksum(document: dict) -> int:
+    """Hash de un documento (64 bits); el de la colección es la suma, sin depender del orden"""
+    return int.from_bytes(hashlib.sha256(_dumps(document).encode("utf-8")).digest()[:8], "big")
+
+
+def combine_checksum(total: int, value: int) -> int:
+    return (total + value) % (1 << 64)
+
+
+def format_checksum(value: int) -> str:
+    return f"{value:016x}"
+
+
+def _projection(collection_name: str) -> Optional[dict]:
+    return None if collection_name in KEEP_OBJECT_ID else {"_id": 0}
+
+
+def _header(kind: str, collections: List[str], **extra) -> bytes:
+    return _line({"__backup__": {
+        "format": BACKUP_FORMAT,
+        "version": BACKUP_FORMAT_VERSION,
+        "app_version": APP_VERSION,
+        "kind": kind,
+        "backup_date": datetime.now(timezone.utc).isoformat(),
+        "collections": collections,
+        **extra,
+    }})
+
+
+async def _collection_lines(db: AsyncIOMotorDatabase, collection_name: str, query: dict) -> AsyncIterator[bytes]:
+    yield _line({"__collection__": collection_name})
+    count = 0
+    checksum = 0
+    async for document in db[collection_name].find(query, _projection(collection_name), batch_size=CURSOR_BATCH_SIZE):
+        yield _line(document)
+        count += 1
+        checksum = combine_checksum(checksum, document_checksum(document))
+    yield _line({"__end__": collection_name, "count": count, "checksum": format_checksum(checksum)})
+
+
+async def iter_backup_lines(
+    db: AsyncIOMotorDatabase,
+    collections: List[str] = BACKUP_COLLECTIONS,
+    watermark: Optional[datetime] = None
+) -> AsyncIterator[bytes]:
+    """Líneas NDJSON del backup, un documento a la vez"""
+    yield _header("full", collections, watermark=watermark.isoformat() if watermark else None)
+    for collection_name in collections:
+        async for line in _collection_lines(db, collection_name, {}):
+            yield line
+
+
+async def iter_incremental_lines(
+    db: AsyncIOMotorDatabase,
+    since: datetime,
+    watermark: datetime,
+    collections: List[str] = BACKUP_COLLECTIONS
+) -> AsyncIterator[bytes]:
+    """Líneas NDJSON de un incremental: lo modificado después de since + eliminaciones"""
+    yield _header(
+        "incremental", collections,
+        since=since.isoformat(),
+        watermark=watermark.isoformat(),
+        upsert=[name for name in collections if name in UPSERT_COLLECTIONS],
+    )
+    for collection_name in collections:
+        if collection_name in DELTA_COLLECTIONS:
+            query = {"updated_at": {"$gt": since}}
+        elif collection_name == GRIDFS_FILES:
+            query = {"uploadDate": {"$gt": since}}
+        elif collection_name == GRIDFS_CHUNKS:
+            # GridFS escribe los bloques antes que el archivo: nunca falta uno
+            file_ids = await db[GRIDFS_FILES].distinct("_id", {"uploadDate": {"$gt": since}})
+            query = {"files_id": {"$in": file_ids}}
+        else:
+            query = {}
+        async for line in _collection_lines(db, collection_name, query):
+            yield line
+    async for line in _collection_lines(db, TOMBSTONES_COLLECTION, {"deleted_at": {"$gt": since}}):
+        yield line
+
+
+async def gzip_stream(lines: AsyncIterator[bytes], chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Comprime sobre la marcha y entrega bloques de ~chunk_size"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = formato gzip
+    buffer = bytearray()
+    async for line in lines:
+        buffer += compressor.compress(line)
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += compressor.flush()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _record_when_done(db: AsyncIOMotorDatabase, lines: AsyncIterator[bytes], snapshot: dict) -> AsyncIterator[bytes]:
+    """La marca de agua solo avanza si el backup se generó completo"""
+    async for line in lines:
+        yield line
+    await db[SNAPSHOTS_COLLECTION].insert_one({**snapshot, "created_at": datetime.now(timezone.utc)})
+
+
+def _new_watermark() -> datetime:
+    """En milisegundos, la precisión de un Date de BSON (se compara con la guardada)"""
+    watermark = datetime.now(timezone.utc) - WATERMARK_LAG
+    return watermark.replace(microsecond=watermark.microsecond // 1000 * 1000)
+
+
+def stream_backup(
+    db: AsyncIOMotorDatabase,
+    collections: List[str] = BACKUP_COLLECTIONS,
+    record: bool = True
+) -> AsyncIterator[bytes]:
+    """
+    Backup completo comprimido, listo para StreamingResponse.
+    record=False no guarda la marca de agua: los snapshots del servidor no
+    son parte de la cadena de incrementales que descarga el usuario.
+    """
+    watermark = _new_watermark()
+    lines = iter_backup_lines(db, collections, watermark)
+    if not record:
+        return gzip_stream(lines)
+    snapshot = {"id": str(uuid.uuid4()), "kind": "full", "since": None, "watermark": watermark}
+    return gzip_stream(_record_when_done(db, lines, snapshot))
+
+
+class BackupError(Exception):
+    pass
+
+
+async def last_watermark(db: AsyncIOMotorDatabase) -> Optional[datetime]:
+    """Marca de agua del último backup generado o restaurado"""
+    snapshot = await db[SNAPSHOTS_COLLECTION].find_one({}, {"_id": 0, "watermark": 1}, sort=[("created_at", -1)])
+    return snapshot["watermark"] if snapshot else None
+
+
+async def stream_incremental_backup(db: AsyncIOMotorDatabase, collections: List[str] = BACKUP_COLLECTIONS) -> AsyncIterator[bytes]:
+    """
+    Incremental comprimido desde la marca de agua del último backup.
+    Raises: BackupError si no hay un backup anterior o si es más antiguo que
+    la retención de backup_tombstones (se perderían eliminaciones)
+    """
+    since = await last_watermark(db)
+    if since is None:
+        raise BackupError("No hay un backup anterior: descargue primero un backup completo")
+    if since < datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        raise BackupError(
+            f"El último backup tiene más de {TOMBSTONE_RETENTION_DAYS} días: descargue un backup completo"
+        )
+    watermark = _new_watermark()
+    lines = iter_incremental_lines(db, since, watermark, collections)
+    snapshot = {"id": str(uuid.uuid4()), "kind": "incremental", "since": since, "watermark": watermark}
+    return gzip_stream(_record_when_done(db, lines, snapshot))
+
+
+async def reset_backup_chain(db: AsyncIOMotorDatabase, watermark: Optional[datetime] = None):
+    """
+    Reinicia la cadena de incrementales (después de restaurar o de borrar
+    todo). Con watermark, la base de datos queda en ese punto y acepta los
+    incrementales que continúan desde ahí.
+    """
+    await db[SNAPSHOTS_COLLECTION].delete_many({})
+    await db[TOMBSTONES_COLLECTION].delete_many({})
+    if watermark is not None:
+        await db[SNAPSHOTS_COLLECTION].insert_one({
+            "id": str(uuid.uuid4()),
+            "kind": "restore",
+            "since": None,
+            "watermark": watermark,
+            "created_at": datetime.now(timezone.utc)
+        })
+
+
+async def backfill_updated_at(db: AsyncIOMotorDatabase) -> Dict[str, int]:
+    """
+    Documentos anteriores a los incrementales: convierte updated_at string a
+    Date y completa el que falte con created_at (o la fecha actual)
+    """
+    await migrate_dates_to_bson(db)
+    summary = {}
+    for collection_name in DELTA_COLLECTIONS:
+        result = await db[collection_name].update_many(
+            {"updated_at": {"$not": {"$type": "date"}}},
+            [{"$set": {"updated_at": {"$cond": [
+                {"$eq": [{"$type": "$created_at"}, "date"]}, "$created_at", "$$NOW"
+            ]}}}]
+        )
+        if result.modified_count:
+            summary[collection_name] = result.modified_count
+    if summary:
+        logger.info(f"🕒 updated_at completado: {summary}")
+    return summary
+
+
+# ============ LECTURA ============
+
+class BackupReader:
+    """
+    Lector incremental de un archivo de backup (NDJSON .gz o plano).
+    Los backups JSON anteriores (un solo objeto) se leen completos: no
+    tienen estructura por líneas.
+    Registros: ("start", colección, None) | ("doc", colección, (documento, bytes))
+    | ("end", colección, pie con count/checksum o None)
+    """
+
+    def __init__(self, fileobj: BinaryIO):
+        head = fileobj.read(512)
+        fileobj.seek(0)
+        self.metadata: dict = {}
+        if head[:2] == b"\x1f\x8b":
+            self._records = self._iter_ndjson(gzip.GzipFile(fileobj=fileobj))
+        elif head.lstrip()[:1] == b"{" and b'"__backup__"' not in head:
+            self._records = self._iter_legacy(fileobj.read())
+        else:
+            self._records = self._iter_ndjson(fileobj)
+        first = next(self._records, None)
+        if first is None or first[0] != "meta":
+            raise ValueError("Formato de backup inválido")
+        self.metadata = first[2]
+
+    def _iter_ndjson(self, stream) -> Iterator[Tuple[str, Optional[str], Any]]:
+        current = None
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            record = json_util.loads(line, json_options=JSON_OPTIONS)
+            if "__backup__" in record:
+                yield "meta", None, record["__backup__"]
+            elif "__collection__" in record:
+                current = record["__collection__"]
+                yield "start", current, None
+            elif "__end__" in record:
+                yield "end", record["__end__"], record
+                current = None
+            elif current is not None:
+                yield "doc", current, (record, len(line))
+
+    def _iter_legacy(self, content: bytes) -> Iterator[Tuple[str, Optional[str], Any]]:
+        legacy = json_util.loads(content.decode("utf-8"), json_options=JSON_OPTIONS)
+        if "collections" not in legacy:
+            raise ValueError("Formato de backup inválido")
+        yield "meta", None, {"backup_date": legacy.get("backup_date"), "kind": "full"}
+        for collection_name, documents in legacy["collections"].items():
+            yield "start", collection_name, None
+            for document in documents:
+                yield "doc", collection_name, (document, 0)
+            yield "end", collection_name, None
+
+    def read_batch(self, max_records: int = RESTORE_BATCH_SIZE) -> List[Tuple[str, Optional[str], Any]]:
+        """Siguiente lote de registros (vacío al terminar). Se llama desde un hilo."""
+        batch = []
+        for record in self._records:
+            batch.append(record)
+            if len(batch) >= max_records:
+                break
+        return batch
+
+
+# ============ RESTAURACIÓN ============
+
+class RestoreError(Exception):
+    pass
+
+
+class RestoreProgress:
+    """Estado de la restauración en curso (consultable mientras corre)"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.state: Dict[str, Any] = {"status": "idle"}
+
+    def start(self, filename: Optional[str]):
+        self.state = {
+            "status": "running",
+            "phase": "reading",
+            "filename": filename,
+            "collection": None,
+            "documents": 0,
+            "collections": {},
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "finished_at": None,
+            "error": None,
+        }
+
+    def update(self, **fields):
+        self.state.update(fields)
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.state.update(status=status, phase=None, error=error,
+                          finished_at=datetime.now(timezone.utc).isoformat())
+
+    def as_dict(self) -> dict:
+        return dict(self.state)
+
+
+restore_progress = RestoreProgress()
+
+
+class _StagedCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self.staging = f"{STAGING_PREFIX}{name}"
+        self.count = 0
+        self.checksum = 0
+        self.footer: Optional[dict] = None
+        self.buffer: List[dict] = []
+        self.buffer_bytes = 0
+
+
+async def _flush(db: AsyncIOMotorDatabase, staged: _StagedCollection):
+    if staged.buffer:
+        await db[staged.staging].insert_many(staged.buffer, ordered=False)
+        staged.buffer = []
+        staged.buffer_bytes = 0
+
+
+async def _collection_checksum(db: AsyncIOMotorDatabase, collection_name: str, projection: Optional[dict]) -> Tuple[int, int]:
+    count = 0
+    checksum = 0
+    async for document in db[collection_name].find({}, projection, batch_size=CURSOR_BATCH_SIZE):
+        count += 1
+        checksum = combine_checksum(checksum, document_checksum(document))
+    return count, checksum
+
+
+def _verify_footer(staged: _StagedCollection):
+    """El archivo trae el conteo/checksum calculado al generar el backup"""
+    if not staged.footer:
+        return
+    if staged.footer.get("count") is not None and staged.footer["count"] != staged.count:
+        raise RestoreError(f"{staged.name}: el archivo declara {staged.footer['count']} documentos y se leyeron {staged.count}")
+    if staged.footer.get("checksum") and staged.footer["checksum"] != format_checksum(staged.checksum):
+        raise RestoreError(f"{staged.name}: checksum del archivo no coincide (archivo dañado)")
+
+
+async def _verify_staging(db: AsyncIOMotorDatabase, staged: _StagedCollection):
+    """Lo guardado en staging debe coincidir con lo leído del archivo"""
+    count, checksum = await _collection_checksum(db, staged.staging, _projection(staged.name))
+    if count != staged.count or checksum != staged.checksum:
+        raise RestoreError(
+            f"{staged.name}: verificación fallida ({count} de {staged.count} documentos en staging)"
+        )
+
+
+async def _build_staging_indexes(db: AsyncIOMotorDatabase, staged: _StagedCollection):
+    """Índices del registro + los que ya tenga la colección actual (ej. GridFS)"""
+    indexes: Dict[str, IndexModel] = {
+        index.document["name"]: index for index in get_index_registry().get(staged.name, [])
+    }
+    try:
+        existing = await db[staged.name].index_information()
+    except Exception:
+        existing = {}
+    for name, info in existing.items():
+        # Los índices de texto se declaran en el registro (su llave interna es _fts)
+        if name == "_id_" or name in indexes or any(field == "_fts" for field, _ in info["key"]):
+            continue
+        options = {k: v for k, v in info.items() if k not in ("key", "v", "ns")}
+        indexes[name] = IndexModel(info["key"], name=name, **options)
+    if indexes:
+        await db[staged.staging].create_indexes(list(indexes.values()))
+
+
+async def _drop_staging(db: AsyncIOMotorDatabase, staged: Dict[str, _StagedCollection]):
+    for item in staged.values():
+        try:
+            await db[item.staging].drop()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo eliminar {item.staging}: {e}")
+
+
+def _parse_watermark(value) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value) if isinstance(value, str) else value
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def _stage_records(db: AsyncIOMotorDatabase, reader: BackupReader, progress: RestoreProgress) -> Tuple[Dict[str, _StagedCollection], int]:
+    """Carga el archivo en colecciones _restore_* y verifica conteos/checksums"""
+    staged: Dict[str, _StagedCollection] = {}
+    current: Optional[_StagedCollection] = None
+    total_documents = 0
+
+    try:
+        while True:
+            records = await asyncio.to_thread(reader.read_batch)
+            if not records:
+                break
+            for kind, collection_name, payload in records:
+                if kind == "start":
+                    if current is not None:
+                        await _flush(db, current)
+                    current = staged.get(collection_name) or _StagedCollection(collection_name)
+                    if collection_name not in staged:
+                        await db[current.staging].drop()
+                        staged[collection_name] = current
+                    progress.update(phase="reading", collection=collection_name)
+                elif kind == "doc":
+                    document, size = payload
+                    current.buffer.append(document)
+                    current.buffer_bytes += size
+                    current.count += 1
+                    current.checksum = combine_checksum(current.checksum, document_checksum(document))
+                    total_documents += 1
+                    if len(current.buffer) >= RESTORE_BATCH_SIZE or current.buffer_bytes >= RESTORE_BATCH_BYTES:
+                        await _flush(db, current)
+                        progress.update(documents=total_documents)
+                elif kind == "end":
+                    await _flush(db, staged[collection_name])
+                    staged[collection_name].footer = payload
+                    progress.state.setdefault("collections", {})[collection_name] = staged[collection_name].count
+            progress.update(documents=total_documents)
+        if current is not None:
+            await _flush(db, current)
+
+        for item in staged.values():
+            if item.count > 0:
+                progress.update(phase="verifying", collection=item.name)
+                _verify_footer(item)
+                await _verify_staging(db, item)
+    except Exception:
+        await _drop_staging(db, staged)
+        raise
+    return staged, total_documents
+
+
+async def _swap(db: AsyncIOMotorDatabase, items: List[_StagedCollection], progress: RestoreProgress) -> List[dict]:
+    """Índices en staging y renameCollection: la colección nunca queda vacía"""
+    for item in items:
+        progress.update(phase="indexing", collection=item.name)
+        await _build_staging_indexes(db, item)
+    restored = []
+    progress.update(phase="swapping")
+    for item in items:
+        progress.update(collection=item.name)
+        await db[item.staging].rename(item.name, dropTarget=True)
+        restored.append({"collection": item.name, "documents": item.count, "checksum": format_checksum(item.checksum)})
+    return restored
+
+
+async def _merge_staging(db: AsyncIOMotorDatabase, item: _StagedCollection) -> dict:
+    """Upsert de los documentos de staging en la colección (por id, o _id en GridFS)"""
+    key = "_id" if item.name in KEEP_OBJECT_ID else "id"
+    operations = []
+    async for document in db[item.staging].find({}, _projection(item.name), batch_size=CURSOR_BATCH_SIZE):
+        operations.append(ReplaceOne({key: document[key]}, document, upsert=True))
+        if len(operations) >= RESTORE_BATCH_SIZE:
+            await db[item.name].bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db[item.name].bulk_write(operations, ordered=False)
+    return {"collection": item.name, "documents": item.count, "checksum": format_checksum(item.checksum)}
+
+
+async def _apply_tombstones(db: AsyncIOMotorDatabase, item: _StagedCollection) -> int:
+    ids_by_collection: Dict[str, List[str]] = {}
+    async for tombstone in db[item.staging].find({}, {"_id": 0, "collection": 1, "id": 1}, batch_size=CURSOR_BATCH_SIZE):
+        if tombstone.get("collection") in DELTA_COLLECTIONS:
+            ids_by_collection.setdefault(tombstone["collection"], []).append(tombstone["id"])
+    deleted = 0
+    for collection_name, ids in ids_by_collection.items():
+        for start in range(0, len(ids), RESTORE_BATCH_SIZE):
+            result = await db[collection_name].delete_many({"id": {"$in": ids[start:start + RESTORE_BATCH_SIZE]}})
+            deleted += result.deleted_count
+    return deleted
+
+
+async def _check_chain(db: AsyncIOMotorDatabase, metadata: dict) -> Tuple[datetime, datetime]:
+    """El incremental debe continuar desde el punto en que está la base de datos"""
+    since = _parse_watermark(metadata.get("since"))
+    watermark = _parse_watermark(metadata.get("watermark"))
+    if since is None or watermark is None:
+        raise RestoreError("El incremental no tiene marcas de agua")
+    position = await last_watermark(db)
+    if position is None:
+        raise RestoreError("Restaure primero el backup completo en el que se basa este incremental")
+    if since > position:
+        raise RestoreError(
+            f"Falta un incremental anterior: este empieza en {since.isoformat()} "
+            f"y la base de datos está en {position.isoformat()}"
+        )
+    if watermark <= position:
+        raise RestoreError("Este incremental ya está aplicado")
+    return since, watermark
+
+
+async def restore_backup(db: AsyncIOMotorDatabase, fileobj: BinaryIO, progress: RestoreProgress = restore_progress) -> dict:
+    """
+    Restaura un backup completo sin dejar colecciones a medio llenar:
+    1. Lee el archivo por lotes e inserta en colecciones _restore_*
+    2. Verifica conteos y checksums contra el archivo y contra staging
+    3. Crea los índices en staging
+    4. Intercambia cada colección con renameCollection(dropTarget=True)
+    Si algo falla antes del intercambio la base de datos queda intacta.
+    Como antes, las colecciones vacías en el backup no se tocan.
+    Los incrementales se delegan a restore_incremental.
+    """
+    reader = await asyncio.to_thread(BackupReader, fileobj)
+    if reader.metadata.get("kind") == "incremental":
+        return await restore_incremental(db, reader, progress)
+
+    staged, total_documents = await _stage_records(db, reader, progress)
+    try:
+        restored = await _swap(db, [item for item in staged.values() if item.count > 0], progress)
+    finally:
+        # Las ya intercambiadas no existen como staging; quedan las vacías
+        await _drop_staging(db, staged)
+    # Las eliminaciones y marcas de la base anterior no aplican a los datos restaurados
+    await reset_backup_chain(db, _parse_watermark(reader.metadata.get("watermark")))
+
+    logger.info(f"♻️ Backup restaurado: {len(restored)} colecciones, {total_documents} documentos")
+    return {"metadata": reader.metadata, "restored": restored}
+
+
+async def restore_incremental(db: AsyncIOMotorDatabase, reader: BackupReader, progress: RestoreProgress = restore_progress) -> dict:
+    """
+    Aplica un incremental sobre la base de datos restaurada:
+    1. Verifica que continúa la cadena (since <= marca actual < watermark)
+    2. Carga y verifica todo en staging, como el backup completo
+    3. Upsert de lo modificado, intercambio de las colecciones completas y
+       eliminación de los documentos en backup_tombstones
+    Aplicar dos veces el mismo rango no cambia el resultado.
+    """
+    _, watermark = await _check_chain(db, reader.metadata)
+    staged, total_documents = await _stage_records(db, reader, progress)
+
+    to_apply = [item for item in staged.values() if item.count > 0]
+    try:
+        restored = []
+        for item in to_apply:
+            if item.name in UPSERT_COLLECTIONS:
+                progress.update(phase="merging", collection=item.name)
+                restored.append(await _merge_staging(db, item))
+        restored += await _swap(
+            db, [item for item in to_apply if item.name not in UPSERT_COLLECTIONS and item.name != TOMBSTONES_COLLECTION],
+            progress
+        )
+        deleted = 0
+        if TOMBSTONES_COLLECTION in staged and staged[TOMBSTONES_COLLECTION].count:
+            progress.update(phase="deleting", collection=None)
+            deleted = await _apply_tombstones(db, staged[TOMBSTONES_COLLECTION])
+    finally:
+        await _drop_staging(db, staged)
+    await reset_backup_chain(db, watermark)
+
+    logger.info(f"♻️ Incremental aplicado: {total_documents} documentos, {deleted} eliminados")
+    return {"metadata": reader.metadata, "restored": restored, "deleted": deleted}
@@ -0,0 +1,93 @@
+"""
+Benchmark de la serialización de los endpoints de listas
+Compara, con documentos sintéticos con la forma de los guardados en MongoDB:
+- antes: restore_datetimes + validación response_model + jsonable_encoder + json
+- después: trusted_docs + orjson (FastJSONResponse)
+No necesita base de datos. Uso: python benchmark_responses.py [documentos] [repeticiones]
+"""
+import json
+import sys
+import time
+import typing
+from datetime import datetime, timezone
+from typing import List, get_args, get_origin
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import PydanticUndefined
+from database import restore_datetimes
+from fast_response import FastJSONResponse, trusted_docs
+from models import Customer, Villa, Reservation, Quotation, Conduce, Commission, VillaOwner, Expense
+
+# endpoint -> (modelo, campos de fecha que se restauraban)
+ENDPOINTS = {
+    "GET /api/customers": (Customer, ["created_at"]),
+    "GET /api/villas": (Villa, ["created_at"]),
+    "GET /api/reservations": (Reservation, ["reservation_date", "created_at", "updated_at"]),
+    "GET /api/quotations": (Quotation, []),
+    "GET /api/conduces": (Conduce, []),
+    "GET /api/commissions": (Commission, ["created_at"]),
+    "GET /api/owners": (VillaOwner, ["created_at"]),
+    "GET /api/expenses": (Expense, ["expense_date", "created_at"]),
+}
+
+NOW = datetime.now(timezone.utc)
+
+
+def sample_value(annotation):
+    """Valor de ejemplo para un campo requerido"""
+    origin = get_origin(annotation)
+    if origin is typing.Union:
+        return sample_value(next(a for a in get_args(annotation) if a is not type(None)))
+    if origin is typing.Literal:
+        return get_args(annotation)[0]
+    if origin in (list, List):
+        return []
+    if origin is dict or annotation is dict:
+        return {}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return sample_document(annotation)
+    return {str: "texto de ejemplo", int: 3, float: 1500.0, bool: True, datetime: NOW}.get(annotation, None)
+
+
+def sample_document(model) -> dict:
+    """Documento como lo guarda la API (model_dump con fechas nativas)"""
+    values = {}
+    for name, info in model.model_fields.items():
+        if info.default is PydanticUndefined and info.default_factory is None:
+            values[name] = sample_value(info.annotation)
+    return model(**values).model_dump()
+
+
+def old_path(docs, model, datetime_fields) -> bytes:
+    """Lo que hacía FastAPI con response_model=List[Model]"""
+    restored = [restore_datetimes(dict(d), datetime_fields) for d in docs]
+    validated = TypeAdapter(List[model]).validate_python(restored)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def new_path(docs, model, datetime_fields) -> bytes:
+    return FastJSONResponse(content=trusted_docs(docs, model)).body
+
+
+def measure(function, docs, model, datetime_fields, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(docs, model, datetime_fields)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"📊 {count} documentos por lista, promedio de {repeat} repeticiones (ms)")
+    print(f"{'Endpoint':<26}{'Antes':>10}{'Después':>10}{'Mejora':>9}")
+    for endpoint, (model, datetime_fields) in ENDPOINTS.items():
+        docs = [sample_document(model) for _ in range(count)]
+        before = measure(old_path, docs, model, datetime_fields, repeat)
+        after = measure(new_path, docs, model, datetime_fields, repeat)
+        print(f"{endpoint:<26}{before:>10.1f}{after:>10.1f}{before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
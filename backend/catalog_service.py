@@ -0,0 +1,157 @@
+"""
+Servicio de Catálogo Público
+Construye una sola vez la proyección pública de las villas agrupadas por
+zona (categoría) y la mantiene en caché en memoria del proceso. Las
+escrituras sobre villas y categorías invalidan la caché; el TTL cubre los
+cambios hechos por otros procesos (varios workers, importaciones por script).
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+from fastapi.encoders import jsonable_encoder
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger(__name__)
+
+NO_CATEGORY = "Sin Categoría"
+CATALOG_TTL_SECONDS = 300
+
+
+def public_villa_projection(villa: dict, zone_name: str) -> dict:
+    """Only public-facing data (NO PRICES, NO INTERNAL INFO)"""
+    return {
+        "id": villa["id"],
+        "code": villa["code"],  # SOLO CÓDIGO
+        "zone": zone_name,
+
+        # Controles de visibilidad
+        "catalog_show_price": villa.get("catalog_show_price", False),
+        "catalog_show_pasadia": villa.get("catalog_show_pasadia", False),
+        "catalog_show_amanecida": villa.get("catalog_show_amanecida", False),
+
+        # Información de catálogo - Pasadía
+        "catalog_description_pasadia": villa.get("catalog_description_pasadia", ""),
+        "catalog_price_pasadia": villa.get("catalog_price_pasadia"),
+        "catalog_currency_pasadia": villa.get("catalog_currency_pasadia", "RD$"),
+
+        # Información de catálogo - Amanecida
+        "catalog_description_amanecida": villa.get("catalog_description_amanecida", ""),
+        "catalog_price_amanecida": villa.get("catalog_price_amanecida"),
+        "catalog_currency_amanecida": villa.get("catalog_currency_amanecida", "RD$"),
+
+        # Descripciones detalladas (modal)
+        "public_description_pasadia": villa.get("public_description_pasadia", ""),
+        "public_description_amanecida": villa.get("public_description_amanecida", ""),
+
+        # Capacidades
+        "max_guests": villa.get("max_guests", 0),  # Capacidad (fallback)
+        "max_guests_pasadia": villa.get("public_max_guests_pasadia"),
+        "max_guests_amanecida": villa.get("public_max_guests_amanecida"),
+        "has_pasadia": villa.get("has_pasadia", False),
+        "has_amanecida": villa.get("has_amanecida", False),
+        "check_in_time_pasadia": villa.get("check_in_time_pasadia"),
+        "check_out_time_pasadia": villa.get("check_out_time_pasadia"),
+        "check_in_time_amanecida": villa.get("check_in_time_amanecida"),
+        "check_out_time_amanecida": villa.get("check_out_time_amanecida"),
+
+        # Multimedia y características
+        "images": villa.get("public_images", []),  # Imágenes y videos públicos
+        "default_public_image_index": villa.get("default_public_image_index", 0),  # Índice de imagen predeterminada
+        "amenities": villa.get("public_amenities", []),  # Amenidades públicas
+        "features": villa.get("public_features", []),  # Características públicas
+
+        # Precios flexibles por modalidad
+        "pasadia_prices": villa.get("pasadia_prices", []),
+        "amanecida_prices": villa.get("amanecida_prices", []),
+        "evento_prices": villa.get("evento_prices", [])
+        # NO incluir: name, prices, owner_price, category_id, etc.
+    }
+
+
+async def build_public_catalog(db: AsyncIOMotorDatabase) -> Dict[str, List[dict]]:
+    """
+    Catálogo completo {zona: [villas públicas]} con dos consultas:
+    categorías y villas, unidas en memoria
+    """
+    categories, villas = await asyncio.gather(
+        db.categories.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(None),
+        db.villas.find({}, {"_id": 0}).to_list(None)
+    )
+    category_names = {c["id"]: c["name"] for c in categories}
+
+    # Todas las categorías aparecen aunque no tengan villas
+    catalog: Dict[str, List[dict]] = {c["name"]: [] for c in categories}
+    catalog[NO_CATEGORY] = []
+
+    for villa in villas:
+        zone_name = category_names.get(villa.get("category_id"), NO_CATEGORY)
+        catalog.setdefault(zone_name, []).append(public_villa_projection(villa, zone_name))
+
+    if not catalog[NO_CATEGORY]:
+        del catalog[NO_CATEGORY]
+
+    return jsonable_encoder(catalog)
+
+
+class PublicCatalogCache:
+    """Caché en memoria del catálogo (una construcción a la vez)"""
+
+    def __init__(self, ttl: float = CATALOG_TTL_SECONDS):
+        self.ttl = ttl
+        self._catalog: Optional[Dict[str, List[dict]]] = None
+        self._body: Optional[bytes] = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+        self._catalog = None
+        self._body = None
+
+    def _is_fresh(self) -> bool:
+        return self._catalog is not None and time.monotonic() - self._built_at < self.ttl
+
+    async def get(self, db: AsyncIOMotorDatabase) -> Dict[str, List[dict]]:
+        if self._is_fresh():
+            return self._catalog
+        async with self._lock:
+            # Otra petición pudo construirlo mientras esperábamos
+            if self._is_fresh():
+                return self._catalog
+            generation = self._generation
+            catalog = await build_public_catalog(db)
+            # Si hubo una escritura durante la construcción no se guarda
+            if generation == self._generation:
+                self._catalog = catalog
+                self._body = None
+                self._built_at = time.monotonic()
+                logger.info(f"🗂️ Catálogo público construido: {sum(len(v) for v in catalog.values())} villas")
+            return catalog
+
+    async def get_body(self, db: AsyncIOMotorDatabase) -> bytes:
+        """Catálogo completo ya serializado a JSON"""
+        catalog = await self.get(db)
+        if catalog is not self._catalog:
+            return json.dumps(catalog, ensure_ascii=False).encode("utf-8")
+        if self._body is None:
+            self._body = json.dumps(catalog, ensure_ascii=False).encode("utf-8")
+        return self._body
+
+
+public_catalog_cache = PublicCatalogCache()
+
+
+def invalidate_public_catalog():
+    """Llamar después de escribir villas o categorías"""
+    public_catalog_cache.invalidate()
+
+
+def filter_catalog_by_zone(catalog: Dict[str, List[dict]], zone: str) -> Dict[str, List[Any]]:
+    """Mismo formato que el catálogo completo, con villas solo en la zona pedida"""
+    filtered = {name: (villas if name == zone else []) for name, villas in catalog.items()}
+    if not filtered.get(NO_CATEGORY):
+        filtered.pop(NO_CATEGORY, None)
+    return filtered
@@ -0,0 +1,153 @@
+"""
+Versiones por colección
+Contador que aumenta con cada escritura sobre una colección. Se alimenta de
+un CommandListener del driver, así que cubre cualquier escritura del proceso
+(endpoints, servicios de importación, migraciones) sin instrumentar cada
+llamada. Lo usan los ETags de la API.
+Cada proceso lleva sus contadores en memoria (visibles en cuanto termina la
+escritura) y los suma con $inc en la colección collection_versions, de donde
+los leen los demás procesos: otros workers y los scripts de mantenimiento,
+que registran el mismo listener (ver start / flush).
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from pymongo import UpdateOne, monitoring
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Un documento por colección: {"_id": nombre, "version": n}
+VERSIONS_COLLECTION = "collection_versions"
+
+# Comandos que modifican la colección indicada en command[nombre_del_comando]
+WRITE_COMMANDS = {"insert", "update", "delete", "findAndModify", "drop", "create"}
+
+# Cambia en cada arranque: los ETags de un proceso anterior nunca coinciden
+PROCESS_EPOCH = os.urandom(4).hex()
+
+
+def _written_collections(command_name: str, command: dict) -> Tuple[str, ...]:
+    if command_name in WRITE_COMMANDS:
+        return (command.get(command_name),)
+    if command_name == "renameCollection":
+        # Nombres completos "db.coleccion"
+        return tuple(command.get(key, "").split(".", 1)[-1] for key in ("renameCollection", "to"))
+    if command_name == "aggregate":
+        for stage in command.get("pipeline", [])[-1:]:
+            target = stage.get("$out") or stage.get("$merge")
+            if isinstance(target, dict):
+                target = target.get("coll") or target.get("into")
+                if isinstance(target, dict):
+                    target = target.get("coll")
+            if isinstance(target, str):
+                return (target,)
+    if command_name == "dropDatabase":
+        return ("*",)
+    return ()
+
+
+class CollectionVersions(monitoring.CommandListener):
+    """
+    Los contadores aumentan cuando el comando termina (con éxito o no: un
+    bulk_write desordenado puede haber aplicado parte de los cambios), para
+    que una lectura concurrente nunca asocie datos viejos a una versión nueva.
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._pending: Dict[Tuple[int, int], Tuple[str, ...]] = {}
+        # Escrituras que todavía no se sumaron en VERSIONS_COLLECTION
+        self._unpublished: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def start(self, db):
+        """Publica en db las escrituras de este proceso (se llama desde el event loop)"""
+        self._db = db
+        self._loop = asyncio.get_running_loop()
+        self._schedule_flush()
+
+    def started(self, event):
+        collections = _written_collections(event.command_name, event.command)
+        if collections:
+            with self._lock:
+                self._pending[(event.request_id, event.operation_id)] = collections
+
+    def _finish(self, event):
+        with self._lock:
+            collections = self._pending.pop((event.request_id, event.operation_id), ())
+            collections = [name for name in collections if name and name != VERSIONS_COLLECTION]
+            for name in collections:
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self._unpublished[name] = self._unpublished.get(name, 0) + 1
+        if collections and self._loop is not None:
+            try:
+                # El listener corre en los hilos del driver
+                self._loop.call_soon_threadsafe(self._schedule_flush)
+            except RuntimeError:  # event loop cerrado (apagado)
+                pass
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def snapshot(self, collections: Iterable[str]) -> Tuple[int, ...]:
+        """Versiones de este proceso ("*" cuenta los dropDatabase)"""
+        versions = self._versions
+        return (versions.get("*", 0),) + tuple(versions.get(name, 0) for name in collections)
+
+    async def shared_snapshot(self, collections: Iterable[str]) -> Tuple[int, ...]:
+        """
+        Versiones guardadas en MongoDB (escrituras de todos los procesos); una
+        sola consulta. Vacío si start no se llamó.
+        Raises: PyMongoError si la base no responde
+        """
+        if self._db is None:
+            return ()
+        names = ["*", *collections]
+        versions = {
+            doc["_id"]: doc.get("version", 0)
+            async for doc in self._db[VERSIONS_COLLECTION].find({"_id": {"$in": names}})
+        }
+        return tuple(versions.get(name, 0) for name in names)
+
+    def _schedule_flush(self):
+        if self._db is not None and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self._publish())
+
+    async def _publish(self):
+        while True:
+            with self._lock:
+                pending, self._unpublished = self._unpublished, {}
+            if not pending:
+                return
+            try:
+                await self._db[VERSIONS_COLLECTION].bulk_write([
+                    UpdateOne({"_id": name}, {"$inc": {"version": count}}, upsert=True)
+                    for name, count in pending.items()
+                ], ordered=False)
+            except PyMongoError as e:
+                # Se reintenta con la siguiente escritura
+                with self._lock:
+                    for name, count in pending.items():
+                        self._unpublished[name] = self._unpublished.get(name, 0) + count
+                logger.warning(f"⚠️ No se pudieron publicar las versiones de colecciones: {e}")
+                return
+
+    async def flush(self):
+        """Espera a que las escrituras de este proceso queden sumadas en MongoDB
+        (antes de cerrar el cliente: apagado del servidor, fin de un script)"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        if self._db is not None:
+            await self._publish()
+
+
+collection_versions = CollectionVersions()
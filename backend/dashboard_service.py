@@ -0,0 +1,361 @@
+"""
+Servicio del Dashboard
+Las estadísticas se leen de dashboard_rollups: un documento por moneda y mes
+(más un acumulado "all" por moneda) que cada escritura financiera actualiza
+con deltas $inc. rebuild_dashboard_rollups lo recalcula desde cero.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from date_service import month_range, day_start
+
+logger = logging.getLogger(__name__)
+
+# Una reservación solo se muestra/cuenta si tiene los campos críticos
+REQUIRED_RESERVATION_FIELDS = ["check_in_time", "check_out_time", "base_price", "subtotal"]
+RESERVATION_DATETIME_FIELDS = ["reservation_date", "created_at", "updated_at"]
+
+ALL_MONTHS = "all"
+ROLLUP_INDEX = IndexModel([("currency", ASCENDING), ("month", ASCENDING)], name="currency_month_unique", unique=True)
+
+RESERVATION_ROLLUP_PROJECTION = {
+    "_id": 0, "id": 1, "currency": 1, "reservation_date": 1,
+    "amount_paid": 1, "balance_due": 1, **{field: 1 for field in REQUIRED_RESERVATION_FIELDS}
+}
+EXPENSE_ROLLUP_PROJECTION = {
+    "_id": 0, "id": 1, "currency": 1, "expense_date": 1, "amount": 1, "category": 1, "payment_status": 1,
+    "related_reservation_id": 1
+}
+
+
+# ============ CONTRIBUCIÓN DE CADA DOCUMENTO ============
+
+def month_key(value) -> str:
+    """"YYYY-MM" de una fecha guardada como datetime o como string ISO"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m")
+    if isinstance(value, str):
+        return value[:7]
+    return "unknown"
+
+
+def _number(value) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+
+def reservation_contribution(reservation: dict) -> Dict[str, float]:
+    has_required = all(field in reservation for field in REQUIRED_RESERVATION_FIELDS)
+    balance_due = _number(reservation.get("balance_due"))
+    return {
+        "reservations": 1,
+        "pending_reservations": 1 if (balance_due > 0 and has_required) else 0,
+        "revenue": _number(reservation.get("amount_paid")),
+        "pending_payments": balance_due
+    }
+
+
+def expense_contribution(expense: dict) -> Dict[str, float]:
+    amount = _number(expense.get("amount"))
+    values = {"expenses": 1, "expenses_total": amount}
+    if expense.get("category") == "compromiso":
+        values.update({
+            "commitments": 1,
+            "commitments_total": amount,
+            "commitments_paid": 1 if expense.get("payment_status") == "paid" else 0,
+            "commitments_pending": 1 if expense.get("payment_status") == "pending" else 0
+        })
+    return values
+
+
+def _bucket_of(doc: dict, date_field: str) -> tuple:
+    return doc.get("currency"), month_key(doc.get(date_field))
+
+
+# ============ DELTAS INCREMENTALES ============
+# dashboard_rollup_sources guarda, por documento, la contribución que ya está
+# sumada en los rollups. Cada actualización la intercambia de forma atómica
+# (find_one_and_update con ReturnDocument.BEFORE) y aplica nueva - anterior,
+# así dos escrituras concurrentes sobre el mismo documento no cuentan doble.
+
+ROLLUP_SOURCES_COLLECTION = "dashboard_rollup_sources"
+ROLLUP_SOURCE_INDEXES = [
+    IndexModel([("kind", ASCENDING), ("id", ASCENDING)], name="kind_id_unique", unique=True),
+    # Gastos de una reservación (para reconciliarlos aunque ya se hayan borrado)
+    IndexModel([("reservation_id", ASCENDING)], name="reservation_id"),
+]
+# Rondas de reconciliación si el documento sigue cambiando mientras se actualiza
+MAX_RECONCILE_ROUNDS = 5
+
+ROLLUP_KINDS = {
+    "reservations": ("reservation_date", reservation_contribution, RESERVATION_ROLLUP_PROJECTION),
+    "expenses": ("expense_date", expense_contribution, EXPENSE_ROLLUP_PROJECTION),
+}
+
+
+def rollup_source(kind: str, doc: dict) -> dict:
+    """Contribución de un documento a los rollups, tal como se guarda en dashboard_rollup_sources"""
+    date_field, contribution, _ = ROLLUP_KINDS[kind]
+    currency, month = _bucket_of(doc, date_field)
+    return {
+        "kind": kind,
+        "id": doc["id"],
+        "currency": currency,
+        "month": month,
+        "reservation_id": doc.get("related_reservation_id"),
+        "values": contribution(doc)
+    }
+
+
+def _accumulate_source(totals: dict, source: Optional[dict], sign: int) -> None:
+    if not source:
+        return
+    bucket = totals.setdefault((source.get("currency"), source.get("month")), {})
+    for field, value in source.get("values", {}).items():
+        bucket[field] = bucket.get(field, 0) + sign * value
+
+
+async def _reconcile_source(db: AsyncIOMotorDatabase, kind: str, doc_id: str, totals: dict) -> None:
+    """
+    Deja en dashboard_rollup_sources la contribución actual del documento y
+    acumula en totals la diferencia con la que había. Si otra escritura cambió
+    el documento entre la lectura y el intercambio, se repite.
+    """
+    _, _, projection = ROLLUP_KINDS[kind]
+    sources = db[ROLLUP_SOURCES_COLLECTION]
+    stored = None
+    for round_number in range(MAX_RECONCILE_ROUNDS):
+        doc = await db[kind].find_one({"id": doc_id}, projection)
+        source = rollup_source(kind, doc) if doc else None
+        if round_number > 0 and source == stored:
+            return
+        if source is None:
+            previous = await sources.find_one_and_delete({"kind": kind, "id": doc_id}, projection={"_id": 0})
+        else:
+            previous = await sources.find_one_and_update(
+                {"kind": kind, "id": doc_id},
+                {"$set": source},
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        _accumulate_source(totals, previous, -1)
+        _accumulate_source(totals, source, 1)
+        stored = source
+    logger.warning(f"⚠️ {kind} {doc_id} siguió cambiando durante la actualización de dashboard_rollups")
+
+
+async def _increment_rollups(db: AsyncIOMotorDatabase, totals: Dict[tuple, Dict[str, float]]) -> int:
+    """Aplica con $inc los deltas por (moneda, mes) en una sola llamada bulk_write"""
+    # Además del mes, cada delta se suma al acumulado "all" de su moneda
+    increments: Dict[tuple, Dict[str, float]] = {}
+    for (currency, month), fields in totals.items():
+        for key in ((currency, month), (currency, ALL_MONTHS)):
+            bucket = increments.setdefault(key, {})
+            for field, value in fields.items():
+                bucket[field] = bucket.get(field, 0) + value
+
+    operations = []
+    for (currency, month), fields in increments.items():
+        changed = {field: value for field, value in fields.items() if value}
+        if changed:
+            operations.append(UpdateOne(
+                {"currency": currency, "month": month},
+                {"$inc": changed},
+                upsert=True
+            ))
+    if operations:
+        await db.dashboard_rollups.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+async def track_rollups(db: AsyncIOMotorDatabase, reservation_ids: Iterable[str] = (), expense_ids: Iterable[str] = ()) -> None:
+    """
+    Llamar después de escribir reservaciones o gastos (las reservaciones
+    incluyen sus gastos relacionados). Un error aquí no debe romper la
+    escritura del usuario; rebuild_dashboard_rollups corrige cualquier desvío.
+    """
+    try:
+        reservation_ids = [rid for rid in reservation_ids if rid]
+        expense_ids = {eid for eid in expense_ids if eid}
+        if reservation_ids:
+            # Gastos relacionados actuales y los que ya estaban contados (pueden haberse borrado)
+            expense_ids.update(await db.expenses.distinct("id", {"related_reservation_id": {"$in": reservation_ids}}))
+            expense_ids.update(await db[ROLLUP_SOURCES_COLLECTION].distinct(
+                "id", {"kind": "expenses", "reservation_id": {"$in": reservation_ids}}
+            ))
+        totals: Dict[tuple, Dict[str, float]] = {}
+        for reservation_id in reservation_ids:
+            await _reconcile_source(db, "reservations", reservation_id, totals)
+        for expense_id in expense_ids:
+            await _reconcile_source(db, "expenses", expense_id, totals)
+        await _increment_rollups(db, totals)
+    except Exception as e:
+        logger.error(f"❌ Error al actualizar dashboard_rollups: {str(e)}")
+
+
+# ============ RECONSTRUCCIÓN ============
+# Se construye en colecciones auxiliares que luego reemplazan a las reales con
+# renameCollection: el dashboard nunca lee rollups vacíos o a medias.
+
+ROLLUPS_STAGING = "dashboard_rollups_rebuild"
+SOURCES_STAGING = "dashboard_rollup_sources_rebuild"
+
+
+def _month_expr(field: str) -> dict:
+    value = f"${field}"
+    return {"$switch": {
+        "branches": [
+            {"case": {"$eq": [{"$type": value}, "date"]}, "then": {"$dateToString": {"format": "%Y-%m", "date": value}}},
+            {"case": {"$eq": [{"$type": value}, "string"]}, "then": {"$substrCP": [value, 0, 7]}}
+        ],
+        "default": "unknown"
+    }}
+
+
+def _number_expr(field: str) -> dict:
+    """Igual que _number: lo que no es numérico cuenta 0"""
+    return {"$cond": [{"$isNumber": f"${field}"}, f"${field}", 0]}
+
+
+def _if(condition: dict, value: Any = 1) -> dict:
+    return {"$cond": [condition, value, 0]}
+
+
+def _source_stage(kind: str, date_field: str, values: dict) -> dict:
+    """$project de un documento a su rollup_source"""
+    return {"$project": {
+        "_id": 0,
+        "kind": {"$literal": kind},
+        "id": 1,
+        "currency": {"$ifNull": ["$currency", None]},
+        "month": _month_expr(date_field),
+        "reservation_id": {"$ifNull": ["$related_reservation_id", None]},
+        "values": values
+    }}
+
+
+def _reservation_sources_pipeline() -> List[dict]:
+    has_required = {"$and": [{"$ne": [{"$type": f"${field}"}, "missing"]} for field in REQUIRED_RESERVATION_FIELDS]}
+    return [_source_stage("reservations", "reservation_date", {
+        "reservations": {"$literal": 1},
+        "pending_reservations": _if({"$and": [{"$gt": [_number_expr("balance_due"), 0]}, has_required]}),
+        "revenue": _number_expr("amount_paid"),
+        "pending_payments": _number_expr("balance_due")
+    })]
+
+
+def _expense_sources_pipeline() -> List[dict]:
+    is_commitment = {"$eq": ["$category", "compromiso"]}
+    return [_source_stage("expenses", "expense_date", {
+        "expenses": {"$literal": 1},
+        "expenses_total": _number_expr("amount"),
+        # Los campos de compromisos solo existen en los gastos de esa categoría
+        "commitments": {"$cond": [is_commitment, 1, "$$REMOVE"]},
+        "commitments_total": {"$cond": [is_commitment, _number_expr("amount"), "$$REMOVE"]},
+        "commitments_paid": {"$cond": [is_commitment, _if({"$eq": ["$payment_status", "paid"]}), "$$REMOVE"]},
+        "commitments_pending": {"$cond": [is_commitment, _if({"$eq": ["$payment_status", "pending"]}), "$$REMOVE"]}
+    })]
+
+
+ROLLUP_FIELDS = [
+    "reservations", "pending_reservations", "revenue", "pending_payments",
+    "expenses", "expenses_total", "commitments", "commitments_total", "commitments_paid", "commitments_pending"
+]
+
+
+async def rebuild_dashboard_rollups(db: AsyncIOMotorDatabase) -> int:
+    """Recalcula dashboard_rollups (y las contribuciones por documento) desde reservaciones y gastos"""
+    staging_sources = db[SOURCES_STAGING]
+    staging_rollups = db[ROLLUPS_STAGING]
+    await asyncio.gather(staging_sources.drop(), staging_rollups.drop())
+    # $out conserva los índices de la colección destino
+    await staging_sources.create_indexes(ROLLUP_SOURCE_INDEXES)
+    await staging_rollups.create_indexes([ROLLUP_INDEX])
+
+    await db.reservations.aggregate(_reservation_sources_pipeline() + [{"$out": SOURCES_STAGING}]).to_list(None)
+    await db.expenses.aggregate(_expense_sources_pipeline() + [{"$merge": {"into": SOURCES_STAGING}}]).to_list(None)
+    rows = await staging_sources.aggregate([{"$group": {
+        "_id": {"currency": "$currency", "month": "$month"},
+        **{field: {"$sum": f"$values.{field}"} for field in ROLLUP_FIELDS}
+    }}]).to_list(None)
+
+    buckets: Dict[tuple, dict] = {}
+    for row in rows:
+        currency, month = row["_id"].get("currency"), row["_id"]["month"]
+        for key in ((currency, month), (currency, ALL_MONTHS)):
+            bucket = buckets.setdefault(key, {"currency": key[0], "month": key[1]})
+            for field in ROLLUP_FIELDS:
+                bucket[field] = bucket.get(field, 0) + (row.get(field) or 0)
+    if buckets:
+        await staging_rollups.insert_many(list(buckets.values()))
+
+    await staging_sources.rename(ROLLUP_SOURCES_COLLECTION, dropTarget=True)
+    await staging_rollups.rename("dashboard_rollups", dropTarget=True)
+
+    logger.info(f"✅ dashboard_rollups reconstruido: {len(buckets)} documentos")
+    return len(buckets)
+
+
+# ============ LECTURA ============
+
+def _rollup_value(rows: List[dict], field: str, month: str, currency: Optional[str] = None) -> float:
+    return sum(
+        row.get(field, 0) for row in rows
+        if row.get("month") == month and (currency is None or row.get("currency") == currency)
+    )
+
+
+async def build_dashboard_stats(db: AsyncIOMotorDatabase) -> Dict[str, Any]:
+    """
+    Construye el payload de DashboardStats leyendo solo los rollups del mes
+    actual y los acumulados (número fijo de documentos) más listas cortas indexadas.
+    """
+    now = datetime.now(timezone.utc)
+    current_month = now.strftime("%Y-%m")
+    month_start, _ = month_range(now.year, now.month)
+
+    rollups, owners, recent_raw, pending_raw, overdue = await asyncio.gather(
+        db.dashboard_rollups.find({"month": {"$in": [ALL_MONTHS, current_month]}}, {"_id": 0}).to_list(None),
+        db.villa_owners.aggregate([
+            {"$group": {"_id": None, "count": {"$sum": 1}, "balance_due": {"$sum": "$balance_due"}}}
+        ]).to_list(1),
+        db.reservations.find({}, {"_id": 0}).sort("created_at", -1).limit(5).to_list(5),
+        db.reservations.find({"balance_due": {"$gt": 0}}, {"_id": 0}).sort("created_at", -1).limit(10).to_list(10),
+        # Vencidos depende de la fecha de hoy, no se puede mantener con $inc
+        db.expenses.count_documents({
+            "category": "compromiso",
+            "payment_status": "pending",
+            "expense_date": {"$gte": month_start, "$lt": day_start(now)}
+        })
+    )
+    owners = owners[0] if owners else {}
+
+    def has_required(r: dict) -> bool:
+        return all(key in r for key in REQUIRED_RESERVATION_FIELDS)
+
+    return {
+        "total_reservations": _rollup_value(rollups, "reservations", ALL_MONTHS),
+        "pending_reservations": _rollup_value(rollups, "pending_reservations", ALL_MONTHS),
+        "total_revenue_dop": _rollup_value(rollups, "revenue", ALL_MONTHS, "DOP"),
+        "total_revenue_usd": _rollup_value(rollups, "revenue", ALL_MONTHS, "USD"),
+        "pending_payments_dop": _rollup_value(rollups, "pending_payments", ALL_MONTHS, "DOP"),
+        "pending_payments_usd": _rollup_value(rollups, "pending_payments", ALL_MONTHS, "USD"),
+        "total_expenses_dop": _rollup_value(rollups, "expenses_total", ALL_MONTHS, "DOP"),
+        "total_expenses_usd": _rollup_value(rollups, "expenses_total", ALL_MONTHS, "USD"),
+        "total_owners": owners.get("count", 0),
+        "owners_balance_due_dop": owners.get("balance_due") or 0,
+        "owners_balance_due_usd": 0,
+        "recent_reservations": [r for r in recent_raw if has_required(r)],
+        "pending_payment_reservations": [r for r in pending_raw if has_required(r)],
+        "commitments_count": _rollup_value(rollups, "commitments", current_month),
+        "commitments_total_dop": _rollup_value(rollups, "commitments_total", current_month, "DOP"),
+        "commitments_total_usd": _rollup_value(rollups, "commitments_total", current_month, "USD"),
+        "commitments_paid_count": _rollup_value(rollups, "commitments_paid", current_month),
+        "commitments_pending_count": _rollup_value(rollups, "commitments_pending", current_month),
+        "commitments_overdue_count": overdue
+    }
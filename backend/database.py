@@ -1,7 +1,13 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
-from typing import Optional, List, Dict
-from datetime import datetime
+from typing import Optional, List, Dict, Union
+from datetime import datetime, timezone
+from date_service import BSON_DATE_FIELDS, to_bson_date
+from collection_versions import collection_versions
+
+# Deletions recorded for incremental backups (expire after the retention period)
+TOMBSTONES_COLLECTION = "backup_tombstones"
+TOMBSTONE_RETENTION_DAYS = 90
 
 class Database:
     client: Optional[AsyncIOMotorClient] = None
@@ -11,7 +17,8 @@ class Database:
     def get_db(cls):
         if cls.db is None:
             mongo_url = os.environ['MONGO_URL']
-            cls.client = AsyncIOMotorClient(mongo_url)
+            # collection_versions cuenta las escrituras por colección (ETags)
+            cls.client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[collection_versions])
             cls.db = cls.client[os.environ.get('DB_NAME', 'villa_management')]
         return cls.db
 
@@ -43,17 +50,60 @@ def serialize_docs(docs: List[dict]) -> List[dict]:
 def prepare_doc_for_insert(doc: dict) -> dict:
     """Prepare a document for MongoDB insertion"""
     prepared = doc.copy()
+    # Incremental backups export documents by updated_at
+    prepared.setdefault("updated_at", datetime.now(timezone.utc))
     
-    # Convert datetime objects to ISO strings for MongoDB
+    # Business dates are stored as BSON dates (UTC); other datetimes as ISO strings
     for key, value in prepared.items():
-        if isinstance(value, datetime):
+        if key in BSON_DATE_FIELDS:
+            if isinstance(value, (datetime, str)) and value:
+                prepared[key] = to_bson_date(value) or value
+        elif isinstance(value, datetime):
             prepared[key] = value.isoformat()
     
     return prepared
 
+def touch(update: Union[dict, list]) -> Union[dict, list]:
+    """Add updated_at to an update document or aggregation pipeline"""
+    if isinstance(update, list):
+        return update + [{"$set": {"updated_at": "$$NOW"}}]
+    touched = dict(update)
+    touched["$set"] = {**update.get("$set", {}), "updated_at": datetime.now(timezone.utc)}
+    return touched
+
+async def delete_tracked(db, collection_name: str, query: dict, many: bool = False) -> int:
+    """Delete documents leaving a tombstone per id so incremental backups replay the deletion.
+    The delete uses the caller's query as-is; tombstones are written for the ids it matched.
+    Returns the number of deleted documents"""
+    collection = db[collection_name]
+    if many:
+        ids = [doc["id"] async for doc in collection.find(query, {"_id": 0, "id": 1}) if "id" in doc]
+        deleted = (await collection.delete_many(query)).deleted_count
+    else:
+        doc = await collection.find_one_and_delete(query, projection={"_id": 0, "id": 1})
+        ids = [doc["id"]] if doc and "id" in doc else []
+        deleted = 1 if doc else 0
+    if ids:
+        deleted_at = datetime.now(timezone.utc)
+        await db[TOMBSTONES_COLLECTION].insert_many([
+            {"collection": collection_name, "id": doc_id, "deleted_at": deleted_at} for doc_id in ids
+        ])
+    return deleted
+
 def restore_datetimes(doc: dict, datetime_fields: List[str]) -> dict:
     """Restore datetime fields from ISO strings"""
     for field in datetime_fields:
         if field in doc and isinstance(doc[field], str):
             doc[field] = datetime.fromisoformat(doc[field])
     return doc
+
+async def run_migration_once(db, name: str, migration) -> bool:
+    """Run a one-off data migration and record it in the migrations collection"""
+    if await db.migrations.find_one({"name": name}):
+        return False
+    await migration(db)
+    await db.migrations.insert_one({
+        "name": name,
+        "completed_at": datetime.now(timezone.utc).isoformat()
+    })
+    return True
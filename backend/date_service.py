@@ -0,0 +1,183 @@
+"""
+Servicio de Fechas
+Las fechas de negocio se guardan como Date nativo de BSON (no como strings
+ISO) para que los filtros por mes, quincena o rango sean consultas
+$gte/$lt que usan índices. Incluye la migración por lotes (reanudable)
+de los documentos que todavía tienen fechas como string.
+"""
+import logging
+from datetime import datetime, timezone, date
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger(__name__)
+
+# Campos que se guardan como Date de BSON
+BSON_DATE_FIELDS = {
+    "reservation_date", "expense_date", "created_at", "payment_date",
+    "paid_date", "invoice_deleted_date", "updated_at"
+}
+
+# Fechas de calendario (día de negocio, sin hora): la API las devuelve sin
+# zona ("2025-01-10T00:00:00") como cuando se guardaban como string. El
+# frontend las lee con new Date(), que con "+00:00" las mostraría un día
+# antes en zonas al oeste de UTC (República Dominicana es UTC-4).
+CALENDAR_DATE_FIELDS = {"reservation_date", "expense_date", "payment_date"}
+
+# Campos a migrar por colección
+DATE_FIELDS_BY_COLLECTION: Dict[str, List[str]] = {
+    "reservations": ["reservation_date", "created_at", "updated_at"],
+    "expenses": ["expense_date", "created_at", "updated_at"],
+    "reservation_abonos": ["payment_date", "created_at", "updated_at"],
+    "expense_abonos": ["payment_date", "created_at", "updated_at"],
+    "commissions": ["reservation_date", "created_at", "paid_date", "invoice_deleted_date", "updated_at"],
+    "owner_payments": ["payment_date", "created_at", "updated_at"],
+    "users": ["created_at", "updated_at"],
+    "customers": ["created_at", "updated_at"],
+    "categories": ["created_at", "updated_at"],
+    "expense_categories": ["created_at", "updated_at"],
+    "villas": ["created_at", "updated_at"],
+    "extra_services": ["created_at", "updated_at"],
+    "quotations": ["created_at", "updated_at"],
+    "conduces": ["created_at", "updated_at"],
+    "villa_owners": ["created_at", "updated_at"],
+    "website_content": ["created_at", "updated_at"],
+    "website_images": ["created_at", "updated_at"],
+    "public_services": ["created_at", "updated_at"],
+    "chatbot_questions": ["created_at", "updated_at"],
+    "client_quotations": ["created_at", "updated_at"],
+    "quote_requests": ["created_at", "updated_at"],
+}
+
+MIGRATION_NAME = "bson_dates_v1"
+PROGRESS_NAME = f"{MIGRATION_NAME}_progress"
+MIGRATION_BATCH_SIZE = 500
+
+
+def to_bson_date(value) -> Optional[datetime]:
+    """
+    Convierte datetime / date / string ISO a un datetime UTC con zona.
+    Fechas sin zona se interpretan como UTC (así se guardaban antes).
+    Returns None si el valor no se puede interpretar.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        parsed = datetime(value.year, value.month, value.day)
+    elif isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    else:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def calendar_date_json(value: datetime) -> str:
+    """ISO sin zona (hora UTC) de una fecha de calendario"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+
+# ============ RANGOS PARA CONSULTAS ============
+
+def date_range(start: datetime, end: datetime) -> dict:
+    """Filtro semiabierto [start, end) para usar en una consulta"""
+    return {"$gte": start, "$lt": end}
+
+
+def month_range(year: int, month: int) -> Tuple[datetime, datetime]:
+    """Inicio del mes y del mes siguiente (UTC)"""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    if month == 12:
+        end = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    else:
+        end = datetime(year, month + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+
+def fortnight_range(year: int, month: int, fortnight: int) -> Tuple[datetime, datetime]:
+    """Quincena 1: días 1-14; quincena 2: del 15 al último día del mes"""
+    month_start, month_end = month_range(year, month)
+    middle = datetime(year, month, 15, tzinfo=timezone.utc)
+    if fortnight == 1:
+        return month_start, middle
+    return middle, month_end
+
+
+def day_start(value: Optional[datetime] = None) -> datetime:
+    """Medianoche UTC del día indicado (hoy por defecto)"""
+    value = value or datetime.now(timezone.utc)
+    return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+
+
+# ============ MIGRACIÓN ============
+
+async def _migrate_field(db: AsyncIOMotorDatabase, collection_name: str, field: str, last_id) -> dict:
+    """
+    Convierte un campo string -> Date recorriendo la colección por _id en lotes.
+    Guarda el último _id procesado para poder reanudar.
+    """
+    collection = db[collection_name]
+    converted = 0
+    invalid = 0
+
+    while True:
+        query = {field: {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await collection.find(query, {"_id": 1, field: 1}).sort("_id", 1).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            parsed = to_bson_date(doc[field])
+            if parsed is None:
+                invalid += 1
+                continue
+            # Solo si el valor no cambió mientras tanto
+            operations.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: parsed}}))
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"name": PROGRESS_NAME},
+            {"$set": {f"progress.{collection_name}.{field}": last_id}},
+            upsert=True
+        )
+
+    return {"converted": converted, "invalid": invalid}
+
+
+async def migrate_dates_to_bson(db: AsyncIOMotorDatabase) -> Dict[str, dict]:
+    """
+    Migración por lotes de fechas string -> Date. Es reanudable: continúa
+    desde el último _id registrado en migrations y puede ejecutarse de nuevo
+    sin efectos (solo toca valores que todavía son string).
+    """
+    state = await db.migrations.find_one({"name": PROGRESS_NAME}) or {}
+    progress = state.get("progress", {})
+    summary = {}
+
+    for collection_name, fields in DATE_FIELDS_BY_COLLECTION.items():
+        for field in fields:
+            last_id = progress.get(collection_name, {}).get(field)
+            result = await _migrate_field(db, collection_name, field, last_id)
+            if result["converted"] or result["invalid"]:
+                summary[f"{collection_name}.{field}"] = result
+                logger.info(f"📅 {collection_name}.{field}: {result['converted']} convertidas, {result['invalid']} inválidas")
+
+    # Al terminar se reinicia el progreso para que una nueva ejecución
+    # (ej. después de restaurar un backup antiguo) revise todo otra vez
+    await db.migrations.delete_one({"name": PROGRESS_NAME})
+    return summary
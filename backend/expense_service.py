@@ -0,0 +1,80 @@
+"""
+Servicio de Totales de Gastos
+Mantiene total_paid y balance_due desnormalizados en cada gasto para que
+las consultas no tengan que sumar los abonos en cada lectura
+"""
+import logging
+from typing import Optional
+from pymongo import ReturnDocument, UpdateOne
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import touch
+
+logger = logging.getLogger(__name__)
+
+# balance_due se deriva siempre de amount - total_paid dentro del mismo update
+_BALANCE_STAGE = {"$set": {"balance_due": {"$subtract": [{"$ifNull": ["$amount", 0]}, "$total_paid"]}}}
+
+
+async def apply_abono_delta(db: AsyncIOMotorDatabase, expense_id: str, delta: float) -> Optional[dict]:
+    """
+    Suma (o resta, si delta < 0) un abono al total pagado del gasto.
+    Es una única actualización atómica del documento; tolera gastos antiguos
+    que todavía no tienen total_paid.
+    Returns: el gasto actualizado (sin _id) o None si no existe
+    """
+    return await db.expenses.find_one_and_update(
+        {"id": expense_id},
+        touch([
+            {"$set": {"total_paid": {"$add": [{"$ifNull": ["$total_paid", 0]}, delta]}}},
+            _BALANCE_STAGE
+        ]),
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def set_expense_amount(db: AsyncIOMotorDatabase, expense_id: str, amount: float, extra_fields: Optional[dict] = None) -> None:
+    """Cambia el monto de un gasto recalculando balance_due en la misma operación"""
+    fields = {"amount": amount, "total_paid": {"$ifNull": ["$total_paid", 0]}}
+    if extra_fields:
+        fields.update({key: {"$literal": value} for key, value in extra_fields.items()})
+    await db.expenses.update_one(
+        {"id": expense_id},
+        touch([{"$set": fields}, _BALANCE_STAGE])
+    )
+
+
+def with_expense_totals(expense: dict) -> dict:
+    """Completa total_paid/balance_due para documentos sin los campos desnormalizados"""
+    total_paid = expense.get("total_paid") or 0
+    expense["total_paid"] = total_paid
+    expense["balance_due"] = expense.get("amount", 0) - total_paid
+    return expense
+
+
+async def backfill_expense_totals(db: AsyncIOMotorDatabase) -> int:
+    """
+    Backfill único: recalcula total_paid y balance_due de todos los gastos
+    a partir de expense_abonos (una agregación + bulk_write por lotes)
+    """
+    # Gastos sin abonos: total_paid = 0
+    await db.expenses.update_many({}, touch([{"$set": {"total_paid": 0}}, _BALANCE_STAGE]))
+
+    updated = 0
+    batch = []
+    pipeline = [{"$group": {"_id": "$expense_id", "total_paid": {"$sum": "$amount"}}}]
+    async for row in db.expense_abonos.aggregate(pipeline):
+        batch.append(UpdateOne(
+            {"id": row["_id"]},
+            touch([{"$set": {"total_paid": row["total_paid"]}}, _BALANCE_STAGE])
+        ))
+        if len(batch) >= 1000:
+            result = await db.expenses.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+    if batch:
+        result = await db.expenses.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+
+    logger.info(f"✅ Totales de gastos recalculados: {updated} gastos con abonos")
+    return updated
@@ -2,14 +2,30 @@
 Servicio de Exportación/Importación de Datos
 Genera plantillas Excel y procesa importaciones
 """
-from datetime import datetime
-from typing import List, Dict, Any
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, AsyncIterator, Awaitable, BinaryIO, Callable, Optional, Tuple, Type, Union, get_args, get_origin
+import asyncio
+import csv
 import io
-import pandas as pd
+import logging
+import math
+import tempfile
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
+from pydantic import BaseModel
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from models import Customer, Villa, Reservation, Expense
+from date_service import to_bson_date
+from search_service import SEARCH_KEYS_FIELD
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él no hay exportación Parquet
+    pa = pq = None
 
 # Colores para la plantilla
 COLOR_HEADER = "4472C4"  # Azul
@@ -262,37 +278,355 @@ def create_excel_template() -> io.BytesIO:
     return output
 
 
-async def export_data_to_excel(db: AsyncIOMotorDatabase, data_type: str) -> io.BytesIO:
+# ============ EXPORTACIÓN ============
+
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+EXPORT_BATCH_SIZE = 1000
+PARQUET_ROW_GROUP_SIZE = 10000
+# Hasta este tamaño el archivo generado queda en memoria; después, en disco
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+EXPORT_CHUNK_SIZE = 64 * 1024
+# Documentos que se leen para encontrar campos que no están en el modelo; si
+# más adelante aparece otro, se agrega como columna final con una segunda pasada
+EXPORT_SAMPLE_SIZE = 200
+# Campos internos que nunca se exportan
+EXPORT_INTERNAL_FIELDS = ("_id", SEARCH_KEYS_FIELD, "import_key")
+# Formatos que usaba pandas.to_excel
+DATETIME_FORMAT = "YYYY-MM-DD HH:MM:SS"
+DATE_FORMAT = "YYYY-MM-DD"
+
+# Columnas fijas (campo, encabezado); los demás tipos exportan todos los campos
+EXPORT_COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    "customers": [
+        ("name", "Nombre Completo"),
+        ("phone", "Teléfono"),
+        ("email", "Email"),
+        ("identification_document", "Cédula/Pasaporte/RNC"),
+        ("address", "Dirección"),
+    ],
+}
+
+# Campo de fecha del filtro por rango (indexado en cada colección)
+EXPORT_DATE_FIELDS = {
+    "customers": "created_at",
+    "villas": "created_at",
+    "reservations": "reservation_date",
+    "expenses": "expense_date",
+}
+CURRENCY_TYPES = {"reservations", "expenses"}
+
+# Modelos que definen los tipos de las columnas en Parquet
+EXPORT_MODELS: Dict[str, Type[BaseModel]] = {
+    "customers": Customer,
+    "villas": Villa,
+    "reservations": Reservation,
+    "expenses": Expense,
+}
+
+
+def _parse_day(value: str, name: str) -> datetime:
+    try:
+        parsed = datetime.strptime(value.strip(), "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{name} debe tener el formato YYYY-MM-DD")
+    return parsed.replace(tzinfo=timezone.utc)
+
+
+def build_export_query(
+    data_type: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    currency: Optional[str] = None
+) -> dict:
     """
-    Exporta datos existentes a Excel
+    Filtro de MongoDB para la exportación: rango de fechas [start_date,
+    end_date] (ambos incluidos, días UTC) y moneda.
+    Raises: ValueError si un filtro es inválido
     """
-    output = io.BytesIO()
-    
-    if data_type == "customers":
-        customers = await db.customers.find({}, {"_id": 0}).to_list(None)
-        df = pd.DataFrame(customers)
-        if not df.empty:
-            df = df[['name', 'phone', 'email', 'identification_document', 'address']]
-            df.columns = ['Nombre Completo', 'Teléfono', 'Email', 'Cédula/Pasaporte/RNC', 'Dirección']
-        df.to_excel(output, index=False, engine='openpyxl')
-    
-    elif data_type == "villas":
-        villas = await db.villas.find({}, {"_id": 0}).to_list(None)
-        df = pd.DataFrame(villas)
-        if not df.empty:
-            # Mapear columnas según necesidad
-            pass
-        df.to_excel(output, index=False, engine='openpyxl')
-    
-    elif data_type == "reservations":
-        reservations = await db.reservations.find({}, {"_id": 0}).to_list(None)
-        df = pd.DataFrame(reservations)
-        df.to_excel(output, index=False, engine='openpyxl')
-    
-    elif data_type == "expenses":
-        expenses = await db.expenses.find({}, {"_id": 0}).to_list(None)
-        df = pd.DataFrame(expenses)
-        df.to_excel(output, index=False, engine='openpyxl')
-    
+    query = {}
+    if start_date or end_date:
+        bounds = {}
+        if start_date:
+            bounds["$gte"] = _parse_day(start_date, "start_date")
+        if end_date:
+            bounds["$lt"] = _parse_day(end_date, "end_date") + timedelta(days=1)
+        if "$gte" in bounds and "$lt" in bounds and bounds["$gte"] >= bounds["$lt"]:
+            raise ValueError("start_date debe ser anterior o igual a end_date")
+        query[EXPORT_DATE_FIELDS[data_type]] = bounds
+    if currency:
+        if data_type not in CURRENCY_TYPES:
+            raise ValueError("El filtro de moneda solo aplica a reservaciones y gastos")
+        query["currency"] = currency.strip().upper()
+    return query
+
+
+async def _export_columns(db: AsyncIOMotorDatabase, collection_name: str, query: dict) -> List[Tuple[str, str]]:
+    """
+    Columnas iniciales: campos del modelo en su orden y, después, los que
+    aparecen en una muestra de los documentos (datos antiguos o importados
+    con columnas extra). Los campos internos (_id, search_keys) se excluyen.
+    """
+    fields: Dict[str, None] = dict.fromkeys(EXPORT_MODELS[collection_name].model_fields)
+    projection = {field: 0 for field in EXPORT_INTERNAL_FIELDS}
+    async for document in db[collection_name].find(query, projection).limit(EXPORT_SAMPLE_SIZE):
+        for key in document:
+            fields.setdefault(key, None)
+    return [(field, field) for field in fields]
+
+
+def _track_fields(documents: List[dict], known: Dict[str, None], missed: Dict[str, None]):
+    """Anota en missed (en orden de aparición) los campos que no tienen columna"""
+    for document in documents:
+        for key in document:
+            if key not in known:
+                missed.setdefault(key, None)
+
+
+async def _export_file(
+    db: AsyncIOMotorDatabase,
+    data_type: str,
+    query: dict,
+    write: Callable[[List[Tuple[str, str]], Dict[str, None]], Awaitable[tempfile.SpooledTemporaryFile]]
+) -> tempfile.SpooledTemporaryFile:
+    """
+    Genera el archivo con write(columnas, missed). Si un documento trae un
+    campo fuera de las columnas (no estaba en la muestra), write lo anota
+    en missed y se repite con esos campos como columnas finales, igual que
+    la unión de campos de pd.DataFrame(documentos).
+    """
+    columns = EXPORT_COLUMNS.get(data_type) or await _export_columns(db, data_type, query)
+    missed: Dict[str, None] = {}
+    output = await write(columns, missed)
+    if missed:
+        logger.info(f"📤 Exportación de {data_type}: {len(missed)} campos fuera de la muestra ({', '.join(missed)}), segunda pasada")
+        output.close()
+        output = await write(columns + [(field, field) for field in missed], {})
+    return output
+
+
+async def _iter_batches(db: AsyncIOMotorDatabase, data_type: str, query: dict, fields: List[str], size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    if data_type in EXPORT_COLUMNS:
+        projection = {"_id": 0, **{field: 1 for field in fields}}
+    else:
+        projection = {field: 0 for field in EXPORT_INTERNAL_FIELDS}
+    batch = []
+    async for document in db[data_type].find(query, projection, batch_size=EXPORT_BATCH_SIZE):
+        batch.append(document)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _naive_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def _excel_cell(ws, value):
+    """Valor de MongoDB -> celda (fechas sin zona, listas/objetos como texto)"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, datetime):
+        cell = WriteOnlyCell(ws, value=_naive_utc(value))
+        cell.number_format = DATETIME_FORMAT
+        return cell
+    if isinstance(value, date):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = DATE_FORMAT
+        return cell
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    return str(value)
+
+
+def _append_rows(ws, documents: List[dict], fields: List[str]):
+    for document in documents:
+        ws.append([_excel_cell(ws, document.get(field)) for field in fields])
+
+
+def _save_workbook(wb: Workbook) -> tempfile.SpooledTemporaryFile:
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    wb.save(output)
     output.seek(0)
     return output
+
+
+async def export_data_to_excel(db: AsyncIOMotorDatabase, data_type: str, query: Optional[dict] = None) -> tempfile.SpooledTemporaryFile:
+    """
+    Exporta datos existentes a Excel en streaming: el cursor se lee por
+    lotes y cada lote se escribe en un libro openpyxl write_only desde un
+    hilo, así que ni se bloquea el event loop ni se cargan todos los
+    documentos en memoria.
+    Returns: archivo temporal posicionado al inicio (ver iter_file)
+    """
+    query = query or {}
+
+    async def write(columns: List[Tuple[str, str]], missed: Dict[str, None]) -> tempfile.SpooledTemporaryFile:
+        fields = [field for field, _ in columns]
+        known = dict.fromkeys(fields)
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Sheet1")
+        if columns:
+            ws.append([header for _, header in columns])
+        async for batch in _iter_batches(db, data_type, query, fields):
+            if data_type not in EXPORT_COLUMNS:
+                _track_fields(batch, known, missed)
+            if not missed:  # Con un campo nuevo habrá otra pasada: solo se buscan campos
+                await asyncio.to_thread(_append_rows, ws, batch, fields)
+        return await asyncio.to_thread(_save_workbook, wb)
+
+    return await _export_file(db, data_type, query, write)
+
+
+# ============ CSV ============
+
+def _csv_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, datetime):
+        return _naive_utc(value).strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+def _write_csv_rows(output: BinaryIO, documents: List[dict], fields: List[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for document in documents:
+        writer.writerow([_csv_value(document.get(field)) for field in fields])
+    output.write(buffer.getvalue().encode("utf-8"))
+
+
+async def export_data_to_csv(db: AsyncIOMotorDatabase, data_type: str, query: Optional[dict] = None) -> tempfile.SpooledTemporaryFile:
+    """
+    CSV (UTF-8 con BOM para que Excel lea los acentos) escrito lote a lote
+    mientras se recorre el cursor; mismas columnas que el Excel. Va a un
+    archivo temporal porque el encabezado depende de todos los documentos.
+    Returns: archivo temporal posicionado al inicio (ver iter_file)
+    """
+    query = query or {}
+
+    async def write(columns: List[Tuple[str, str]], missed: Dict[str, None]) -> tempfile.SpooledTemporaryFile:
+        fields = [field for field, _ in columns]
+        known = dict.fromkeys(fields)
+        output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        header = io.StringIO()
+        csv.writer(header).writerow([name for _, name in columns])
+        output.write(("\ufeff" + header.getvalue()).encode("utf-8"))
+        async for batch in _iter_batches(db, data_type, query, fields):
+            if data_type not in EXPORT_COLUMNS:
+                _track_fields(batch, known, missed)
+            if not missed:
+                await asyncio.to_thread(_write_csv_rows, output, batch, fields)
+        output.seek(0)
+        return output
+
+    return await _export_file(db, data_type, query, write)
+
+
+# ============ PARQUET ============
+
+def _unwrap_optional(annotation):
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _arrow_type(annotation):
+    """Tipo de Arrow para un campo del modelo; lo que no es escalar va como texto"""
+    annotation = _unwrap_optional(annotation)
+    if annotation is bool:
+        return pa.bool_()
+    if annotation is int:
+        return pa.int64()
+    if annotation is float:
+        return pa.float64()
+    if annotation is datetime:
+        return pa.timestamp("ms", tz="UTC")
+    if annotation is date:
+        return pa.date32()
+    return pa.string()
+
+
+def parquet_schema(data_type: str, fields: List[str]) -> "pa.Schema":
+    model_fields = EXPORT_MODELS[data_type].model_fields
+    return pa.schema([
+        (field, _arrow_type(model_fields[field].annotation) if field in model_fields else pa.string())
+        for field in fields
+    ])
+
+
+def _arrow_value(value, arrow_type):
+    """Convierte al tipo de la columna; un valor que no encaja queda nulo"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    try:
+        if pa.types.is_timestamp(arrow_type):
+            return to_bson_date(value)
+        if pa.types.is_date32(arrow_type):
+            return value.date() if isinstance(value, datetime) else value if isinstance(value, date) else None
+        if pa.types.is_floating(arrow_type):
+            return float(value)
+        if pa.types.is_integer(arrow_type):
+            return int(value)
+        if pa.types.is_boolean(arrow_type):
+            return bool(value)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, datetime):
+        return _naive_utc(value).isoformat()
+    return value if isinstance(value, str) else str(value)
+
+
+def _write_row_group(writer, schema, documents: List[dict]):
+    columns = {
+        field.name: [_arrow_value(document.get(field.name), field.type) for document in documents]
+        for field in schema
+    }
+    writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+
+async def export_data_to_parquet(db: AsyncIOMotorDatabase, data_type: str, query: Optional[dict] = None) -> tempfile.SpooledTemporaryFile:
+    """
+    Parquet con esquema tipado (montos float64, fechas timestamp UTC) a
+    partir del modelo; cada lote del cursor es un row group escrito desde
+    un hilo.
+    """
+    if pq is None:
+        raise RuntimeError("La exportación Parquet requiere pyarrow")
+    query = query or {}
+
+    async def write(columns: List[Tuple[str, str]], missed: Dict[str, None]) -> tempfile.SpooledTemporaryFile:
+        fields = [field for field, _ in columns]
+        known = dict.fromkeys(fields)
+        schema = parquet_schema(data_type, fields)
+        output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        writer = await asyncio.to_thread(pq.ParquetWriter, output, schema, compression="snappy")
+        try:
+            async for batch in _iter_batches(db, data_type, query, fields, PARQUET_ROW_GROUP_SIZE):
+                if data_type not in EXPORT_COLUMNS:
+                    _track_fields(batch, known, missed)
+                if not missed:
+                    await asyncio.to_thread(_write_row_group, writer, schema, batch)
+        finally:
+            await asyncio.to_thread(writer.close)
+        output.seek(0)
+        return output
+
+    return await _export_file(db, data_type, query, write)
+
+
+async def iter_file(fileobj: BinaryIO, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Contenido de un archivo por bloques para StreamingResponse (lo cierra al terminar)"""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(fileobj.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
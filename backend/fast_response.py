@@ -0,0 +1,100 @@
+"""
+Respuestas JSON rápidas
+Renderizado con orjson y una ruta para lecturas confiables de la base de
+datos: los documentos se devuelven tal como vienen de MongoDB (fechas BSON
+nativas, sin pasar por string -> datetime -> string) sin construir ni
+re-validar un modelo Pydantic por documento.
+"""
+import copy
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, Type
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined
+from date_service import CALENDAR_DATE_FIELDS, calendar_date_json
+
+# Encabezados de la respuesta inyectada que no deben copiarse
+_SKIP_HEADERS = {"content-length", "content-type"}
+
+
+def _orjson_default(value: Any):
+    """Tipos de BSON que orjson no conoce"""
+    if isinstance(value, (ObjectId, Decimal)):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(ORJSONResponse):
+    """Clase de respuesta por defecto de la API"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_orjson_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+
+@lru_cache(maxsize=None)
+def _field_defaults(model: Type[BaseModel]) -> Tuple[Tuple[str, Any, Any], ...]:
+    """(nombre, default, default_factory) de cada campo del modelo"""
+    fields = []
+    for name, info in model.model_fields.items():
+        default = None if info.default is PydanticUndefined else info.default
+        fields.append((name, default, info.default_factory))
+    return tuple(fields)
+
+
+def trusted_docs(docs: Iterable[dict], model: Type[BaseModel], extra_fields: Sequence[str] = ()) -> List[dict]:
+    """
+    Equivalente liviano de validar con response_model para documentos que
+    escribió la propia API: conserva solo los campos del modelo (más
+    extra_fields) y completa los que falten con su valor por defecto.
+    """
+    fields = _field_defaults(model)
+    result = []
+    for doc in docs:
+        trusted = {}
+        for name, default, factory in fields:
+            if name in doc:
+                trusted[name] = doc[name]
+                if name in CALENDAR_DATE_FIELDS and isinstance(trusted[name], datetime):
+                    trusted[name] = calendar_date_json(trusted[name])
+            elif factory is not None:
+                trusted[name] = factory()
+            elif isinstance(default, (list, dict)):
+                trusted[name] = copy.copy(default)
+            else:
+                trusted[name] = default
+        for name in extra_fields:
+            if name in doc:
+                trusted[name] = doc[name]
+                if name in CALENDAR_DATE_FIELDS and isinstance(trusted[name], datetime):
+                    trusted[name] = calendar_date_json(trusted[name])
+        result.append(trusted)
+    return result
+
+
+def trusted_list_response(
+    docs: Iterable[dict],
+    model: Type[BaseModel],
+    response: Optional[Response] = None,
+    extra_fields: Sequence[str] = ()
+) -> FastJSONResponse:
+    """
+    Respuesta para listas leídas de la base de datos. Al devolver una
+    Response FastAPI omite response_model (que se mantiene para la
+    documentación), así que se copian los encabezados ya puestos
+    (ej. X-Next-Cursor de paginate).
+    """
+    headers = None
+    if response is not None:
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _SKIP_HEADERS}
+    return FastJSONResponse(content=trusted_docs(docs, model, extra_fields), headers=headers)
@@ -1,20 +1,39 @@
 """
 Servicio de Exportación Jerárquica - Plantillas Separadas por Entidad
-Cada entidad tiene su propia plantilla con validaciones y dropdowns
+Cada entidad tiene su propia plantilla con validaciones y dropdowns.
+Las plantillas se generan (en un hilo) una sola vez y se sirven desde una
+caché de bytes; las que llevan datos de la base (dropdowns de categorías,
+clientes, villas) se regeneran cuando cambian esas colecciones.
 """
 
+import asyncio
+import logging
+import time
 import pandas as pd
 from io import BytesIO
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.worksheet.datavalidation import DataValidation
 from datetime import datetime
-from typing import List, Dict
+from typing import Awaitable, Callable, List, Dict, Optional, Sequence, Tuple
+from collection_versions import collection_versions
+
+logger = logging.getLogger(__name__)
 
 # Colores
 COLOR_HEADER = "4472C4"
 COLOR_REQUIRED = "FFF2CC"
 COLOR_OPTIONAL = "E7E6E6"
+# Un solo objeto de relleno compartido por todas las celdas de la columna
+REQUIRED_FILL = PatternFill(start_color=COLOR_REQUIRED, end_color=COLOR_REQUIRED, fill_type="solid")
+OPTIONAL_FILL = PatternFill(start_color=COLOR_OPTIONAL, end_color=COLOR_OPTIONAL, fill_type="solid")
+
+# Hoja oculta con las opciones de los dropdowns (sin el límite de 255
+# caracteres de las listas escritas en la fórmula)
+LOOKUP_SHEET = "_Listas"
+# Las plantillas con datos también vencen: las escrituras de otros procesos
+# no cambian las versiones de este
+TEMPLATE_TTL_SECONDS = 300
 
 def _apply_header_style(ws, row_num=1):
     """Aplica estilo al header"""
@@ -26,24 +45,90 @@ def _apply_header_style(ws, row_num=1):
 def _apply_required_fill(ws, col_letter, start_row=2, end_row=100):
     """Aplica color amarillo a columnas obligatorias"""
     for row in range(start_row, end_row + 1):
-        ws[f"{col_letter}{row}"].fill = PatternFill(start_color=COLOR_REQUIRED, end_color=COLOR_REQUIRED, fill_type="solid")
+        ws[f"{col_letter}{row}"].fill = REQUIRED_FILL
 
 def _apply_optional_fill(ws, col_letter, start_row=2, end_row=100):
     """Aplica color gris a columnas opcionales"""
     for row in range(start_row, end_row + 1):
-        ws[f"{col_letter}{row}"].fill = PatternFill(start_color=COLOR_OPTIONAL, end_color=COLOR_OPTIONAL, fill_type="solid")
+        ws[f"{col_letter}{row}"].fill = OPTIONAL_FILL
+
+def _lookup_sheet(wb):
+    """Crea la hoja oculta de listas"""
+    ws_lookup = wb.create_sheet(LOOKUP_SHEET)
+    ws_lookup.sheet_state = 'hidden'
+    return ws_lookup
 
-def _add_dropdown(ws, col_letter, options, start_row=2, end_row=100):
-    """Agrega lista desplegable a una columna"""
-    dv = DataValidation(type="list", formula1=f'"{",".join(options)}"', allow_blank=True)
-    dv.error = 'Por favor selecciona un valor de la lista'
-    dv.errorTitle = 'Valor Inválido'
+def _add_dropdown(ws, col_letter, options, ws_lookup, lookup_col,
+                  error='Por favor selecciona un valor de la lista', error_title='Valor Inválido',
+                  start_row=2, end_row=100):
+    """Agrega lista desplegable a una columna, con las opciones en la columna lookup_col de la hoja oculta"""
+    for idx, option in enumerate(options, start=1):
+        ws_lookup[f'{lookup_col}{idx}'] = option
+    dv = DataValidation(
+        type="list",
+        formula1=f'={LOOKUP_SHEET}!${lookup_col}$1:${lookup_col}${max(len(options), 1)}',
+        allow_blank=True
+    )
+    dv.error = error
+    dv.errorTitle = error_title
     ws.add_data_validation(dv)
     dv.add(f'{col_letter}{start_row}:{col_letter}{end_row}')
 
+def _save(wb) -> bytes:
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+# ========== CACHÉ DE PLANTILLAS ==========
+class TemplateCache:
+    """
+    Plantillas ya generadas, en bytes. Las estáticas se generan una vez; las
+    que consultan la base se guardan con las versiones de esas colecciones
+    (collection_versions) y se regeneran cuando alguna cambia o vence el TTL.
+    """
+
+    def __init__(self, ttl: float = TEMPLATE_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[Tuple[int, ...], float, bytes]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _cached(self, name: str, collections: Sequence[str]) -> Optional[bytes]:
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        versions, built_at, content = entry
+        if not collections:
+            return content
+        if versions != collection_versions.snapshot(collections) or time.monotonic() - built_at >= self.ttl:
+            return None
+        return content
+
+    async def get(self, name: str, build: Callable[[], Awaitable[bytes]], collections: Sequence[str] = ()) -> BytesIO:
+        content = self._cached(name, collections)
+        if content is None:
+            async with self._locks.setdefault(name, asyncio.Lock()):
+                # Otra petición pudo generarla mientras esperábamos
+                content = self._cached(name, collections)
+                if content is None:
+                    # Versiones tomadas ANTES de consultar: una escritura concurrente invalida la entrada
+                    versions = collection_versions.snapshot(collections)
+                    content = await build()
+                    self._entries[name] = (versions, time.monotonic(), content)
+                    logger.info(f"📄 Plantilla {name} generada ({len(content)} bytes)")
+        return BytesIO(content)
+
+    def clear(self):
+        self._entries.clear()
+
+
+template_cache = TemplateCache()
+
 # ========== PASO 1: PLANTILLA DE CLIENTES ==========
-def generate_customers_template() -> BytesIO:
+async def generate_customers_template() -> BytesIO:
     """Genera plantilla Excel para importar clientes"""
+    return await template_cache.get("customers", lambda: asyncio.to_thread(_build_customers_template))
+
+def _build_customers_template() -> bytes:
     wb = Workbook()
     ws = wb.active
     ws.title = "Clientes"
@@ -70,15 +155,14 @@ def generate_customers_template() -> BytesIO:
     ws.column_dimensions['D'].width = 20
     ws.column_dimensions['E'].width = 40
     
-    # Guardar en BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
+    return _save(wb)
 
 # ========== PASO 2: PLANTILLA DE CATEGORÍAS DE VILLAS ==========
-def generate_villa_categories_template() -> BytesIO:
+async def generate_villa_categories_template() -> BytesIO:
     """Genera plantilla Excel para importar categorías de villas"""
+    return await template_cache.get("villa_categories", lambda: asyncio.to_thread(_build_villa_categories_template))
+
+def _build_villa_categories_template() -> bytes:
     wb = Workbook()
     ws = wb.active
     ws.title = "Categorías"
@@ -101,14 +185,19 @@ def generate_villa_categories_template() -> BytesIO:
     ws.column_dimensions['A'].width = 30
     ws.column_dimensions['B'].width = 50
     
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
+    return _save(wb)
 
 # ========== PASO 3: PLANTILLA DE VILLAS ==========
 async def generate_villas_template(db) -> BytesIO:
     """Genera plantilla Excel para importar villas con dropdown de categorías"""
+    async def build() -> bytes:
+        # Obtener categorías existentes para dropdown
+        categories = await db.categories.find({'is_active': True}, {"_id": 0, "name": 1}).to_list(None)
+        category_names = [cat["name"] for cat in categories] if categories else ["VIP", "Estándar", "Familiar"]
+        return await asyncio.to_thread(_build_villas_template, category_names)
+    return await template_cache.get("villas", build, collections=("categories",))
+
+def _build_villas_template(category_names: List[str]) -> bytes:
     wb = Workbook()
     ws = wb.active
     ws.title = "Villas"
@@ -119,18 +208,6 @@ async def generate_villas_template(db) -> BytesIO:
     ws.append(headers)
     _apply_header_style(ws)
     
-    # Obtener categorías existentes para dropdown
-    categories = await db.categories.find({'is_active': True}, {"_id": 0, "name": 1}).to_list(100)
-    category_names = [cat["name"] for cat in categories] if categories else ["VIP", "Estándar", "Familiar"]
-    
-    # Crear hoja oculta para las categorías (solución para evitar límite de 255 caracteres)
-    ws_categories = wb.create_sheet("_Categorias")
-    ws_categories.sheet_state = 'hidden'
-    
-    # Escribir categorías en hoja oculta
-    for idx, cat_name in enumerate(category_names, start=1):
-        ws_categories[f'A{idx}'] = cat_name
-    
     # Marcar columnas
     _apply_required_fill(ws, "A")  # Código (obligatorio)
     _apply_required_fill(ws, "B")  # Nombre (obligatorio)
@@ -142,16 +219,9 @@ async def generate_villas_template(db) -> BytesIO:
     _apply_optional_fill(ws, "H")  # Check-out
     
     # Dropdown para categorías usando referencia a hoja oculta
-    if category_names:
-        dv = DataValidation(
-            type="list", 
-            formula1=f'=_Categorias!$A$1:$A${len(category_names)}',
-            allow_blank=True
-        )
-        dv.error = 'Por favor selecciona una categoría de la lista'
-        dv.errorTitle = 'Categoría Inválida'
-        ws.add_data_validation(dv)
-        dv.add('C2:C100')
+    ws_lookup = _lookup_sheet(wb)
+    _add_dropdown(ws, "C", category_names, ws_lookup, "A",
+                  error='Por favor selecciona una categoría de la lista', error_title='Categoría Inválida')
     
     # NO agregar fila de ejemplo - usuario agregará sus propias villas
     
@@ -159,14 +229,14 @@ async def generate_villas_template(db) -> BytesIO:
     for col, width in [("A", 15), ("B", 25), ("C", 15), ("D", 18), ("E", 20), ("F", 40), ("G", 15), ("H", 15)]:
         ws.column_dimensions[col].width = width
     
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
+    return _save(wb)
 
 # ========== PASO 4: PLANTILLA DE SERVICIOS EXTRA ==========
-def generate_services_template() -> BytesIO:
+async def generate_services_template() -> BytesIO:
     """Genera plantilla Excel para importar servicios extra"""
+    return await template_cache.get("services", lambda: asyncio.to_thread(_build_services_template))
+
+def _build_services_template() -> bytes:
     wb = Workbook()
     ws = wb.active
     ws.title = "Servicios Extra"
@@ -191,14 +261,14 @@ def generate_services_template() -> BytesIO:
     ws.column_dimensions['B'].width = 15
     ws.column_dimensions['C'].width = 50
     
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
+    return _save(wb)
 
 # ========== PASO 5: PLANTILLA DE CATEGORÍAS DE GASTOS ==========
-def generate_expense_categories_template() -> BytesIO:
+async def generate_expense_categories_template() -> BytesIO:
     """Genera plantilla Excel para importar categorías de gastos"""
+    return await template_cache.get("expense_categories", lambda: asyncio.to_thread(_build_expense_categories_template))
+
+def _build_expense_categories_template() -> bytes:
     wb = Workbook()
     ws = wb.active
     ws.title = "Categorías Gastos"
@@ -221,14 +291,23 @@ def generate_expense_categories_template() -> BytesIO:
     ws.column_dimensions['A'].width = 30
     ws.column_dimensions['B'].width = 50
     
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
+    return _save(wb)
 
 # ========== PASO 6: PLANTILLA DE RESERVACIONES ==========
 async def generate_reservations_template(db) -> BytesIO:
     """Genera plantilla Excel para importar reservaciones con dropdowns"""
+    async def build() -> bytes:
+        # Obtener datos para dropdowns
+        customers, villas = await asyncio.gather(
+            db.customers.find({}, {"_id": 0, "name": 1}).to_list(None),
+            db.villas.find({}, {"_id": 0, "code": 1}).to_list(None)
+        )
+        customer_names = [c["name"] for c in customers] if customers else ["Ejemplo Cliente"]
+        villa_codes = [v["code"] for v in villas] if villas else ["ECPVSH"]
+        return await asyncio.to_thread(_build_reservations_template, customer_names, villa_codes)
+    return await template_cache.get("reservations", build, collections=("customers", "villas"))
+
+def _build_reservations_template(customer_names: List[str], villa_codes: List[str]) -> bytes:
     wb = Workbook()
     ws = wb.active
     ws.title = "Reservaciones"
@@ -240,16 +319,6 @@ async def generate_reservations_template(db) -> BytesIO:
     ws.append(headers)
     _apply_header_style(ws)
     
-    # Obtener datos para dropdowns
-    customers = await db.customers.find({}, {"_id": 0, "name": 1}).to_list(500)
-    customer_names = [c["name"] for c in customers] if customers else ["Ejemplo Cliente"]
-    
-    villas = await db.villas.find({}, {"_id": 0, "code": 1}).to_list(100)
-    villa_codes = [v["code"] for v in villas] if villas else ["ECPVSH"]
-    
-    services = await db.extra_services.find({}, {"_id": 0, "name": 1}).to_list(100)
-    service_names = [s["name"] for s in services] if services else ["Chef privado"]
-    
     # Opciones predefinidas
     rental_types = ["pasadia", "amanecida", "evento"]
     currencies = ["DOP", "USD"]
@@ -274,13 +343,14 @@ async def generate_reservations_template(db) -> BytesIO:
     _apply_optional_fill(ws, "O")  # Servicios
     _apply_optional_fill(ws, "P")  # Notas
     
-    # Agregar dropdowns
-    _add_dropdown(ws, "C", customer_names[:50])  # Limitar a 50 para evitar problemas
-    _add_dropdown(ws, "D", villa_codes)
-    _add_dropdown(ws, "E", rental_types)
-    _add_dropdown(ws, "J", currencies)
-    _add_dropdown(ws, "K", payment_methods)
-    _add_dropdown(ws, "N", yes_no)
+    # Agregar dropdowns (todas las opciones en la hoja oculta)
+    ws_lookup = _lookup_sheet(wb)
+    _add_dropdown(ws, "C", customer_names, ws_lookup, "A")
+    _add_dropdown(ws, "D", villa_codes, ws_lookup, "B")
+    _add_dropdown(ws, "E", rental_types, ws_lookup, "C")
+    _add_dropdown(ws, "J", currencies, ws_lookup, "D")
+    _add_dropdown(ws, "K", payment_methods, ws_lookup, "E")
+    _add_dropdown(ws, "N", yes_no, ws_lookup, "F")
     
     # Ejemplo
     ws.append(["1001", "15/10/2025", customer_names[0] if customer_names else "Juan Pérez", 
@@ -293,10 +363,7 @@ async def generate_reservations_template(db) -> BytesIO:
                        ("M", 12), ("N", 12), ("O", 30), ("P", 40)]:
         ws.column_dimensions[col].width = width
     
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
+    return _save(wb)
 
 # ========== FUNCIONES AUXILIARES ==========
 async def get_all_templates_info(db) -> List[Dict]:
@@ -1,563 +1,544 @@
 """
 Servicio de Importación Jerárquica - Procesa archivos Excel separados por entidad
+Cada hoja pasa por una etapa de validación por columnas (pandas) que produce
+un reporte de errores por fila y un DataFrame limpio y tipado; la etapa de
+escritura solo recorre ese DataFrame. Con dry_run=True se devuelve el reporte
+sin escribir nada.
 """
 
 import pandas as pd
-from io import BytesIO
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 import uuid
 from datetime import datetime, timezone
+from invoice_service import register_invoice_numbers
+from import_engine import BulkWriter, load_lookup, INSERT_ONLY_FIELDS
+from workbook_reader import read_sheet
 
-def parse_prices_from_excel(price_string: str) -> List[Dict]:
+TRUE_VALUES = ['SI', 'SÍ', 'YES', 'TRUE', '1']
+
+# (tipo, clave del precio propietario, clave del precio cliente)
+PRICE_TYPES = [
+    ("regular", "regular", "cliente"),
+    ("oferta", "oferta", "cliente"),
+    ("temporada_alta", "temporada_alta", "cliente_alta"),
+]
+
+# ============ VALIDACIÓN ============
+
+class SheetReport:
+    """
+    Errores por fila de una hoja. Como en la importación fila a fila, cada
+    fila rechazada reporta solo el primer problema encontrado.
     """
-    Parsea string de precios del Excel al formato del modelo
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.rejected = pd.Series(False, index=df.index)
+        self.skipped = pd.Series(False, index=df.index)
+        self.skipped_counts: Dict[str, int] = {}
+        self._messages: Dict[int, str] = {}
+
+    @property
+    def pending(self) -> pd.Series:
+        return ~(self.rejected | self.skipped)
+
+    def reject(self, mask: pd.Series, message: Union[str, pd.Series]):
+        """Rechaza las filas de mask aún válidas; message puede ser un texto por fila"""
+        mask = mask.fillna(False).astype(bool) & self.pending
+        for idx in self.df.index[mask]:
+            self._messages[idx] = message if isinstance(message, str) else message[idx]
+        self.rejected |= mask
+
+    def skip(self, mask: pd.Series, reason: str):
+        """Descarta en silencio (filas vacías, ejemplos de la plantilla) contando por motivo"""
+        mask = mask.fillna(False).astype(bool) & self.pending
+        self.skipped |= mask
+        self.skipped_counts[reason] = self.skipped_counts.get(reason, 0) + int(mask.sum())
+
+    @property
+    def errors(self) -> List[str]:
+        return [f"Fila {idx+2}: {message}" for idx, message in sorted(self._messages.items())]
+
+    def clean(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Filas válidas de frame con su número de fila del Excel en _row"""
+        valid = frame[self.pending].copy()
+        valid['_row'] = valid.index + 2
+        return valid
+
+    def summary(self, valid: pd.DataFrame) -> Dict:
+        return {
+            'dry_run': True,
+            'valid': len(valid),
+            'errors': self.errors,
+            'total': len(self.df)
+        }
+
+
+def _column(df: pd.DataFrame, column: str) -> pd.Series:
+    return df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+
+
+def _text(df: pd.DataFrame, column: str, default: str = '') -> pd.Series:
+    """Texto sin espacios; celdas vacías -> default"""
+    values = _column(df, column).astype('string').str.strip()
+    return values.fillna(default).astype(object)
+
+
+def _required_text(df: pd.DataFrame, column: str) -> Tuple[pd.Series, pd.Series]:
+    """(texto, máscara de celdas vacías)"""
+    values = _text(df, column)
+    return values, (values == '') | (values.str.lower() == 'nan')
+
+
+def _flag(df: pd.DataFrame, column: str, default: bool) -> pd.Series:
+    values = _column(df, column)
+    flags = values.astype('string').str.strip().str.upper().isin(TRUE_VALUES)
+    return flags.where(values.notna(), default).astype(bool)
+
+
+def _number(df: pd.DataFrame, column: str, default: Optional[float] = None) -> Tuple[pd.Series, pd.Series]:
+    """(valores numéricos, máscara de celdas con texto no numérico)"""
+    values = _column(df, column)
+    numbers = pd.to_numeric(values, errors='coerce')
+    invalid = values.notna() & numbers.isna()
+    if default is not None:
+        numbers = numbers.fillna(default)
+    return numbers.astype(float), invalid
+
+
+def _date(df: pd.DataFrame, column: str) -> Tuple[pd.Series, pd.Series]:
+    """(fechas UTC, máscara de celdas que no son fecha)"""
+    values = _column(df, column)
+    dates = pd.to_datetime(values, errors='coerce', format='mixed', utc=True)
+    return dates, values.notna() & dates.isna()
+
+
+def parse_prices_column(values: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    Parsea la columna de precios del Excel al formato del modelo
     Formato esperado: "regular:12000|cliente:15000|oferta:10000|temporada_alta:18000|cliente_alta:22000"
-    
-    Returns: [
-        {"type": "regular", "owner_price": 12000, "client_price": 15000},
-        {"type": "oferta", "owner_price": 10000, "client_price": 15000},
-        {"type": "temporada_alta", "owner_price": 18000, "client_price": 22000}
-    ]
+
+    Returns: (lista de precios por fila, máscara de filas con montos inválidos), p. ej.
+        [{"type": "regular", "owner_price": 12000, "client_price": 15000},
+         {"type": "oferta", "owner_price": 10000, "client_price": 15000},
+         {"type": "temporada_alta", "owner_price": 18000, "client_price": 22000}]
     """
-    if not price_string or pd.isna(price_string) or str(price_string).strip() == '':
-        return []
-    
+    text = values.astype('string').str.strip()
+    pairs = text[text.notna() & (text != '')].str.split('|').explode()
+    pairs = pairs[pairs.str.contains(':', regex=False, na=False)]
+    invalid = pd.Series(False, index=values.index)
+    if pairs.empty:
+        return pd.Series([[] for _ in range(len(values))], index=values.index, dtype=object), invalid
+
+    parts = pairs.str.split(':', n=1, expand=True)
+    amounts = pd.to_numeric(parts[1].str.strip(), errors='coerce')
+    invalid.loc[amounts[amounts.isna()].index.unique()] = True
+    # Si una clave se repite gana la última, como al llenar un diccionario
+    table = pd.DataFrame({'key': parts[0].str.strip(), 'amount': amounts})
+    table = table[table['key'] != ''].rename_axis('row').reset_index()
+    table = table.pivot_table(index='row', columns='key', values='amount', aggfunc='last')
+    table = table.reindex(index=values.index)
+
+    columns = []
+    for price_type, owner_key, client_key in PRICE_TYPES:
+        owner = table[owner_key] if owner_key in table.columns else pd.Series(float('nan'), index=table.index)
+        client = table[client_key].fillna(owner) if client_key in table.columns else owner
+        columns.append([
+            {"type": price_type, "owner_price": float(o), "client_price": float(c)} if pd.notna(o) else None
+            for o, c in zip(owner, client)
+        ])
+    prices = [
+        [] if bad else [entry for entry in entries if entry]
+        for bad, entries in zip(invalid, zip(*columns))
+    ]
+    return pd.Series(prices, index=values.index, dtype=object), invalid
+
+
+def _python_datetimes(dates: pd.Series, default: datetime) -> pd.Series:
+    """Series de datetime de Python (UTC) para que pymongo las guarde como fechas"""
+    return pd.Series(
+        [date.to_pydatetime() if pd.notna(date) else default for date in dates],
+        index=dates.index, dtype=object
+    )
+
+
+def validate_customers(df: pd.DataFrame) -> Tuple[pd.DataFrame, SheetReport]:
+    report = SheetReport(df)
+    name, missing_name = _required_text(df, 'Nombre *')
+    report.reject(missing_name, "Nombre es obligatorio")
+    frame = pd.DataFrame({
+        'name': name,
+        'email': _text(df, 'Email'),
+        'phone': _text(df, 'Teléfono'),
+        'cedula': _text(df, 'Cédula/RNC'),
+        'address': _text(df, 'Dirección'),
+    })
+    return report.clean(frame), report
+
+
+def validate_categories(df: pd.DataFrame) -> Tuple[pd.DataFrame, SheetReport]:
+    """Categorías de villas y de gastos"""
+    report = SheetReport(df)
+    name, missing_name = _required_text(df, 'Nombre Categoría *')
+    report.reject(missing_name, "Nombre es obligatorio")
+    frame = pd.DataFrame({'name': name, 'description': _text(df, 'Descripción')})
+    return report.clean(frame), report
+
+
+def validate_villas(df: pd.DataFrame) -> Tuple[pd.DataFrame, SheetReport]:
+    """Villas con modalidades (Pasadía, Amanecida, Evento)"""
+    report = SheetReport(df)
+    code, missing_code = _required_text(df, 'Código Villa *')
+    code = code.str.upper()
+    name, missing_name = _required_text(df, 'Nombre Villa *')
+    report.reject(missing_code, "Código Villa es obligatorio")
+    report.reject(missing_name, "Nombre Villa es obligatorio")
+    # SKIP EJEMPLO: la fila de ejemplo de la plantilla
+    report.skip((code == 'ECPVSH') & (name == 'Villa Shangrila'), 'skipped_example')
+
+    # Por defecto todas tienen pasadía; los precios NO son obligatorios
+    has_pasadia = _flag(df, 'Tiene Pasadía', True)
+    has_amanecida = _flag(df, 'Tiene Amanecida', False)
+    has_evento = _flag(df, 'Tiene Evento', False)
+    prices = {}
+    for modality, column, enabled in [
+        ('pasadia', 'Precios Pasadía *', None),
+        ('amanecida', 'Precios Amanecida', has_amanecida),
+        ('evento', 'Precios Evento', has_evento),
+    ]:
+        parsed, invalid = parse_prices_column(_column(df, column))
+        if enabled is not None:
+            parsed = parsed.where(enabled, pd.Series([[] for _ in range(len(df))], index=df.index))
+            invalid &= enabled
+        report.reject(invalid, f"{column.rstrip(' *')} con montos inválidos")
+        prices[modality] = parsed
+
+    frame = pd.DataFrame({
+        'code': code,
+        'name': name,
+        'category_name': _text(df, 'Categoría'),
+
+        # MODALIDAD PASADÍA
+        'has_pasadia': has_pasadia,
+        'description_pasadia': _text(df, 'Descripción Pasadía'),
+        'pasadia_prices': prices['pasadia'],
+        'pasadia_currency': _text(df, 'Moneda Pasadía', 'DOP'),
+        'default_check_in_time_pasadia': _text(df, 'Check-in Pasadía', '9:00 AM'),
+        'default_check_out_time_pasadia': _text(df, 'Check-out Pasadía', '8:00 PM'),
+
+        # MODALIDAD AMANECIDA
+        'has_amanecida': has_amanecida,
+        'description_amanecida': _text(df, 'Descripción Amanecida'),
+        'amanecida_prices': prices['amanecida'],
+        'amanecida_currency': _text(df, 'Moneda Amanecida', 'DOP'),
+        'default_check_in_time_amanecida': _text(df, 'Check-in Amanecida', '9:00 AM'),
+        'default_check_out_time_amanecida': _text(df, 'Check-out Amanecida', '8:00 AM'),
+
+        # MODALIDAD EVENTO
+        'has_evento': has_evento,
+        'description_evento': _text(df, 'Descripción Evento'),
+        'evento_prices': prices['evento'],
+        'evento_currency': _text(df, 'Moneda Evento', 'DOP'),
+        'default_check_in_time_evento': _text(df, 'Check-in Evento', '9:00 AM'),
+        'default_check_out_time_evento': _text(df, 'Check-out Evento', '8:00 PM'),
+    })
+    return report.clean(frame), report
+
+
+def validate_services(df: pd.DataFrame) -> Tuple[pd.DataFrame, SheetReport]:
+    report = SheetReport(df)
+    name, missing_name = _required_text(df, 'Nombre Servicio *')
+    price, invalid_price = _number(df, 'Precio *')
+    raw_price = _column(df, 'Precio *')
+    # Saltar filas vacías (sin nombre o sin precio)
+    report.skip(missing_name | raw_price.isna() | (raw_price.astype('string').str.strip() == ''), 'skipped_empty')
+    # SKIP EJEMPLOS del template (pero NO DJ que puede ser servicio real)
+    report.skip(name.isin(['Chef privado', 'Decoración']), 'skipped_examples')
+    report.reject(invalid_price, "Precio inválido")
+    frame = pd.DataFrame({'name': name, 'default_price': price, 'description': _text(df, 'Descripción')})
+    return report.clean(frame), report
+
+
+def validate_reservations(df: pd.DataFrame) -> Tuple[pd.DataFrame, SheetReport]:
+    """Campos y tipos; la existencia de cliente y villa se comprueba en import_reservations"""
+    report = SheetReport(df)
+    invoice_number, missing_invoice = _required_text(df, 'N° Factura *')
+    customer_name, missing_customer = _required_text(df, 'Cliente *')
+    villa_code, missing_villa = _required_text(df, 'Villa *')
+    price, invalid_price = _number(df, 'Precio *')
+    report.reject(missing_invoice, "N° Factura es obligatorio")
+    report.reject(missing_customer, "Cliente es obligatorio")
+    report.reject(missing_villa, "Villa es obligatoria")
+    report.reject(price.isna() & ~invalid_price, "Precio es obligatorio")
+    report.reject(invalid_price, "Precio inválido")
+
+    reservation_date, invalid_date = _date(df, 'Fecha Reservación *')
+    num_people, invalid_people = _number(df, 'N° Personas', 0)
+    amount_paid, invalid_paid = _number(df, 'Monto Pagado', 0)
+    deposit, invalid_deposit = _number(df, 'Depósito', 0)
+    report.reject(invalid_date, "Fecha Reservación inválida")
+    report.reject(invalid_people, "N° Personas inválido")
+    report.reject(invalid_paid, "Monto Pagado inválido")
+    report.reject(invalid_deposit, "Depósito inválido")
+
+    frame = pd.DataFrame({
+        'invoice_number': invoice_number,
+        # Sin fecha se usa la de la importación
+        'reservation_date': _python_datetimes(reservation_date, datetime.now(timezone.utc)),
+        'customer_name': customer_name,
+        'villa_code': villa_code.str.upper(),
+        'rental_type': _text(df, 'Tipo Alquiler *', 'pasadia').str.lower(),
+        'checkin_time': _text(df, 'Check-in', '08:00'),
+        'checkout_time': _text(df, 'Check-out', '18:00'),
+        'num_people': num_people.astype(int),
+        'total_amount': price,
+        'currency': _text(df, 'Moneda *', 'DOP').str.upper(),
+        'payment_method': _text(df, 'Método Pago *', 'efectivo').str.lower(),
+        'amount_paid': amount_paid,
+        'deposit': deposit,
+        'include_itbis': _text(df, 'Incluir ITBIS').str.upper() == 'SI',
+        'notes': _text(df, 'Notas'),
+    })
+    frame['balance_due'] = frame['total_amount'].fillna(0) + frame['deposit'] - frame['amount_paid']
+    return report.clean(frame), report
+
+
+def _file_error(e: Exception) -> Dict:
+    return {
+        'created': 0,
+        'updated': 0,
+        'errors': [f"Error al procesar archivo: {str(e)}"],
+        'total': 0
+    }
+
+# ============ IMPORTACIÓN ============
+# import_<entidad>(bytes) lee la hoja; import_<entidad>_frame(df) valida y
+# escribe un DataFrame ya leído (o un bloque de sus filas, ver import_jobs)
+
+async def _import_file(file_content: bytes, sheet_name: str, import_frame, db, dry_run: bool) -> Dict:
     try:
-        price_string = str(price_string).strip()
-        prices = []
-        
-        # Parsear cada par key:value separado por |
-        pairs = price_string.split('|')
-        price_dict = {}
-        
-        for pair in pairs:
-            if ':' in pair:
-                key, value = pair.split(':', 1)
-                price_dict[key.strip()] = float(value.strip())
-        
-        # Crear objetos de precio según el tipo
-        if 'regular' in price_dict:
-            prices.append({
-                "type": "regular",
-                "owner_price": price_dict.get('regular', 0),
-                "client_price": price_dict.get('cliente', price_dict.get('regular', 0))
-            })
-        
-        if 'oferta' in price_dict:
-            prices.append({
-                "type": "oferta",
-                "owner_price": price_dict.get('oferta', 0),
-                "client_price": price_dict.get('cliente', price_dict.get('oferta', 0))
-            })
-        
-        if 'temporada_alta' in price_dict:
-            prices.append({
-                "type": "temporada_alta",
-                "owner_price": price_dict.get('temporada_alta', 0),
-                "client_price": price_dict.get('cliente_alta', price_dict.get('temporada_alta', 0))
-            })
-        
-        return prices
-        
+        df = await read_sheet(file_content, sheet_name)
+        return await import_frame(df, db, dry_run)
     except Exception as e:
-        print(f"Error parseando precios: {price_string} - {e}")
-        return []
+        return _file_error(e)
 
-async def import_customers(file_content: bytes, db) -> Dict:
+async def import_customers(file_content: bytes, db, dry_run: bool = False) -> Dict:
     """Importa clientes desde Excel"""
-    try:
-        df = pd.read_excel(BytesIO(file_content), sheet_name='Clientes')
-        
-        created = 0
-        updated = 0
-        errors = []
-        
-        for idx, row in df.iterrows():
-            try:
-                # Validar campos obligatorios
-                name = str(row.get('Nombre *', '')).strip()
-                if not name or name.lower() == 'nan':
-                    errors.append(f"Fila {idx+2}: Nombre es obligatorio")
-                    continue
-                
-                # Preparar datos
-                customer_data = {
-                    'id': str(uuid.uuid4()),
-                    'name': name,
-                    'email': str(row.get('Email', '')).strip() if pd.notna(row.get('Email')) else '',
-                    'phone': str(row.get('Teléfono', '')).strip() if pd.notna(row.get('Teléfono')) else '',
-                    'cedula': str(row.get('Cédula/RNC', '')).strip() if pd.notna(row.get('Cédula/RNC')) else '',
-                    'address': str(row.get('Dirección', '')).strip() if pd.notna(row.get('Dirección')) else '',
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'created_by': 'import_system'
-                }
-                
-                # Verificar si ya existe (por nombre exacto)
-                existing = await db.customers.find_one({'name': customer_data['name']})
-                
-                if existing:
-                    # Actualizar
-                    await db.customers.update_one(
-                        {'name': customer_data['name']},
-                        {'$set': customer_data}
-                    )
-                    updated += 1
-                else:
-                    # Crear nuevo
-                    await db.customers.insert_one(customer_data)
-                    created += 1
-                    
-            except Exception as e:
-                errors.append(f"Fila {idx+2}: {str(e)}")
-        
-        return {
-            'created': created,
-            'updated': updated,
-            'errors': errors,
-            'total': len(df)
+    return await _import_file(file_content, 'Clientes', import_customers_frame, db, dry_run)
+
+async def import_customers_frame(df: pd.DataFrame, db, dry_run: bool = False) -> Dict:
+    valid, report = validate_customers(df)
+    if dry_run:
+        return report.summary(valid)
+
+    errors = report.errors
+    writer = BulkWriter(db.customers, errors)
+
+    for record in valid.to_dict('records'):
+        row = record.pop('_row')
+        customer_data = {
+            'id': str(uuid.uuid4()),
+            **record,
+            'created_at': datetime.now(timezone.utc),
+            'created_by': 'import_system'
         }
-        
-    except Exception as e:
-        return {
-            'created': 0,
-            'updated': 0,
-            'errors': [f"Error al procesar archivo: {str(e)}"],
-            'total': 0
+        # Actualizar si ya existe (por nombre exacto), si no crear
+        await writer.upsert(row, {'name': customer_data['name']}, customer_data)
+
+    await writer.flush()
+    return {
+        'created': writer.created,
+        'updated': writer.updated,
+        'errors': errors,
+        'total': len(df)
+    }
+
+async def _import_categories_frame(df: pd.DataFrame, collection, extra: Dict, dry_run: bool) -> Dict:
+    valid, report = validate_categories(df)
+    if dry_run:
+        return report.summary(valid)
+
+    errors = report.errors
+    writer = BulkWriter(collection, errors)
+
+    for record in valid.to_dict('records'):
+        row = record.pop('_row')
+        category_data = {
+            'id': str(uuid.uuid4()),
+            **record,
+            **extra,
+            'created_at': datetime.now(timezone.utc),
+            'created_by': 'import_system'
         }
+        # Actualizar si ya existe, si no crear
+        await writer.upsert(row, {'name': category_data['name']}, category_data)
+
+    await writer.flush()
+    return {
+        'created': writer.created,
+        'updated': writer.updated,
+        'errors': errors,
+        'total': len(df)
+    }
 
-async def import_villa_categories(file_content: bytes, db) -> Dict:
+async def import_villa_categories(file_content: bytes, db, dry_run: bool = False) -> Dict:
     """Importa categorías de villas desde Excel"""
-    try:
-        df = pd.read_excel(BytesIO(file_content), sheet_name='Categorías')
-        
-        created = 0
-        updated = 0
-        errors = []
-        
-        for idx, row in df.iterrows():
-            try:
-                # Validar campos obligatorios
-                name = str(row.get('Nombre Categoría *', '')).strip()
-                if not name or name.lower() == 'nan':
-                    errors.append(f"Fila {idx+2}: Nombre es obligatorio")
-                    continue
-                
-                # Preparar datos
-                category_data = {
-                    'id': str(uuid.uuid4()),
-                    'name': name,
-                    'description': str(row.get('Descripción', '')).strip() if pd.notna(row.get('Descripción')) else '',
-                    'is_active': True,  # Siempre activo al importar
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'created_by': 'import_system'
-                }
-                
-                # Verificar si ya existe
-                existing = await db.categories.find_one({'name': category_data['name']})
-                
-                if existing:
-                    await db.categories.update_one(
-                        {'name': category_data['name']},
-                        {'$set': category_data}
-                    )
-                    updated += 1
-                else:
-                    await db.categories.insert_one(category_data)
-                    created += 1
-                    
-            except Exception as e:
-                errors.append(f"Fila {idx+2}: {str(e)}")
-        
-        return {
-            'created': created,
-            'updated': updated,
-            'errors': errors,
-            'total': len(df)
-        }
-        
-    except Exception as e:
-        return {
-            'created': 0,
-            'updated': 0,
-            'errors': [f"Error al procesar archivo: {str(e)}"],
-            'total': 0
-        }
+    return await _import_file(file_content, 'Categorías', import_villa_categories_frame, db, dry_run)
+
+async def import_villa_categories_frame(df: pd.DataFrame, db, dry_run: bool = False) -> Dict:
+    # Siempre activo al importar
+    return await _import_categories_frame(df, db.categories, {'is_active': True}, dry_run)
+
+async def import_expense_categories(file_content: bytes, db, dry_run: bool = False) -> Dict:
+    """Importa categorías de gastos desde Excel"""
+    return await _import_file(file_content, 'Categorías Gastos', import_expense_categories_frame, db, dry_run)
 
-async def import_villas(file_content: bytes, db) -> Dict:
+async def import_expense_categories_frame(df: pd.DataFrame, db, dry_run: bool = False) -> Dict:
+    return await _import_categories_frame(df, db.expense_categories, {}, dry_run)
+
+async def import_villas(file_content: bytes, db, dry_run: bool = False) -> Dict:
     """Importa villas desde Excel con soporte para modalidades (Pasadía, Amanecida, Evento)"""
-    try:
-        df = pd.read_excel(BytesIO(file_content), sheet_name='Villas')
-        
-        created = 0
-        updated = 0
-        errors = []
-        skipped_example = 0
-        
-        for idx, row in df.iterrows():
-            try:
-                # Validar campos obligatorios
-                code = str(row.get('Código Villa *', '')).strip().upper()
-                name = str(row.get('Nombre Villa *', '')).strip()
-                
-                if not code or code == 'NAN':
-                    errors.append(f"Fila {idx+2}: Código Villa es obligatorio")
-                    continue
-                if not name or name.lower() == 'nan':
-                    errors.append(f"Fila {idx+2}: Nombre Villa es obligatorio")
-                    continue
-                
-                # SKIP EJEMPLO: Si es la fila de ejemplo del template, saltarla
-                if code == 'ECPVSH' and name == 'Villa Shangrila':
-                    skipped_example += 1
-                    continue
-                
-                # Buscar categoría si se especificó
-                category_id = None
-                category_name = str(row.get('Categoría', '')).strip()
-                if category_name and category_name.lower() != 'nan':
-                    category = await db.categories.find_one({'name': category_name})
-                    if category:
-                        category_id = category['id']
-                
-                # MODALIDAD PASADÍA
-                has_pasadia = True  # Por defecto todas tienen pasadía
-                if pd.notna(row.get('Tiene Pasadía')):
-                    has_pasadia = str(row.get('Tiene Pasadía', 'SI')).strip().upper() in ['SI', 'SÍ', 'YES', 'TRUE', '1']
-                
-                pasadia_prices = parse_prices_from_excel(row.get('Precios Pasadía *', ''))
-                # NO ES OBLIGATORIO - puede estar vacío
-                
-                # MODALIDAD AMANECIDA
-                has_amanecida = False
-                if pd.notna(row.get('Tiene Amanecida')):
-                    has_amanecida = str(row.get('Tiene Amanecida', 'NO')).strip().upper() in ['SI', 'SÍ', 'YES', 'TRUE', '1']
-                
-                amanecida_prices = parse_prices_from_excel(row.get('Precios Amanecida', '')) if has_amanecida else []
-                
-                # MODALIDAD EVENTO
-                has_evento = False
-                if pd.notna(row.get('Tiene Evento')):
-                    has_evento = str(row.get('Tiene Evento', 'NO')).strip().upper() in ['SI', 'SÍ', 'YES', 'TRUE', '1']
-                
-                evento_prices = parse_prices_from_excel(row.get('Precios Evento', '')) if has_evento else []
-                
-                # Preparar datos con el esquema actualizado
-                villa_data = {
-                    'id': str(uuid.uuid4()),
-                    'code': code,
-                    'name': name,
-                    'category_id': category_id,
-                    
-                    # MODALIDAD PASADÍA
-                    'has_pasadia': has_pasadia,
-                    'description_pasadia': str(row.get('Descripción Pasadía', '')).strip() if pd.notna(row.get('Descripción Pasadía')) else '',
-                    'pasadia_prices': pasadia_prices,
-                    'pasadia_currency': str(row.get('Moneda Pasadía', 'DOP')).strip() if pd.notna(row.get('Moneda Pasadía')) else 'DOP',
-                    'default_check_in_time_pasadia': str(row.get('Check-in Pasadía', '9:00 AM')).strip() if pd.notna(row.get('Check-in Pasadía')) else '9:00 AM',
-                    'default_check_out_time_pasadia': str(row.get('Check-out Pasadía', '8:00 PM')).strip() if pd.notna(row.get('Check-out Pasadía')) else '8:00 PM',
-                    
-                    # MODALIDAD AMANECIDA
-                    'has_amanecida': has_amanecida,
-                    'description_amanecida': str(row.get('Descripción Amanecida', '')).strip() if pd.notna(row.get('Descripción Amanecida')) else '',
-                    'amanecida_prices': amanecida_prices,
-                    'amanecida_currency': str(row.get('Moneda Amanecida', 'DOP')).strip() if pd.notna(row.get('Moneda Amanecida')) else 'DOP',
-                    'default_check_in_time_amanecida': str(row.get('Check-in Amanecida', '9:00 AM')).strip() if pd.notna(row.get('Check-in Amanecida')) else '9:00 AM',
-                    'default_check_out_time_amanecida': str(row.get('Check-out Amanecida', '8:00 AM')).strip() if pd.notna(row.get('Check-out Amanecida')) else '8:00 AM',
-                    
-                    # MODALIDAD EVENTO
-                    'has_evento': has_evento,
-                    'description_evento': str(row.get('Descripción Evento', '')).strip() if pd.notna(row.get('Descripción Evento')) else '',
-                    'evento_prices': evento_prices,
-                    'evento_currency': str(row.get('Moneda Evento', 'DOP')).strip() if pd.notna(row.get('Moneda Evento')) else 'DOP',
-                    'default_check_in_time_evento': str(row.get('Check-in Evento', '9:00 AM')).strip() if pd.notna(row.get('Check-in Evento')) else '9:00 AM',
-                    'default_check_out_time_evento': str(row.get('Check-out Evento', '8:00 PM')).strip() if pd.notna(row.get('Check-out Evento')) else '8:00 PM',
-                    
-                    # Campos generales
-                    'max_guests': 0,
-                    'amenities': [],
-                    'is_active': True,
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'created_by': 'import_system'
-                }
-                
-                # Verificar si ya existe
-                existing = await db.villas.find_one({'code': villa_data['code']})
-                
-                if existing:
-                    await db.villas.update_one(
-                        {'code': villa_data['code']},
-                        {'$set': villa_data}
-                    )
-                    updated += 1
-                else:
-                    await db.villas.insert_one(villa_data)
-                    created += 1
-                    
-            except Exception as e:
-                errors.append(f"Fila {idx+2}: {str(e)}")
-        
-        return {
-            'created': created,
-            'updated': updated,
-            'errors': errors,
-            'total': len(df)
-        }
-        
-    except Exception as e:
-        return {
-            'created': 0,
-            'updated': 0,
-            'errors': [f"Error al procesar archivo: {str(e)}"],
-            'total': 0
+    return await _import_file(file_content, 'Villas', import_villas_frame, db, dry_run)
+
+async def import_villas_frame(df: pd.DataFrame, db, dry_run: bool = False) -> Dict:
+    valid, report = validate_villas(df)
+    if dry_run:
+        return report.summary(valid)
+
+    errors = report.errors
+    writer = BulkWriter(db.villas, errors)
+    # Una categoría inexistente deja la villa sin categoría
+    categories = await load_lookup(db.categories, 'name', set(valid['category_name']) - {''}, {'_id': 0, 'id': 1, 'name': 1})
+
+    for record in valid.to_dict('records'):
+        row = record.pop('_row')
+        category = categories.get(record.pop('category_name'))
+        villa_data = {
+            'id': str(uuid.uuid4()),
+            **record,
+            'category_id': category['id'] if category else None,
+
+            # Campos generales
+            'max_guests': 0,
+            'amenities': [],
+            'is_active': True,
+            'created_at': datetime.now(timezone.utc),
+            'created_by': 'import_system'
         }
+        # Actualizar si ya existe, si no crear
+        await writer.upsert(row, {'code': villa_data['code']}, villa_data)
 
-async def import_services(file_content: bytes, db) -> Dict:
+    await writer.flush()
+    return {
+        'created': writer.created,
+        'updated': writer.updated,
+        'errors': errors,
+        'total': len(df)
+    }
+
+async def import_services(file_content: bytes, db, dry_run: bool = False) -> Dict:
     """Importa servicios extra desde Excel"""
-    try:
-        df = pd.read_excel(BytesIO(file_content), sheet_name='Servicios Extra')
-        
-        created = 0
-        updated = 0
-        errors = []
-        skipped_examples = 0
-        skipped_empty = 0
-        
-        for idx, row in df.iterrows():
-            try:
-                # Validar campos obligatorios
-                name = str(row.get('Nombre Servicio *', '')).strip()
-                price = row.get('Precio *')
-                
-                # Saltar filas completamente vacías
-                if not name or name.lower() in ['nan', '']:
-                    skipped_empty += 1
-                    continue
-                    
-                if pd.isna(price) or price == '':
-                    skipped_empty += 1
-                    continue
-                
-                # SKIP EJEMPLOS del template (pero NO DJ que puede ser servicio real)
-                if name in ['Chef privado', 'Decoración']:
-                    skipped_examples += 1
-                    continue
-                
-                # Preparar datos
-                price_float = float(price)
-                
-                # Debug logging
-                print(f"Importando servicio: {name}, Precio del Excel: {price}, Precio convertido: {price_float}")
-                
-                service_data = {
-                    'id': str(uuid.uuid4()),
-                    'name': name,
-                    'default_price': price_float,
-                    'description': str(row.get('Descripción', '')).strip() if pd.notna(row.get('Descripción')) else '',
-                    'is_active': True,
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'created_by': 'import_system'
-                }
-                
-                # Verificar si ya existe (por nombre - case insensitive)
-                existing = await db.extra_services.find_one({'name': {'$regex': f'^{name}$', '$options': 'i'}})
-                
-                if existing:
-                    existing_price = existing.get('default_price', 0)
-                    print(f"  → Servicio existe: precio actual={existing_price}, nuevo precio={price_float}")
-                    
-                    # SIEMPRE actualizar el precio del Excel (no comparar)
-                    await db.extra_services.update_one(
-                        {'id': existing['id']},
-                        {'$set': {
-                            'default_price': price_float, 
-                            'description': service_data['description'], 
-                            'is_active': True
-                        }}
-                    )
-                    updated += 1
-                    print(f"  → ACTUALIZADO: {name} de {existing_price} a {price_float}")
-                else:
-                    await db.extra_services.insert_one(service_data)
-                    created += 1
-                    print(f"  → CREADO: {name} con precio {price_float}")
-                    
-            except Exception as e:
-                errors.append(f"Fila {idx+2}: {str(e)}")
-        
-        return {
-            'created': created,
-            'updated': updated,
-            'errors': errors,
-            'total': len(df),
-            'skipped_examples': skipped_examples,
-            'skipped_empty': skipped_empty
-        }
-        
-    except Exception as e:
-        return {
-            'created': 0,
-            'updated': 0,
-            'errors': [f"Error al procesar archivo: {str(e)}"],
-            'total': 0
-        }
+    return await _import_file(file_content, 'Servicios Extra', import_services_frame, db, dry_run)
 
-async def import_expense_categories(file_content: bytes, db) -> Dict:
-    """Importa categorías de gastos desde Excel"""
-    try:
-        df = pd.read_excel(BytesIO(file_content), sheet_name='Categorías Gastos')
-        
-        created = 0
-        updated = 0
-        errors = []
-        
-        for idx, row in df.iterrows():
-            try:
-                # Validar campos obligatorios
-                name = str(row.get('Nombre Categoría *', '')).strip()
-                if not name or name.lower() == 'nan':
-                    errors.append(f"Fila {idx+2}: Nombre es obligatorio")
-                    continue
-                
-                # Preparar datos
-                category_data = {
-                    'id': str(uuid.uuid4()),
-                    'name': name,
-                    'description': str(row.get('Descripción', '')).strip() if pd.notna(row.get('Descripción')) else '',
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'created_by': 'import_system'
-                }
-                
-                # Verificar si ya existe
-                existing = await db.expense_categories.find_one({'name': category_data['name']})
-                
-                if existing:
-                    await db.expense_categories.update_one(
-                        {'name': category_data['name']},
-                        {'$set': category_data}
-                    )
-                    updated += 1
-                else:
-                    await db.expense_categories.insert_one(category_data)
-                    created += 1
-                    
-            except Exception as e:
-                errors.append(f"Fila {idx+2}: {str(e)}")
-        
-        return {
-            'created': created,
-            'updated': updated,
-            'errors': errors,
-            'total': len(df)
-        }
-        
-    except Exception as e:
-        return {
-            'created': 0,
-            'updated': 0,
-            'errors': [f"Error al procesar archivo: {str(e)}"],
-            'total': 0
+async def import_services_frame(df: pd.DataFrame, db, dry_run: bool = False) -> Dict:
+    valid, report = validate_services(df)
+    skipped = {'skipped_examples': report.skipped_counts['skipped_examples'], 'skipped_empty': report.skipped_counts['skipped_empty']}
+    if dry_run:
+        return {**report.summary(valid), **skipped}
+
+    errors = report.errors
+    writer = BulkWriter(db.extra_services, errors)
+    # Coincidencia por nombre sin distinguir mayúsculas: el catálogo de servicios es pequeño
+    service_filters = {}
+    async for service in db.extra_services.find({}, {'_id': 0, 'id': 1, 'name': 1}):
+        service_filters.setdefault(str(service.get('name', '')).lower(), {'id': service['id']})
+
+    for record in valid.to_dict('records'):
+        row = record.pop('_row')
+        service_data = {
+            'id': str(uuid.uuid4()),
+            **record,
+            'is_active': True,
+            'created_at': datetime.now(timezone.utc),
+            'created_by': 'import_system'
         }
+        # Si ya existe (por nombre - case insensitive) SIEMPRE se actualiza
+        # el precio del Excel (no comparar); el resto solo al crear
+        query = service_filters.setdefault(record['name'].lower(), {'name': record['name']})
+        await writer.upsert(row, query, service_data, INSERT_ONLY_FIELDS + ('name',))
 
-async def import_reservations(file_content: bytes, db) -> Dict:
+    await writer.flush()
+    return {
+        'created': writer.created,
+        'updated': writer.updated,
+        'errors': errors,
+        'total': len(df),
+        **skipped
+    }
+
+async def import_reservations(file_content: bytes, db, dry_run: bool = False) -> Dict:
     """Importa reservaciones desde Excel"""
-    try:
-        df = pd.read_excel(BytesIO(file_content), sheet_name='Reservaciones')
-        
-        created = 0
-        updated = 0
-        errors = []
-        
-        for idx, row in df.iterrows():
-            try:
-                # Validar campos obligatorios
-                invoice_number = str(row.get('N° Factura *', '')).strip()
-                customer_name = str(row.get('Cliente *', '')).strip()
-                villa_code = str(row.get('Villa *', '')).strip().upper()
-                price = row.get('Precio *')
-                
-                if not invoice_number or invoice_number.lower() == 'nan':
-                    errors.append(f"Fila {idx+2}: N° Factura es obligatorio")
-                    continue
-                if not customer_name or customer_name.lower() == 'nan':
-                    errors.append(f"Fila {idx+2}: Cliente es obligatorio")
-                    continue
-                if not villa_code or villa_code == 'NAN':
-                    errors.append(f"Fila {idx+2}: Villa es obligatoria")
-                    continue
-                if pd.isna(price):
-                    errors.append(f"Fila {idx+2}: Precio es obligatorio")
-                    continue
-                
-                # Buscar cliente
-                customer = await db.customers.find_one({'name': customer_name})
-                if not customer:
-                    errors.append(f"Fila {idx+2}: Cliente '{customer_name}' no encontrado. Debe importar clientes primero.")
-                    continue
-                
-                # Buscar villa
-                villa = await db.villas.find_one({'code': villa_code})
-                if not villa:
-                    errors.append(f"Fila {idx+2}: Villa '{villa_code}' no encontrada. Debe importar villas primero.")
-                    continue
-                
-                # Preparar datos de reservación
-                reservation_date = pd.to_datetime(row.get('Fecha Reservación *')).isoformat() if pd.notna(row.get('Fecha Reservación *')) else datetime.now(timezone.utc).isoformat()
-                
-                reservation_data = {
-                    'id': str(uuid.uuid4()),
-                    'invoice_number': invoice_number,
-                    'reservation_date': reservation_date,
-                    'customer_id': customer['id'],
-                    'customer_name': customer['name'],
-                    'villa_id': villa['id'],
-                    'villa_code': villa['code'],
-                    'rental_type': str(row.get('Tipo Alquiler *', 'pasadia')).strip().lower(),
-                    'checkin_time': str(row.get('Check-in', '08:00')).strip() if pd.notna(row.get('Check-in')) else '08:00',
-                    'checkout_time': str(row.get('Check-out', '18:00')).strip() if pd.notna(row.get('Check-out')) else '18:00',
-                    'num_people': int(row.get('N° Personas', 0)) if pd.notna(row.get('N° Personas')) else 0,
-                    'total_amount': float(price),
-                    'currency': str(row.get('Moneda *', 'DOP')).strip().upper(),
-                    'payment_method': str(row.get('Método Pago *', 'efectivo')).strip().lower(),
-                    'amount_paid': float(row.get('Monto Pagado', 0)) if pd.notna(row.get('Monto Pagado')) else 0,
-                    'deposit': float(row.get('Depósito', 0)) if pd.notna(row.get('Depósito')) else 0,
-                    'include_itbis': str(row.get('Incluir ITBIS', 'NO')).strip().upper() == 'SI',
-                    'notes': str(row.get('Notas', '')).strip() if pd.notna(row.get('Notas')) else '',
-                    'extra_services': [],
-                    'status': 'confirmed',
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'created_by': 'import_system'
-                }
-                
-                # Calcular balance_due
-                reservation_data['balance_due'] = reservation_data['total_amount'] + reservation_data['deposit'] - reservation_data['amount_paid']
-                
-                # Verificar si ya existe (por número de factura)
-                existing = await db.reservations.find_one({'invoice_number': invoice_number})
-                
-                if existing:
-                    await db.reservations.update_one(
-                        {'invoice_number': invoice_number},
-                        {'$set': reservation_data}
-                    )
-                    updated += 1
-                else:
-                    await db.reservations.insert_one(reservation_data)
-                    created += 1
-                    
-            except Exception as e:
-                errors.append(f"Fila {idx+2}: {str(e)}")
-        
-        return {
-            'created': created,
-            'updated': updated,
-            'errors': errors,
-            'total': len(df)
-        }
-        
-    except Exception as e:
-        return {
-            'created': 0,
-            'updated': 0,
-            'errors': [f"Error al procesar archivo: {str(e)}"],
-            'total': 0
+    return await _import_file(file_content, 'Reservaciones', import_reservations_frame, db, dry_run)
+
+async def import_reservations_frame(df: pd.DataFrame, db, dry_run: bool = False) -> Dict:
+    valid, report = validate_reservations(df)
+
+    # Referencias precargadas: una consulta por colección (también en dry_run)
+    customers = await load_lookup(db.customers, 'name', set(valid['customer_name']), {'_id': 0, 'id': 1, 'name': 1})
+    villas = await load_lookup(db.villas, 'code', set(valid['villa_code']), {'_id': 0, 'id': 1, 'code': 1})
+    report.reject(
+        ~valid['customer_name'].isin(set(customers)).reindex(df.index, fill_value=True),
+        "Cliente '" + _text(df, 'Cliente *') + "' no encontrado. Debe importar clientes primero."
+    )
+    report.reject(
+        ~valid['villa_code'].isin(set(villas)).reindex(df.index, fill_value=True),
+        "Villa '" + _text(df, 'Villa *').str.upper() + "' no encontrada. Debe importar villas primero."
+    )
+    valid = valid[report.pending.loc[valid.index]]
+    if dry_run:
+        return report.summary(valid)
+
+    errors = report.errors
+    writer = BulkWriter(db.reservations, errors)
+    new_invoices = {}
+    existing_invoices = set(await load_lookup(
+        db.reservations, 'invoice_number', set(valid['invoice_number']), {'_id': 0, 'invoice_number': 1}
+    ))
+
+    for record in valid.to_dict('records'):
+        row = record.pop('_row')
+        customer = customers[record['customer_name']]
+        villa = villas[record['villa_code']]
+        reservation_data = {
+            'id': str(uuid.uuid4()),
+            **record,
+            'customer_id': customer['id'],
+            'customer_name': customer['name'],
+            'villa_id': villa['id'],
+            'villa_code': villa['code'],
+            'extra_services': [],
+            'status': 'confirmed',
+            'created_at': datetime.now(timezone.utc),
+            'created_by': 'import_system'
         }
+
+        # Actualizar si ya existe (por número de factura), si no crear
+        invoice_number = reservation_data['invoice_number']
+        if invoice_number not in existing_invoices:
+            existing_invoices.add(invoice_number)
+            new_invoices[row] = (invoice_number, 'reservation', reservation_data['id'])
+        await writer.upsert(row, {'invoice_number': invoice_number}, reservation_data)
+
+    await writer.flush()
+
+    # Registrar los números de factura importados para que no se reasignen
+    await register_invoice_numbers(db, [
+        invoice for row, invoice in new_invoices.items() if row not in writer.failed_rows
+    ])
+
+    return {
+        'created': writer.created,
+        'updated': writer.updated,
+        'errors': errors,
+        'total': len(df)
+    }
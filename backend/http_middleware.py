@@ -0,0 +1,233 @@
+"""
+Middlewares HTTP
+- ConditionalGetMiddleware: ETag a partir de las versiones de las
+  colecciones que lee cada ruta (las de este proceso y las compartidas en
+  MongoDB, una consulta) y de un intervalo de ETAG_TTL_SECONDS;
+  If-None-Match responde 304 sin ejecutar el endpoint.
+- CompressionMiddleware: brotli (si está instalado) o gzip para
+  respuestas por encima de un tamaño mínimo.
+Ambos son ASGI puros para no romper las respuestas en streaming.
+"""
+import hashlib
+import logging
+import time
+import zlib
+from typing import Dict, List, Optional
+from pymongo.errors import PyMongoError
+from starlette.datastructures import Headers, MutableHeaders
+from collection_versions import collection_versions, PROCESS_EPOCH
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se usa gzip
+    brotli = None
+
+# Prefijo de ruta -> colecciones de las que depende la respuesta.
+# Rutas que dependen de la hora (dashboard) o sin entrada aquí no usan ETag.
+ROUTE_COLLECTIONS: Dict[str, List[str]] = {
+    "/api/reservations": ["reservations", "reservation_abonos", "customers", "expenses"],
+    "/api/expenses": ["expenses", "expense_abonos", "reservations"],
+    "/api/villas": ["villas", "categories"],
+    "/api/customers": ["customers"],
+    "/api/categories": ["categories"],
+    "/api/expense-categories": ["expense_categories"],
+    "/api/extra-services": ["extra_services"],
+    "/api/quotations": ["quotations"],
+    "/api/conduces": ["conduces"],
+    "/api/owners": ["villa_owners", "owner_payments"],
+    "/api/commissions": ["commissions"],
+    "/api/config/logo": ["logo_config"],
+    "/api/public/villas": ["villas", "categories"],
+    "/api/cms/content": ["website_content"],
+    "/api/cms/images": ["website_images"],
+    "/api/cms/services": ["public_services"],
+    "/api/cms/chatbot": ["chatbot_questions"],
+    "/api/cms/quotations": ["client_quotations"],
+}
+
+PUBLIC_PREFIXES = ("/api/public/", "/api/cms/")
+
+# Un ETag vence aunque nadie registre el cambio (ediciones manuales en la base)
+ETAG_TTL_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+# Tipos que ya vienen comprimidos
+INCOMPRESSIBLE_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip", "application/x-gzip")
+
+
+def _route_collections(path: str) -> Optional[List[str]]:
+    for prefix in sorted(ROUTE_COLLECTIONS, key=len, reverse=True):
+        if path == prefix or path.startswith(prefix + "/"):
+            return ROUTE_COLLECTIONS[prefix]
+    return None
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Comparación débil (RFC 9110): se ignora el prefijo W/"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+class ConditionalGetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        collections = _route_collections(path)
+        if collections is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        is_public = path.startswith(PUBLIC_PREFIXES)
+        # Las rutas privadas dependen del usuario: el token forma parte del ETag
+        identity = "" if is_public else headers.get("authorization", "")
+        # Versiones tomadas ANTES de leer: una escritura concurrente cambia el ETag siguiente
+        try:
+            shared = await collection_versions.shared_snapshot(collections)
+        except PyMongoError as e:
+            logger.warning(f"⚠️ Sin versiones compartidas, respuesta sin ETag: {e}")
+            await self.app(scope, receive, send)
+            return
+        versions = (collection_versions.snapshot(collections), shared, int(time.time() // ETAG_TTL_SECONDS))
+        digest = hashlib.blake2b(
+            f"{path}?{scope.get('query_string', b'').decode()}|{identity}|{versions}".encode(),
+            digest_size=12
+        ).hexdigest()
+        etag = f'W/"{PROCESS_EPOCH}-{digest}"'
+        cache_headers = {
+            "etag": etag,
+            "cache-control": "public, no-cache" if is_public else "private, no-cache",
+        }
+        if not is_public:
+            cache_headers["vary"] = "Authorization"
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(k.encode(), v.encode()) for k, v in cache_headers.items()],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                response_headers = MutableHeaders(scope=message)
+                if "etag" not in response_headers:
+                    for key, value in cache_headers.items():
+                        if key == "vary":
+                            response_headers.add_vary_header(value)
+                        else:
+                            response_headers[key] = value
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+def _choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=level)
+        else:
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = formato gzip
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """
+    Comprime respuestas >= minimum_size. Las respuestas que ya traen
+    Content-Encoding o son binarias ya comprimidas se envían igual.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = _choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[dict] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = "content-encoding" in headers or content_type.startswith(INCOMPRESSIBLE_TYPES)
+                if passthrough:
+                    await send(message)
+                else:
+                    # Se decide al ver el primer bloque del cuerpo
+                    start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding, self.levels[encoding])
+                headers = MutableHeaders(raw=start_message["headers"])
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "content-length" in headers:
+                    del headers["content-length"]
+                if not more_body:
+                    data = compressor.compress(body) + compressor.finish()
+                    headers["content-length"] = str(len(data))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": data})
+                    return
+                await send(start_message)
+
+            data = compressor.compress(body)
+            if not more_body:
+                data += compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
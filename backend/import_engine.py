@@ -0,0 +1,115 @@
+"""
+Motor de escritura por lotes para las importaciones desde Excel
+- load_lookup: precarga en un diccionario las entidades referenciadas
+  (clientes, villas, categorías...) con una sola consulta por colección,
+  en lugar de un find_one por fila.
+- BulkWriter: acumula UpdateOne(upsert=True)/InsertOne y los envía con
+  bulk_write(ordered=False) en lotes; los contadores de creados/actualizados
+  salen del resultado y los errores se asignan a su fila del Excel.
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+import pandas as pd
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from motor.motor_asyncio import AsyncIOMotorCollection
+from database import prepare_doc_for_insert
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 500
+# Un lote de $in por consulta de precarga
+LOOKUP_BATCH_SIZE = 1000
+# Campos que una actualización no debe pisar: el id sigue siendo el del
+# documento existente (otras colecciones lo referencian)
+INSERT_ONLY_FIELDS = ("id", "created_at", "created_by")
+
+
+async def load_lookup(
+    collection: AsyncIOMotorCollection,
+    field: str,
+    values: Iterable[Any],
+    projection: Optional[dict] = None,
+    key: Optional[Callable[[Any], Any]] = None
+) -> Dict[Any, dict]:
+    """
+    {valor: documento} de los documentos cuyo field está en values.
+    Con varios documentos para el mismo valor gana el primero, igual que find_one.
+    """
+    key = key or (lambda value: value)
+    pending = list(dict.fromkeys(value for value in values if value is not None))
+    lookup: Dict[Any, dict] = {}
+    for start in range(0, len(pending), LOOKUP_BATCH_SIZE):
+        query = {field: {"$in": pending[start:start + LOOKUP_BATCH_SIZE]}}
+        async for document in collection.find(query, projection or {"_id": 0}):
+            lookup.setdefault(key(document.get(field)), document)
+    return lookup
+
+
+def sheet_values(df: pd.DataFrame, column: str, normalize: Callable[[str], str] = str.strip) -> Set[str]:
+    """Valores distintos (no vacíos) de una columna, normalizados como en la importación"""
+    if column not in df.columns:
+        return set()
+    return {normalize(str(value)) for value in df[column].dropna()}
+
+
+def upsert_operation(query: dict, document: dict, insert_only: Iterable[str] = INSERT_ONLY_FIELDS) -> UpdateOne:
+    """
+    UpdateOne(upsert=True) equivalente a "actualizar si existe, si no insertar":
+    los campos de insert_only solo se escriben al crear el documento
+    """
+    prepared = prepare_doc_for_insert(document)
+    on_insert = {field: prepared.pop(field) for field in insert_only if field in prepared}
+    update = {"$set": prepared}
+    if on_insert:
+        update["$setOnInsert"] = on_insert
+    return UpdateOne(query, update, upsert=True)
+
+
+class BulkWriter:
+    """
+    Acumula operaciones de una colección y las envía en lotes desordenados.
+    Los errores se agregan a errors como "Fila N: ..." y la fila queda en failed_rows.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, errors: List[str], batch_size: int = IMPORT_BATCH_SIZE):
+        self.collection = collection
+        self.errors = errors
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.failed_rows: Set[int] = set()
+        self._operations: List[Any] = []
+        self._rows: List[int] = []
+
+    async def upsert(self, row: int, query: dict, document: dict, insert_only: Iterable[str] = INSERT_ONLY_FIELDS):
+        await self.add(row, upsert_operation(query, document, insert_only))
+
+    async def insert(self, row: int, document: dict):
+        await self.add(row, InsertOne(prepare_doc_for_insert(document)))
+
+    async def add(self, row: int, operation):
+        self._operations.append(operation)
+        self._rows.append(row)
+        if len(self._operations) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self._operations:
+            return
+        operations, rows = self._operations, self._rows
+        self._operations, self._rows = [], []
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+            self.created += result.inserted_count + result.upserted_count
+            self.updated += result.matched_count
+        except BulkWriteError as e:
+            # ordered=False: el resto del lote se escribió igual
+            details = e.details
+            self.created += details.get("nInserted", 0) + details.get("nUpserted", 0)
+            self.updated += details.get("nMatched", 0)
+            for error in details.get("writeErrors", []):
+                row = rows[error["index"]]
+                self.failed_rows.add(row)
+                self.errors.append(f"Fila {row}: {error.get('errmsg', 'Error de escritura')}")
+            logger.warning(f"⚠️ {len(details.get('writeErrors', []))} errores de escritura en {self.collection.name}")
@@ -0,0 +1,348 @@
+"""
+Importaciones en segundo plano
+Los endpoints de importación guardan el archivo en GridFS (bucket
+import_uploads), crean un documento en import_jobs y responden de inmediato
+con su id. Un pool acotado de workers procesa cada trabajo por bloques de
+filas: después de cada bloque se guardan los contadores y un punto de
+control, que GET /api/import/jobs/{id} muestra como avance.
+Al iniciar, los trabajos que quedaron en cola o a medias (reinicio del
+servidor) se retoman desde su último punto de control.
+
+Variables de entorno:
+    IMPORT_WORKERS   trabajos que se procesan a la vez (por defecto 2)
+"""
+import asyncio
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import pandas as pd
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+import import_service
+import hierarchical_import_service as hierarchical
+from dashboard_service import rebuild_dashboard_rollups
+from search_service import backfill_search_keys
+from catalog_service import invalidate_public_catalog
+from workbook_reader import read_workbook
+
+logger = logging.getLogger(__name__)
+
+IMPORT_JOBS_COLLECTION = "import_jobs"
+UPLOADS_BUCKET = "import_uploads"
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", "2"))
+# Filas por bloque: cada bloque es un punto de control
+IMPORT_CHUNK_ROWS = 500
+# Un trabajo que tumba el proceso no se reintenta indefinidamente
+MAX_JOB_ATTEMPTS = 3
+MAX_JOB_ERRORS = 1000
+JOB_RETENTION_DAYS = 30
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+IMPORT_JOB_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    # Los trabajos terminados se borran solos (solo los que tienen finished_at)
+    IndexModel([("finished_at", ASCENDING)], name="finished_at_ttl", expireAfterSeconds=JOB_RETENTION_DAYS * 24 * 3600),
+]
+
+
+# ============ TIPOS DE IMPORTACIÓN ============
+
+# (df, db) y, si el paso lo pide, job_id
+ImportFrame = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class ImportStep:
+    """Una hoja del archivo y la función que importa un bloque de sus filas"""
+    key: str
+    sheet: str
+    run: ImportFrame
+    # Archivo completo (/import/excel): las hojas son opcionales y traen una fila de ejemplo
+    optional: bool = False
+    skiprows: Optional[List[int]] = None
+    example: Optional[Tuple[str, str]] = None
+    # La hoja no tiene clave natural: run recibe job_id para que un bloque retomado no duplique filas
+    keyed_by_job: bool = False
+
+
+@dataclass(frozen=True)
+class ImportKind:
+    title: str
+    steps: List[ImportStep]
+    finalize: List[Callable[[AsyncIOMotorDatabase], Awaitable[Any]]] = field(default_factory=list)
+
+
+def _legacy_step(importer) -> ImportFrame:
+    """Adapta las funciones de import_service, que devuelven tuplas"""
+    async def run(df: pd.DataFrame, db: AsyncIOMotorDatabase, **context) -> Dict[str, Any]:
+        *counts, errors = await importer(df, db, **context)
+        return {**dict(zip(["created", "updated", "expenses_created"], counts)), "errors": errors}
+    return run
+
+
+async def _refresh_search_keys(db: AsyncIOMotorDatabase):
+    await backfill_search_keys(db, only_missing=False)
+
+
+async def _invalidate_catalog(db: AsyncIOMotorDatabase):
+    invalidate_public_catalog()
+
+
+IMPORT_KINDS: Dict[str, ImportKind] = {
+    "excel": ImportKind(
+        title="Excel completo",
+        steps=[
+            ImportStep("customers", "👥 Clientes", _legacy_step(import_service.import_customers),
+                       optional=True, skiprows=[1], example=("Nombre Completo*", "Juan Pérez")),
+            ImportStep("villas", "🏠 Villas", _legacy_step(import_service.import_villas),
+                       optional=True, skiprows=[1], example=("Código Villa*", "ECPVSH")),
+            # Crea también los gastos automáticos del propietario (OPCIÓN A)
+            ImportStep("reservations", "🎫 Reservaciones", _legacy_step(import_service.import_reservations),
+                       optional=True, skiprows=[1], example=("Número Factura*", "5815")),
+            ImportStep("expenses", "💰 Gastos", _legacy_step(import_service.import_expenses),
+                       optional=True, skiprows=[1], example=("Descripción*", "Pago de luz"), keyed_by_job=True),
+        ],
+        # Las importaciones escriben en bloque: recalcular el dashboard completo
+        finalize=[rebuild_dashboard_rollups, _refresh_search_keys, _invalidate_catalog],
+    ),
+    "customers": ImportKind(
+        "Clientes", [ImportStep("customers", "Clientes", hierarchical.import_customers_frame)],
+        [_refresh_search_keys],
+    ),
+    "villa-categories": ImportKind(
+        "Categorías de Villas", [ImportStep("villa-categories", "Categorías", hierarchical.import_villa_categories_frame)],
+        [_invalidate_catalog],
+    ),
+    "villas": ImportKind(
+        "Villas", [ImportStep("villas", "Villas", hierarchical.import_villas_frame)],
+        [_refresh_search_keys, _invalidate_catalog],
+    ),
+    "services": ImportKind(
+        "Servicios Extra", [ImportStep("services", "Servicios Extra", hierarchical.import_services_frame)],
+    ),
+    "expense-categories": ImportKind(
+        "Categorías de Gastos", [ImportStep("expense-categories", "Categorías Gastos", hierarchical.import_expense_categories_frame)],
+    ),
+    "reservations": ImportKind(
+        "Reservaciones", [ImportStep("reservations", "Reservaciones", hierarchical.import_reservations_frame)],
+        [rebuild_dashboard_rollups],
+    ),
+}
+
+
+async def read_job_sheets(content: bytes, kind: ImportKind) -> Dict[str, pd.DataFrame]:
+    """Lee todas las hojas del trabajo en una sola pasada (pool de procesos)"""
+    sheets = await read_workbook(content, [(step.sheet, step.skiprows, step.optional) for step in kind.steps])
+    frames = {}
+    for step in kind.steps:
+        df = sheets[step.sheet]
+        if df is None:
+            continue
+        if step.example:
+            column, text = step.example
+            if column in df.columns:
+                df = df[~df[column].astype(str).str.contains(text, na=False)]
+        frames[step.key] = df
+    return frames
+
+
+def build_summary(kind_name: str, results: Dict[str, Dict[str, Any]]) -> str:
+    """Mismo resumen que devolvían los endpoints síncronos"""
+    if kind_name == "excel":
+        counts = {key: results.get(key, {}) for key in ("customers", "villas", "reservations", "expenses")}
+        return f"""
+✅ IMPORTACIÓN COMPLETADA
+
+👥 Clientes: {counts['customers'].get('created', 0)} creados, {counts['customers'].get('updated', 0)} actualizados
+🏠 Villas: {counts['villas'].get('created', 0)} creadas, {counts['villas'].get('updated', 0)} actualizadas
+🎫 Reservaciones: {counts['reservations'].get('created', 0)} creadas, {counts['reservations'].get('updated', 0)} actualizadas
+💰 Gastos Propietario: {counts['reservations'].get('expenses_created', 0)} creados automáticamente
+💰 Gastos Adicionales: {counts['expenses'].get('created', 0)} creados
+
+Total errores: {sum(len(r.get('errors', [])) for r in results.values())}
+        """
+    result = next(iter(results.values()), {})
+    errors = result.get("errors", [])
+    return f"""✅ Importación de {IMPORT_KINDS[kind_name].title} completada:
+
+📊 Total procesado: {result.get('total', 0)} filas
+✅ Creados: {result.get('created', 0)}
+🔄 Actualizados: {result.get('updated', 0)}
+❌ Errores: {len(errors)}
+
+{chr(10).join(errors[:10]) if errors else ''}
+"""
+
+
+# ============ TRABAJOS ============
+
+class ImportJobRunner:
+    def __init__(self, workers: int = IMPORT_WORKERS):
+        self.workers = max(workers, 1)
+        self.queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, db: AsyncIOMotorDatabase):
+        if self._tasks:
+            return
+        self.queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker(db)) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._resume(db)))
+        logger.info(f"📥 Importaciones en segundo plano: {self.workers} workers")
+
+    async def stop(self):
+        # Los trabajos en curso quedan en "running" y se retoman al iniciar
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks = []
+
+    async def submit(self, db: AsyncIOMotorDatabase, kind: str, filename: str, content: bytes, user: dict) -> Dict[str, Any]:
+        """Guarda el archivo y encola el trabajo"""
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f"Tipo de importación inválido: {kind}")
+        job_id = str(uuid.uuid4())
+        bucket = AsyncIOMotorGridFSBucket(db, bucket_name=UPLOADS_BUCKET)
+        file_id = await bucket.upload_from_stream(filename, content, metadata={"job_id": job_id})
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "filename": filename,
+            "file_id": str(file_id),
+            "status": QUEUED,
+            "created_by": user.get("username"),
+            "created_at": datetime.now(timezone.utc),
+            "started_at": None,
+            "finished_at": None,
+            "attempts": 0,
+            "progress": {"processed_rows": 0, "total_rows": None},
+            "checkpoint": {"step": 0, "row": 0},
+            "results": {},
+            "summary": None,
+            "error": None,
+        }
+        await db[IMPORT_JOBS_COLLECTION].insert_one(job)
+        job.pop("_id", None)
+        if self.queue is not None:
+            self.queue.put_nowait(job_id)
+        return job
+
+    async def _resume(self, db: AsyncIOMotorDatabase):
+        jobs = db[IMPORT_JOBS_COLLECTION]
+        await jobs.update_many(
+            {"status": RUNNING, "attempts": {"$gte": MAX_JOB_ATTEMPTS}},
+            {"$set": {"status": FAILED, "error": "Interrumpido demasiadas veces", "finished_at": datetime.now(timezone.utc)}}
+        )
+        await jobs.update_many({"status": RUNNING}, {"$set": {"status": QUEUED}})
+        pending = await jobs.find({"status": QUEUED}, {"_id": 0, "id": 1}).sort("created_at", ASCENDING).to_list(None)
+        for job in pending:
+            self.queue.put_nowait(job["id"])
+        if pending:
+            logger.info(f"📥 {len(pending)} importaciones pendientes retomadas")
+
+    async def _worker(self, db: AsyncIOMotorDatabase):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(db, job_id)
+            except Exception as e:
+                logger.error(f"❌ Importación {job_id} falló: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, db: AsyncIOMotorDatabase, job_id: str):
+        jobs = db[IMPORT_JOBS_COLLECTION]
+        # Reclamar el trabajo: otro worker (o una entrada repetida en la cola) no lo toma
+        job = await jobs.find_one_and_update(
+            {"id": job_id, "status": QUEUED},
+            {"$set": {"status": RUNNING, "started_at": datetime.now(timezone.utc)}, "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            return
+        kind_name = job["kind"]
+        kind = IMPORT_KINDS[kind_name]
+        bucket = AsyncIOMotorGridFSBucket(db, bucket_name=UPLOADS_BUCKET)
+        try:
+            grid_out = await bucket.open_download_stream(ObjectId(job["file_id"]))
+            content = await grid_out.read()
+            frames = await read_job_sheets(content, kind)
+            await jobs.update_one(
+                {"id": job_id},
+                {"$set": {"progress.total_rows": sum(len(df) for df in frames.values())}}
+            )
+
+            checkpoint = job["checkpoint"]
+            for step_index, step in enumerate(kind.steps):
+                if step_index < checkpoint["step"] or step.key not in frames:
+                    continue
+                df = frames[step.key]
+                context = {"job_id": job_id} if step.keyed_by_job else {}
+                start = checkpoint["row"] if step_index == checkpoint["step"] else 0
+                await jobs.update_one({"id": job_id}, {"$set": {f"results.{step.key}.total": len(df)}})
+                for offset in range(start, len(df), IMPORT_CHUNK_ROWS):
+                    chunk = df.iloc[offset:offset + IMPORT_CHUNK_ROWS]
+                    result = await step.run(chunk, db, **context)
+                    await self._save_chunk(db, job_id, step, result, len(chunk), {"step": step_index, "row": offset + len(chunk)})
+                await jobs.update_one({"id": job_id}, {"$set": {"checkpoint": {"step": step_index + 1, "row": 0}}})
+
+            for finalize in kind.finalize:
+                await finalize(db)
+
+            saved = await jobs.find_one({"id": job_id}, {"_id": 0, "results": 1})
+            await jobs.update_one({"id": job_id}, {"$set": {
+                "status": COMPLETED,
+                "summary": build_summary(kind_name, saved.get("results", {})),
+                "finished_at": datetime.now(timezone.utc),
+            }})
+            logger.info(f"📥 Importación {job_id} ({kind.title}) completada")
+        except asyncio.CancelledError:
+            # Apagado: el trabajo sigue en "running" y se retoma desde el punto de control
+            raise
+        except Exception as e:
+            logger.error(f"❌ Importación {job_id} ({kind.title}) falló: {e}")
+            await jobs.update_one({"id": job_id}, {"$set": {
+                "status": FAILED,
+                "error": f"Error al procesar archivo: {str(e)}",
+                "finished_at": datetime.now(timezone.utc),
+            }})
+        # Completado o fallido: el archivo ya no hace falta
+        try:
+            await bucket.delete(ObjectId(job["file_id"]))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo borrar el archivo de la importación {job_id}: {e}")
+
+    async def _save_chunk(self, db: AsyncIOMotorDatabase, job_id: str, step: ImportStep,
+                          result: Dict[str, Any], rows: int, checkpoint: Dict[str, int]):
+        """Contadores del bloque y punto de control en una sola escritura"""
+        counters = {
+            f"results.{step.key}.{name}": value
+            for name, value in result.items()
+            if name != "total" and isinstance(value, int) and not isinstance(value, bool)
+        }
+        counters["progress.processed_rows"] = rows
+        update = {"$inc": counters, "$set": {"checkpoint": checkpoint}}
+        if result.get("errors"):
+            update["$push"] = {f"results.{step.key}.errors": {"$each": result["errors"], "$slice": MAX_JOB_ERRORS}}
+        await db[IMPORT_JOBS_COLLECTION].update_one({"id": job_id}, update)
+
+
+async def get_import_job(db: AsyncIOMotorDatabase, job_id: str) -> Optional[Dict[str, Any]]:
+    return await db[IMPORT_JOBS_COLLECTION].find_one({"id": job_id}, {"_id": 0, "file_id": 0})
+
+
+import_job_runner = ImportJobRunner()
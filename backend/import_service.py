@@ -2,20 +2,21 @@
 Servicio de Importación de Datos desde Excel
 Procesa archivos Excel y los guarda en la base de datos
 """
-from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
 import pandas as pd
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import uuid
+from invoice_service import register_invoice_numbers
+from import_engine import BulkWriter, load_lookup, sheet_values
 
 async def import_customers(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[int, int, List[str]]:
     """
     Importa clientes desde DataFrame
     Returns: (creados, actualizados, errores)
     """
-    created = 0
-    updated = 0
     errors = []
+    writer = BulkWriter(db.customers, errors)
     
     for idx, row in df.iterrows():
         try:
@@ -33,25 +34,14 @@ async def import_customers(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[
                 'address': str(row.get('Dirección', '')).strip() if not pd.isna(row.get('Dirección')) else ''
             }
             
-            # Buscar si ya existe por teléfono
-            existing = await db.customers.find_one({'phone': customer_data['phone']})
-            
-            if existing:
-                # Actualizar existente
-                await db.customers.update_one(
-                    {'id': existing['id']},
-                    {'$set': customer_data}
-                )
-                updated += 1
-            else:
-                # Crear nuevo
-                await db.customers.insert_one(customer_data)
-                created += 1
+            # Actualizar si ya existe por teléfono, si no crear
+            await writer.upsert(idx + 2, {'phone': customer_data['phone']}, customer_data)
                 
         except Exception as e:
             errors.append(f"Fila {idx + 2}: {str(e)}")
     
-    return created, updated, errors
+    await writer.flush()
+    return writer.created, writer.updated, errors
 
 
 async def import_villas(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[int, int, List[str]]:
@@ -59,9 +49,9 @@ async def import_villas(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[int
     Importa villas desde DataFrame
     Returns: (creadas, actualizadas, errores)
     """
-    created = 0
-    updated = 0
     errors = []
+    writer = BulkWriter(db.villas, errors)
+    categories = await load_lookup(db.categories, 'name', sheet_values(df, 'Categoría'), {'_id': 0, 'id': 1, 'name': 1})
     
     for idx, row in df.iterrows():
         try:
@@ -77,7 +67,7 @@ async def import_villas(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[int
             
             # Buscar categoría por nombre
             category_name = str(row['Categoría']).strip()
-            category = await db.categories.find_one({'name': category_name}, {'_id': 0})
+            category = categories.get(category_name)
             if not category:
                 errors.append(f"Fila {idx + 2}: Categoría '{category_name}' no encontrada. Créala primero.")
                 continue
@@ -110,25 +100,14 @@ async def import_villas(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[int
                 'is_active': str(row['Estado']).strip().lower() == 'activo'
             }
             
-            # Buscar si ya existe por código
-            existing = await db.villas.find_one({'code': villa_data['code']})
-            
-            if existing:
-                # Actualizar existente
-                await db.villas.update_one(
-                    {'id': existing['id']},
-                    {'$set': villa_data}
-                )
-                updated += 1
-            else:
-                # Crear nueva
-                await db.villas.insert_one(villa_data)
-                created += 1
+            # Actualizar si ya existe por código, si no crear
+            await writer.upsert(idx + 2, {'code': villa_data['code']}, villa_data)
                 
         except Exception as e:
             errors.append(f"Fila {idx + 2}: {str(e)}")
     
-    return created, updated, errors
+    await writer.flush()
+    return writer.created, writer.updated, errors
 
 
 async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[int, int, int, List[str]]:
@@ -136,10 +115,29 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
     Importa reservaciones desde DataFrame
     Returns: (reservaciones_creadas, reservaciones_actualizadas, gastos_creados, errores)
     """
-    reservations_created = 0
-    reservations_updated = 0
-    expenses_created = 0
     errors = []
+    reservations_writer = BulkWriter(db.reservations, errors)
+    expenses_writer = BulkWriter(db.expenses, errors)
+    new_invoices = {}
+    pending_expenses = []
+    
+    # Referencias precargadas: una consulta por colección
+    customers = await load_lookup(db.customers, 'name', sheet_values(df, 'Nombre Cliente'), {'_id': 0, 'id': 1, 'name': 1})
+    villas = await load_lookup(
+        db.villas, 'code', sheet_values(df, 'Código Villa', lambda value: value.strip().upper()),
+        {'_id': 0, 'id': 1, 'code': 1, 'name': 1, 'owner_price': 1}
+    )
+    invoice_numbers = set()
+    for value in df['Número Factura'].dropna() if 'Número Factura' in df.columns else []:
+        try:
+            invoice_numbers.add(str(int(value)))
+        except (TypeError, ValueError):
+            pass
+    existing_reservations = await load_lookup(db.reservations, 'invoice_number', invoice_numbers, {'_id': 0, 'id': 1, 'invoice_number': 1})
+    expensed_reservations = set(await load_lookup(
+        db.expenses, 'related_reservation_id', [doc['id'] for doc in existing_reservations.values()],
+        {'_id': 0, 'related_reservation_id': 1}
+    ))
     
     for idx, row in df.iterrows():
         try:
@@ -155,14 +153,14 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
             
             # Buscar cliente por nombre
             customer_name = str(row['Nombre Cliente']).strip()
-            customer = await db.customers.find_one({'name': customer_name}, {'_id': 0})
+            customer = customers.get(customer_name)
             if not customer:
                 errors.append(f"Fila {idx + 2}: Cliente '{customer_name}' no encontrado. Créalo primero en hoja Clientes.")
                 continue
             
             # Buscar villa por código
             villa_code = str(row['Código Villa']).strip().upper()
-            villa = await db.villas.find_one({'code': villa_code}, {'_id': 0})
+            villa = villas.get(villa_code)
             if not villa:
                 errors.append(f"Fila {idx + 2}: Villa '{villa_code}' no encontrada. Créala primero en hoja Villas.")
                 continue
@@ -190,7 +188,7 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
                 'villa_code': villa['code'],
                 'villa_description': villa.get('name', ''),
                 'rental_type': str(row['Tipo Renta']).strip().lower(),
-                'reservation_date': fecha_obj.isoformat(),
+                'reservation_date': fecha_obj.replace(tzinfo=timezone.utc),
                 'check_out_date': fecha_obj.isoformat(),
                 'check_in_time': str(row.get('Hora Check-In', '9:00 AM')).strip(),
                 'check_out_time': str(row.get('Hora Check-Out', '8:00 PM')).strip(),
@@ -214,36 +212,27 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
                 'currency': str(row['Moneda']).strip().upper(),
                 'notes': str(row.get('Notas', '')).strip() if not pd.isna(row.get('Notas')) else '',
                 'status': str(row['Estado']).strip().lower(),
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat(),
+                'created_at': datetime.now(timezone.utc),
+                'updated_at': datetime.now(timezone.utc),
                 'created_by': 'import_system'
             }
             
-            # Buscar si ya existe por número de factura
-            existing = await db.reservations.find_one({'invoice_number': reservation_data['invoice_number']})
-            
+            # Actualizar si ya existe por número de factura, si no crear
+            existing = existing_reservations.get(reservation_data['invoice_number'])
             if existing:
-                # Actualizar existente
-                await db.reservations.update_one(
-                    {'id': existing['id']},
-                    {'$set': reservation_data}
-                )
-                reservations_updated += 1
                 reservation_id = existing['id']
             else:
-                # Crear nueva
-                await db.reservations.insert_one(reservation_data)
-                reservations_created += 1
                 reservation_id = reservation_data['id']
+                # Una factura repetida en la hoja actualiza la reservación creada por la primera fila
+                existing_reservations[reservation_data['invoice_number']] = {'id': reservation_id}
+                new_invoices[idx + 2] = (reservation_data['invoice_number'], 'reservation', reservation_id)
+            await reservations_writer.upsert(idx + 2, {'invoice_number': reservation_data['invoice_number']}, reservation_data)
             
             # OPCIÓN A: Crear gasto automático si owner_price > 0
             if villa.get('owner_price', 0) > 0:
-                # Verificar si ya existe un gasto para esta reservación
-                existing_expense = await db.expenses.find_one({
-                    'related_reservation_id': reservation_id
-                })
-                
-                if not existing_expense:
+                # Solo si no existe ya un gasto para esta reservación
+                if reservation_id not in expensed_reservations:
+                    expensed_reservations.add(reservation_id)
                     expense_data = {
                         'id': str(uuid.uuid4()),
                         'category': 'pago_propietario',
@@ -262,24 +251,37 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
                         'related_reservation_id': reservation_id,
                         'abonos': []
                     }
-                    
-                    await db.expenses.insert_one(expense_data)
-                    expenses_created += 1
+                    pending_expenses.append((idx + 2, expense_data))
                 
         except Exception as e:
             errors.append(f"Fila {idx + 2}: {str(e)}")
     
-    return reservations_created, reservations_updated, expenses_created, errors
+    await reservations_writer.flush()
+    
+    # Los gastos automáticos solo para reservaciones que se escribieron
+    for row, expense_data in pending_expenses:
+        if row not in reservations_writer.failed_rows:
+            await expenses_writer.insert(row, expense_data)
+    await expenses_writer.flush()
+    
+    # Registrar los números de factura importados para que no se reasignen
+    await register_invoice_numbers(db, [
+        invoice for row, invoice in new_invoices.items() if row not in reservations_writer.failed_rows
+    ])
+    
+    return reservations_writer.created, reservations_writer.updated, expenses_writer.created, errors
 
 
-async def import_expenses(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[int, int, List[str]]:
+async def import_expenses(df: pd.DataFrame, db: AsyncIOMotorDatabase, job_id: Optional[str] = None) -> Tuple[int, int, List[str]]:
     """
     Importa gastos desde DataFrame
+    Los gastos no tienen clave natural: dentro de un trabajo de importación
+    (job_id) cada fila se escribe con la clave "job_id:fila", así que
+    retomar un bloque actualiza los gastos ya escritos en vez de duplicarlos.
     Returns: (creados, actualizados, errores)
     """
-    created = 0
-    updated = 0
     errors = []
+    writer = BulkWriter(db.expenses, errors)
     
     for idx, row in df.iterrows():
         try:
@@ -312,7 +314,7 @@ async def import_expenses(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[i
                 'description': str(row['Descripción']).strip(),
                 'amount': float(row['Monto']),
                 'currency': str(row['Moneda']).strip().upper(),
-                'expense_date': fecha_obj.isoformat(),
+                'expense_date': fecha_obj.replace(tzinfo=timezone.utc),
                 'payment_status': str(row['Estado Pago']).strip().lower(),
                 'notes': str(row.get('Notas', '')).strip() if not pd.isna(row.get('Notas')) else '',
                 'expense_type': str(row['Tipo Gasto']).strip().lower(),
@@ -323,11 +325,15 @@ async def import_expenses(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[i
                 'abonos': []
             }
             
-            # Crear nuevo (no buscamos duplicados en gastos)
-            await db.expenses.insert_one(expense_data)
-            created += 1
+            if job_id:
+                expense_data['import_key'] = f"{job_id}:{idx + 2}"
+                await writer.upsert(idx + 2, {'import_key': expense_data['import_key']}, expense_data)
+            else:
+                # Crear nuevo (no buscamos duplicados en gastos)
+                await writer.insert(idx + 2, expense_data)
                 
         except Exception as e:
             errors.append(f"Fila {idx + 2}: {str(e)}")
     
-    return created, updated, errors
+    await writer.flush()
+    return writer.created, writer.updated, errors
@@ -0,0 +1,256 @@
+"""
+Servicio de Índices de MongoDB
+Registro declarativo de los índices que usa la API, creación idempotente
+al iniciar y reporte de índices faltantes o sin uso
+"""
+import logging
+from typing import Dict, List, Any
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from invoice_service import INVOICE_REGISTRY_INDEX
+from dashboard_service import ROLLUP_INDEX, ROLLUP_SOURCES_COLLECTION, ROLLUP_SOURCE_INDEXES
+from search_service import TEXT_INDEXES, SEARCH_KEYS_INDEX
+from media_service import MEDIA_SHA_INDEX
+from database import TOMBSTONES_COLLECTION, TOMBSTONE_RETENTION_DAYS
+from import_jobs import IMPORT_JOBS_COLLECTION, IMPORT_JOB_INDEXES
+
+logger = logging.getLogger(__name__)
+
+# Colecciones cuyos documentos se identifican por el campo "id" (uuid)
+ID_COLLECTIONS = [
+    "users", "customers", "categories", "expense_categories",
+    "villas", "extra_services", "reservations", "quotations", "conduces",
+    "villa_owners", "owner_payments", "expenses", "reservation_abonos",
+    "expense_abonos", "commissions", "website_content", "website_images",
+    "public_services", "chatbot_questions", "client_quotations", "quote_requests",
+    "media"
+]
+
+
+def _unique_id_index() -> IndexModel:
+    """Índice único sobre "id" (parcial para tolerar documentos sin id)"""
+    return IndexModel(
+        [("id", ASCENDING)],
+        name="id_unique",
+        unique=True,
+        partialFilterExpression={"id": {"$exists": True}}
+    )
+
+
+def _updated_at_index() -> IndexModel:
+    """Los backups incrementales buscan por updated_at > marca de agua"""
+    return IndexModel([("updated_at", ASCENDING)], name="updated_at")
+
+
+# Índices adicionales por colección (además del único sobre "id")
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username"),
+        IndexModel([("email", ASCENDING)], name="email"),
+    ],
+    "customers": [
+        IndexModel([("name", ASCENDING)], name="name"),
+        IndexModel([("phone", ASCENDING)], name="phone"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        SEARCH_KEYS_INDEX,
+        TEXT_INDEXES["customers"],
+    ],
+    "categories": [
+        IndexModel([("name", ASCENDING)], name="name"),
+    ],
+    "expense_categories": [
+        IndexModel([("name", ASCENDING)], name="name"),
+    ],
+    "villas": [
+        IndexModel([("code", ASCENDING)], name="code"),
+        IndexModel([("category_id", ASCENDING)], name="category_id"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        SEARCH_KEYS_INDEX,
+        TEXT_INDEXES["villas"],
+    ],
+    "reservations": [
+        IndexModel([("invoice_number", ASCENDING)], name="invoice_number"),
+        IndexModel([("customer_id", ASCENDING)], name="customer_id"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        IndexModel([("reservation_date", DESCENDING)], name="reservation_date"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("balance_due", ASCENDING)], name="balance_due"),
+    ],
+    "reservation_abonos": [
+        IndexModel([("reservation_id", ASCENDING)], name="reservation_id"),
+        IndexModel([("invoice_number", ASCENDING)], name="invoice_number"),
+    ],
+    "expenses": [
+        IndexModel([("related_reservation_id", ASCENDING), ("category", ASCENDING)], name="related_reservation_category"),
+        IndexModel([("expense_date", DESCENDING)], name="expense_date"),
+        IndexModel([("category", ASCENDING), ("expense_date", DESCENDING)], name="category_expense_date"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        # Clave por fila de los gastos importados (una importación retomada no los duplica)
+        IndexModel([("import_key", ASCENDING)], name="import_key_unique", unique=True,
+                   partialFilterExpression={"import_key": {"$exists": True}}),
+        TEXT_INDEXES["expenses"],
+    ],
+    "expense_abonos": [
+        IndexModel([("expense_id", ASCENDING)], name="expense_id"),
+        IndexModel([("invoice_number", ASCENDING)], name="invoice_number"),
+    ],
+    "quotations": [
+        IndexModel([("quotation_number", ASCENDING)], name="quotation_number"),
+        IndexModel([("customer_id", ASCENDING)], name="customer_id"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "conduces": [
+        IndexModel([("conduce_number", ASCENDING)], name="conduce_number"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "commissions": [
+        IndexModel([("reservation_id", ASCENDING)], name="reservation_id"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_at"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "villa_owners": [
+        IndexModel([("name", ASCENDING)], name="name"),
+    ],
+    "owner_payments": [
+        IndexModel([("owner_id", ASCENDING), ("payment_date", DESCENDING)], name="owner_payment_date"),
+    ],
+    "invoice_numbers": [
+        INVOICE_REGISTRY_INDEX,
+    ],
+    "dashboard_rollups": [
+        ROLLUP_INDEX,
+    ],
+    ROLLUP_SOURCES_COLLECTION: ROLLUP_SOURCE_INDEXES,
+    "media": [
+        MEDIA_SHA_INDEX,
+    ],
+    "invoice_counter": [
+        IndexModel([("counter_id", ASCENDING)], name="counter_id_unique", unique=True),
+    ],
+    "website_content": [
+        IndexModel([("section", ASCENDING)], name="section"),
+    ],
+    "client_quotations": [
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    TOMBSTONES_COLLECTION: [
+        IndexModel(
+            [("deleted_at", ASCENDING)],
+            name="deleted_at_ttl",
+            expireAfterSeconds=TOMBSTONE_RETENTION_DAYS * 24 * 3600
+        ),
+    ],
+    IMPORT_JOBS_COLLECTION: IMPORT_JOB_INDEXES,
+}
+
+
+def get_index_registry() -> Dict[str, List[IndexModel]]:
+    """
+    Devuelve el registro completo: único sobre "id" + updated_at + índices declarados
+    """
+    registry: Dict[str, List[IndexModel]] = {}
+    for collection_name in ID_COLLECTIONS:
+        registry[collection_name] = [_unique_id_index(), _updated_at_index()]
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        registry.setdefault(collection_name, []).extend(indexes)
+    return registry
+
+
+def _key_of(spec) -> tuple:
+    """
+    Normaliza la especificación de llaves de un índice para compararla.
+    Los índices de texto aparecen en index_information como _fts/_ftsx,
+    así que todas sus llaves "text" se reducen a ese par.
+    """
+    key = []
+    for field, direction in spec:
+        if direction == "text" or field in ("_fts", "_ftsx"):
+            if ("_fts", "text") not in key:
+                key.extend([("_fts", "text"), ("_ftsx", 1)])
+            continue
+        key.append((field, direction))
+    return tuple(key)
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase) -> Dict[str, Any]:
+    """
+    Crea (de forma idempotente) todos los índices del registro.
+    Un fallo en una colección (ej. ids duplicados) no detiene el resto.
+    Returns: {"created": [...], "errors": [...]}
+    """
+    created = []
+    errors = []
+
+    for collection_name, indexes in get_index_registry().items():
+        collection = db[collection_name]
+        try:
+            existing = await collection.index_information()
+        except PyMongoError:
+            existing = {}
+        existing_keys = {_key_of(info["key"]) for info in existing.values()}
+
+        for index in indexes:
+            # Si ya existe un índice con las mismas llaves (aunque con otro nombre) no se recrea
+            if _key_of(index.document["key"].items()) in existing_keys:
+                continue
+            try:
+                names = await collection.create_indexes([index])
+                created.extend(f"{collection_name}.{name}" for name in names)
+            except PyMongoError as e:
+                index_name = index.document.get("name")
+                logger.warning(f"⚠️ No se pudo crear índice {collection_name}.{index_name}: {e}")
+                errors.append({
+                    "collection": collection_name,
+                    "index": index_name,
+                    "error": str(e)
+                })
+
+    logger.info(f"✅ Índices verificados: {len(created)} creados, {len(errors)} con error")
+    return {"created": created, "errors": errors}
+
+
+async def get_index_report(db: AsyncIOMotorDatabase) -> Dict[str, Any]:
+    """
+    Reporte por colección de índices faltantes (declarados pero no presentes)
+    y sin uso (presentes pero con 0 accesos según $indexStats)
+    """
+    report = []
+    total_missing = 0
+    total_unused = 0
+
+    for collection_name, indexes in get_index_registry().items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        existing_keys = {_key_of(info["key"]): name for name, info in existing.items()}
+
+        missing = []
+        for index in indexes:
+            document = index.document
+            if _key_of(document["key"].items()) not in existing_keys:
+                missing.append(document["name"])
+
+        # $indexStats puede no estar permitido en algunos planes de Atlas
+        unused = []
+        stats_available = True
+        try:
+            async for stat in collection.aggregate([{"$indexStats": {}}]):
+                if stat["name"] != "_id_" and stat.get("accesses", {}).get("ops", 0) == 0:
+                    unused.append(stat["name"])
+        except PyMongoError:
+            stats_available = False
+
+        total_missing += len(missing)
+        total_unused += len(unused)
+        report.append({
+            "collection": collection_name,
+            "existing": sorted(existing.keys()),
+            "missing": missing,
+            "unused": sorted(unused) if stats_available else None
+        })
+
+    return {
+        "total_missing": total_missing,
+        "total_unused": total_unused,
+        "collections": report
+    }
@@ -0,0 +1,152 @@
+"""
+Servicio de Números de Factura
+Registro único (colección invoice_numbers) de todos los números usados por
+reservaciones y abonos, con asignación atómica desde invoice_counter
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+from pymongo import ReturnDocument, UpdateOne, ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger(__name__)
+
+INVOICE_START = 1600
+COUNTER_ID = "main_counter"
+MAX_ALLOCATION_ATTEMPTS = 1000
+
+# Índice único que garantiza que un número no se asigne dos veces
+INVOICE_REGISTRY_INDEX = IndexModel(
+    [("invoice_number", ASCENDING)],
+    name="invoice_number_unique",
+    unique=True
+)
+
+
+def _registry_doc(invoice_number: str, source: str, ref_id: Optional[str]) -> dict:
+    return {
+        "invoice_number": invoice_number,
+        "source": source,  # reservation | reservation_abono | expense_abono
+        "ref_id": ref_id,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+async def _ensure_counter(db: AsyncIOMotorDatabase) -> None:
+    """Crea el contador principal si no existe (sin tocar su valor si ya existe)"""
+    await db.invoice_counter.update_one(
+        {"counter_id": COUNTER_ID},
+        {"$setOnInsert": {"current_number": INVOICE_START}},
+        upsert=True
+    )
+
+
+async def allocate_invoice_number(db: AsyncIOMotorDatabase, source: str, ref_id: Optional[str] = None) -> str:
+    """
+    Asigna el siguiente número de factura disponible de forma atómica.
+    El contador avanza con un único find_one_and_update($inc); si el número
+    ya fue tomado manualmente, el índice único lo rechaza y se prueba el siguiente.
+    """
+    await _ensure_counter(db)
+
+    for _ in range(MAX_ALLOCATION_ATTEMPTS):
+        counter = await db.invoice_counter.find_one_and_update(
+            {"counter_id": COUNTER_ID},
+            {"$inc": {"current_number": 1}},
+            return_document=ReturnDocument.BEFORE
+        )
+        invoice_number = str(counter["current_number"])
+        try:
+            await db.invoice_numbers.insert_one(_registry_doc(invoice_number, source, ref_id))
+            return invoice_number
+        except DuplicateKeyError:
+            # Número usado manualmente por un admin, continuar con el siguiente
+            continue
+
+    raise RuntimeError("No se pudo asignar un número de factura disponible")
+
+
+async def claim_invoice_number(db: AsyncIOMotorDatabase, invoice_number: str, source: str, ref_id: Optional[str] = None) -> bool:
+    """
+    Reserva un número manual (admin). Devuelve False si ya está en uso.
+    La verificación y la reserva son una sola operación atómica.
+    """
+    try:
+        await db.invoice_numbers.insert_one(_registry_doc(str(invoice_number), source, ref_id))
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def is_invoice_number_available(db: AsyncIOMotorDatabase, invoice_number: str) -> bool:
+    """Verifica disponibilidad con una sola búsqueda indexada"""
+    existing = await db.invoice_numbers.find_one({"invoice_number": str(invoice_number)}, {"_id": 1})
+    return existing is None
+
+
+async def update_invoice_ref(db: AsyncIOMotorDatabase, invoice_number: str, ref_id: str) -> None:
+    """Asocia un número ya reservado con el documento que lo usa"""
+    await db.invoice_numbers.update_one(
+        {"invoice_number": str(invoice_number)},
+        {"$set": {"ref_id": ref_id}}
+    )
+
+
+async def release_invoice_numbers(db: AsyncIOMotorDatabase, invoice_numbers: Iterable[str]) -> int:
+    """Libera números cuyos documentos fueron eliminados para que puedan reutilizarse manualmente"""
+    numbers = [str(n) for n in invoice_numbers if n]
+    if not numbers:
+        return 0
+    result = await db.invoice_numbers.delete_many({"invoice_number": {"$in": numbers}})
+    return result.deleted_count
+
+
+async def register_invoice_numbers(db: AsyncIOMotorDatabase, entries: Iterable[Tuple[str, str, Optional[str]]]) -> int:
+    """
+    Registra (upsert) números ya existentes, ej. desde importaciones.
+    entries: tuplas (invoice_number, source, ref_id)
+    """
+    operations = [
+        UpdateOne(
+            {"invoice_number": str(number)},
+            {"$setOnInsert": _registry_doc(str(number), source, ref_id)},
+            upsert=True
+        )
+        for number, source, ref_id in entries if number
+    ]
+    if not operations:
+        return 0
+    result = await db.invoice_numbers.bulk_write(operations, ordered=False)
+    return result.upserted_count
+
+
+async def sync_invoice_registry(db: AsyncIOMotorDatabase) -> int:
+    """
+    Backfill del registro a partir de reservaciones y abonos existentes.
+    Idempotente: solo inserta los números que falten.
+    """
+    await db.invoice_numbers.create_indexes([INVOICE_REGISTRY_INDEX])
+
+    sources = [
+        ("reservations", "reservation"),
+        ("reservation_abonos", "reservation_abono"),
+        ("expense_abonos", "expense_abono"),
+    ]
+    registered = 0
+    for collection_name, source in sources:
+        cursor = db[collection_name].find(
+            {"invoice_number": {"$nin": [None, ""]}},
+            {"_id": 0, "invoice_number": 1, "id": 1}
+        )
+        batch = []
+        async for doc in cursor:
+            batch.append((doc["invoice_number"], source, doc.get("id")))
+            if len(batch) >= 1000:
+                registered += await register_invoice_numbers(db, batch)
+                batch = []
+        if batch:
+            registered += await register_invoice_numbers(db, batch)
+
+    logger.info(f"✅ Registro de facturas sincronizado: {registered} números agregados")
+    return registered
@@ -0,0 +1,465 @@
+"""
+Servicio de Multimedia
+Guarda una sola vez (deduplicado por SHA-256) los binarios de imágenes y
+videos en GridFS o en el sistema de archivos local, genera miniaturas y
+variantes WebP en un pool de hilos y los sirve por /api/media/{id}.
+Los documentos (villas, logo) solo guardan la ruta del archivo
+(/api/media/{id}.{ext}): los frontends le anteponen la URL del backend y
+distinguen videos de imágenes por la extensión, que sale del content_type.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from database import touch
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Sin Pillow se guardan solo los originales
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_URL_PREFIX = "/api/media/"
+# Copia de los valores base64 que reemplazó migrate_inline_media (para poder revertir)
+INLINE_MEDIA_BACKUP_COLLECTION = "inline_media_backup"
+MEDIA_BUCKET = "media_files"
+MAX_MEDIA_SIZE = 25 * 1024 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+ORIGINAL = "original"
+THUMB = "thumb"
+WEBP = "webp"
+VARIANTS = (ORIGINAL, THUMB, WEBP)
+THUMB_SIZE = (480, 480)
+WEBP_MAX_SIZE = (1920, 1920)
+
+# Tipos que se aceptan y se sirven tal cual; el tipo sale de los bytes, no del cliente
+# (sin SVG ni HTML: se servirían como documentos en el origen de la API)
+IMAGE_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+VIDEO_TYPES = ("video/mp4", "video/quicktime", "video/webm", "video/ogg")
+ALLOWED_MEDIA_TYPES = IMAGE_TYPES + VIDEO_TYPES
+# Lo que no es un tipo permitido (archivos anteriores a esta validación) se descarga
+FALLBACK_CONTENT_TYPE = "application/octet-stream"
+
+MEDIA_SHA_INDEX = IndexModel([("sha256", ASCENDING)], name="sha256_unique", unique=True)
+
+DATA_URL_RE = re.compile(r"^data:(?P<type>[\w.+-]+/[\w.+-]+)?(?:;[^,;]*)*;base64,(?P<data>.*)$", re.DOTALL)
+
+# Pillow libera el GIL al redimensionar/codificar: un pool de hilos basta
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="media")
+
+
+class MediaError(ValueError):
+    """Archivo rechazado; status_code es la respuesta HTTP que corresponde"""
+    status_code = 400
+
+
+class MediaTooLargeError(MediaError):
+    status_code = 413
+
+
+# ============ BACKENDS DE ALMACENAMIENTO ============
+
+class GridFSMediaBackend:
+    """Binarios en GridFS (mismo MongoDB, se respalda con la base de datos)"""
+    name = "gridfs"
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=MEDIA_BUCKET)
+
+    async def save(self, data: bytes, content_type: str, filename: str) -> str:
+        file_id = await self.bucket.upload_from_stream(filename, data, metadata={"content_type": content_type})
+        return str(file_id)
+
+    async def stream(self, key: str) -> AsyncIterator[bytes]:
+        grid_out = await self.bucket.open_download_stream(ObjectId(key))
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            yield chunk
+
+    async def delete(self, key: str):
+        await self.bucket.delete(ObjectId(key))
+
+
+class LocalMediaBackend:
+    """Binarios en disco (MEDIA_ROOT), útil para desarrollo o un volumen compartido"""
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError("Invalid media key")
+        return path
+
+    async def save(self, data: bytes, content_type: str, filename: str) -> str:
+        key = f"{uuid.uuid4().hex[:2]}/{uuid.uuid4().hex}"
+        path = self._path(key)
+
+        def write():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+
+        await asyncio.to_thread(write)
+        return key
+
+    async def stream(self, key: str) -> AsyncIterator[bytes]:
+        handle = await asyncio.to_thread(open, self._path(key), "rb")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(handle.read, STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            handle.close()
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(lambda: self._path(key).unlink(missing_ok=True))
+
+
+def _backend_by_name(db: AsyncIOMotorDatabase, name: Optional[str]):
+    if name == LocalMediaBackend.name:
+        return LocalMediaBackend(os.environ.get("MEDIA_ROOT", str(Path(__file__).parent / "media")))
+    return GridFSMediaBackend(db)
+
+
+def get_media_backend(db: AsyncIOMotorDatabase):
+    """MEDIA_BACKEND=gridfs (por defecto) | local (usa MEDIA_ROOT)"""
+    return _backend_by_name(db, os.environ.get("MEDIA_BACKEND", GridFSMediaBackend.name))
+
+
+# ============ VARIANTES ============
+
+def _encode_webp(image, max_size: Tuple[int, int], quality: int) -> bytes:
+    image = image.copy()
+    image.thumbnail(max_size)
+    buffer = BytesIO()
+    image.save(buffer, format="WEBP", quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def render_variants(data: bytes) -> Dict[str, Tuple[bytes, int, int]]:
+    """
+    Miniatura y versión WebP de una imagen (se ejecuta en el pool).
+    Videos, imágenes animadas o formatos no reconocidos no tienen variantes.
+    """
+    if Image is None:
+        return {}
+    try:
+        with Image.open(BytesIO(data)) as opened:
+            if getattr(opened, "is_animated", False):
+                return {}
+            image = ImageOps.exif_transpose(opened)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "P") else "RGB")
+            variants = {}
+            for name, max_size, quality in ((THUMB, THUMB_SIZE, 75), (WEBP, WEBP_MAX_SIZE, 85)):
+                encoded = _encode_webp(image, max_size, quality)
+                with Image.open(BytesIO(encoded)) as result:
+                    variants[name] = (encoded, result.width, result.height)
+            return variants
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning(f"⚠️ No se pudieron generar variantes: {e}")
+        return {}
+
+
+def media_extension(content_type: Optional[str]) -> str:
+    """".jpg", ".mp4"...; vacío si el tipo no tiene extensión conocida"""
+    if not content_type:
+        return ""
+    return mimetypes.guess_extension(content_type) or ""
+
+
+def media_url(media_id: str, variant: str = ORIGINAL, content_type: Optional[str] = None) -> str:
+    path = f"{MEDIA_URL_PREFIX}{media_id}{media_extension(content_type)}"
+    if variant == ORIGINAL:
+        return path
+    return f"{path}?variant={variant}"
+
+
+def media_id_from_path(value: str) -> str:
+    """Id de un archivo a partir del segmento de la URL (con o sin extensión)"""
+    return value.split(".", 1)[0]
+
+
+def media_urls(media: dict) -> dict:
+    """URLs públicas de un archivo y sus variantes disponibles"""
+    variants = media.get("variants", {})
+    content_type = media.get("content_type")
+    return {
+        "id": media["id"],
+        "url": media_url(media["id"], content_type=content_type),
+        "thumbnail_url": media_url(media["id"], THUMB, content_type) if THUMB in variants else None,
+        "webp_url": media_url(media["id"], WEBP, content_type) if WEBP in variants else None,
+        "content_type": media.get("content_type"),
+        "size": media.get("size"),
+    }
+
+
+# ============ GUARDAR / LEER ============
+
+def sniff_media_type(data: bytes) -> Optional[str]:
+    """Tipo real del archivo según sus primeros bytes; None si no es uno permitido"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        return "video/quicktime" if data[8:12] == b"qt  " else "video/mp4"
+    if data.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video/webm"
+    if data.startswith(b"OggS"):
+        return "video/ogg"
+    return None
+
+
+def served_content_type(content_type: Optional[str]) -> str:
+    """Content-Type con el que se sirve un archivo guardado"""
+    return content_type if content_type in ALLOWED_MEDIA_TYPES else FALLBACK_CONTENT_TYPE
+
+
+async def store_media(
+    db: AsyncIOMotorDatabase,
+    data: bytes,
+    content_type: str,
+    filename: Optional[str] = None,
+    created_by: Optional[str] = None
+) -> dict:
+    """
+    Guarda un archivo y sus variantes. Si ya existe uno con el mismo
+    contenido se devuelve ese (los binarios se guardan una sola vez).
+    El content_type enviado por el cliente no se usa: el tipo se detecta en
+    los bytes y solo se aceptan imágenes raster y videos (ALLOWED_MEDIA_TYPES).
+    Raises: MediaTooLargeError si excede MAX_MEDIA_SIZE, MediaError si el
+    tipo no está permitido
+    """
+    if len(data) > MAX_MEDIA_SIZE:
+        raise MediaTooLargeError(f"El archivo excede el máximo de {MAX_MEDIA_SIZE // (1024 * 1024)} MB")
+    detected = sniff_media_type(data)
+    if detected is None:
+        raise MediaError(
+            f"Tipo de archivo no permitido ({content_type or 'desconocido'}). "
+            "Solo imágenes JPEG, PNG, GIF o WebP y videos MP4, MOV, WebM u Ogg"
+        )
+    content_type = detected
+
+    sha256 = hashlib.sha256(data).hexdigest()
+    existing = await db.media.find_one({"sha256": sha256}, {"_id": 0})
+    if existing:
+        return existing
+
+    filename = filename or sha256
+    backend = get_media_backend(db)
+
+    rendered = {}
+    if content_type in IMAGE_TYPES:
+        loop = asyncio.get_running_loop()
+        rendered = await loop.run_in_executor(_executor, render_variants, data)
+
+    variants = {ORIGINAL: {
+        "key": await backend.save(data, content_type, filename),
+        "content_type": content_type,
+        "size": len(data),
+        "etag": sha256[:32]
+    }}
+    for name, (encoded, width, height) in rendered.items():
+        variants[name] = {
+            "key": await backend.save(encoded, "image/webp", f"{filename}.{name}.webp"),
+            "content_type": "image/webp",
+            "size": len(encoded),
+            "width": width,
+            "height": height,
+            "etag": hashlib.sha256(encoded).hexdigest()[:32]
+        }
+
+    now = datetime.now(timezone.utc)
+    media = {
+        "id": str(uuid.uuid4()),
+        "sha256": sha256,
+        "filename": filename,
+        "content_type": content_type,
+        "size": len(data),
+        "backend": backend.name,
+        "variants": variants,
+        "created_by": created_by,
+        "created_at": now,
+        "updated_at": now
+    }
+    try:
+        await db.media.insert_one(media)
+    except DuplicateKeyError:
+        # Otra petición guardó el mismo contenido al mismo tiempo
+        for variant in variants.values():
+            await backend.delete(variant["key"])
+        return await db.media.find_one({"sha256": sha256}, {"_id": 0})
+
+    media.pop("_id", None)
+    logger.info(f"🖼️ Archivo guardado: {filename} ({len(data)} bytes, variantes: {sorted(variants)})")
+    return media
+
+
+async def get_media_variant(db: AsyncIOMotorDatabase, media_id: str, variant: str = ORIGINAL) -> Optional[dict]:
+    """Datos de la variante pedida (o el original si no existe)"""
+    media = await db.media.find_one({"id": media_id}, {"_id": 0, "variants": 1, "backend": 1})
+    if not media:
+        return None
+    variants = media["variants"]
+    info = variants.get(variant) or variants[ORIGINAL]
+    return {**info, "backend": media.get("backend")}
+
+
+def stream_media(db: AsyncIOMotorDatabase, variant_info: dict) -> AsyncIterator[bytes]:
+    """Lee del backend donde se guardó el archivo (aunque luego se cambie MEDIA_BACKEND)"""
+    return _backend_by_name(db, variant_info.get("backend")).stream(variant_info["key"])
+
+
+# ============ BASE64 EN LÍNEA -> REFERENCIAS ============
+
+def parse_data_url(value) -> Optional[Tuple[bytes, str]]:
+    """("data:image/png;base64,...") -> (bytes, content_type) o None"""
+    if not isinstance(value, str) or not value.startswith("data:"):
+        return None
+    match = DATA_URL_RE.match(value)
+    if not match:
+        return None
+    try:
+        data = base64.b64decode(match.group("data"), validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    return data, match.group("type") or "application/octet-stream"
+
+
+async def externalize_media(db: AsyncIOMotorDatabase, value, created_by: Optional[str] = None):
+    """Reemplaza un data URL por la ruta del archivo guardado; el resto se deja igual"""
+    parsed = parse_data_url(value)
+    if parsed is None:
+        # Un frontend puede devolver la URL absoluta que mostró: se guarda solo la ruta
+        if isinstance(value, str) and MEDIA_URL_PREFIX in value:
+            return value[value.index(MEDIA_URL_PREFIX):]
+        return value
+    data, content_type = parsed
+    media = await store_media(db, data, content_type, created_by=created_by)
+    return media_url(media["id"], content_type=media.get("content_type"))
+
+
+async def externalize_images(db: AsyncIOMotorDatabase, images: List[str], created_by: Optional[str] = None) -> List[str]:
+    return [await externalize_media(db, image, created_by) for image in images or []]
+
+
+# Rutas guardadas antes de que llevaran extensión
+BARE_MEDIA_URL = f"^{re.escape(MEDIA_URL_PREFIX)}[^./?]+$"
+
+
+async def _with_extensions(db: AsyncIOMotorDatabase, values: List[str]) -> List[str]:
+    """Agrega la extensión (según el content_type guardado) a las rutas que no la tienen"""
+    ids = [value[len(MEDIA_URL_PREFIX):] for value in values if re.match(BARE_MEDIA_URL, value or "")]
+    if not ids:
+        return values
+    types = {
+        media["id"]: media.get("content_type")
+        async for media in db.media.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "content_type": 1})
+    }
+    result = []
+    for value in values:
+        media_id = value[len(MEDIA_URL_PREFIX):] if re.match(BARE_MEDIA_URL, value or "") else None
+        result.append(media_url(media_id, content_type=types.get(media_id)) if media_id else value)
+    return result
+
+
+async def _backup_inline_value(db: AsyncIOMotorDatabase, collection: str, key: dict, field: str, value) -> None:
+    await db[INLINE_MEDIA_BACKUP_COLLECTION].update_one(
+        {"collection": collection, "key": key, "field": field},
+        {"$set": {"value": value, "migrated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+async def _externalize_legacy(db: AsyncIOMotorDatabase, value: str) -> str:
+    """Como externalize_media, pero un valor rechazado (p. ej. un SVG) se deja en base64"""
+    try:
+        return await externalize_media(db, value)
+    except MediaError as e:
+        logger.warning(f"⚠️ Multimedia en base64 no migrada: {e}")
+        return value
+
+
+async def migrate_inline_media(db: AsyncIOMotorDatabase) -> Dict[str, int]:
+    """
+    Mueve a la tienda de archivos las imágenes base64 guardadas dentro de
+    las villas y el logo (guardando antes una copia en inline_media_backup)
+    y agrega la extensión a las rutas que no la tienen. Puede ejecutarse de
+    nuevo (ej. después de restaurar un backup antiguo): solo toca valores
+    que siguen en base64 o sin extensión.
+    """
+    villas = 0
+    query = {"$or": [{"public_images": {"$regex": "^data:"}}, {"public_images": {"$regex": BARE_MEDIA_URL}}]}
+    async for villa in db.villas.find(query, {"_id": 0, "id": 1, "public_images": 1}):
+        if any(str(image).startswith("data:") for image in villa["public_images"]):
+            await _backup_inline_value(db, "villas", {"id": villa["id"]}, "public_images", villa["public_images"])
+        images = [await _externalize_legacy(db, image) for image in villa["public_images"]]
+        images = await _with_extensions(db, images)
+        await db.villas.update_one({"id": villa["id"]}, touch({"$set": {"public_images": images}}))
+        villas += 1
+
+    logos = 0
+    async for logo in db.logo_config.find({"logo_data": {"$regex": "^data:"}}, {"_id": 0, "config_id": 1, "logo_data": 1}):
+        await _backup_inline_value(db, "logo_config", {"config_id": logo["config_id"]}, "logo_data", logo["logo_data"])
+        url = await _externalize_legacy(db, logo["logo_data"])
+        if url.startswith("data:"):
+            continue
+        await db.logo_config.update_one(
+            {"config_id": logo["config_id"]},
+            {"$set": {"logo_url": url}, "$unset": {"logo_data": ""}}
+        )
+        logos += 1
+    async for logo in db.logo_config.find({"logo_url": {"$regex": BARE_MEDIA_URL}}, {"_id": 0, "config_id": 1, "logo_url": 1}):
+        [url] = await _with_extensions(db, [logo["logo_url"]])
+        await db.logo_config.update_one({"config_id": logo["config_id"]}, {"$set": {"logo_url": url}})
+        logos += 1
+
+    if villas or logos:
+        logger.info(f"🖼️ Multimedia migrada: {villas} villas, {logos} logos")
+    return {"villas": villas, "logos": logos}
+
+
+async def rollback_inline_media(db: AsyncIOMotorDatabase) -> int:
+    """
+    Vuelve a poner en las villas y el logo los valores base64 guardados por
+    migrate_inline_media. Los archivos en la tienda no se borran.
+    """
+    restored = 0
+    async for backup in db[INLINE_MEDIA_BACKUP_COLLECTION].find({}, {"_id": 0}):
+        update = {"$set": {backup["field"]: backup["value"]}}
+        if backup["collection"] == "logo_config":
+            update["$unset"] = {"logo_url": ""}
+        result = await db[backup["collection"]].update_one(backup["key"], touch(update))
+        restored += result.modified_count
+    logger.info(f"🖼️ Multimedia base64 restaurada en {restored} documentos")
+    return restored
@@ -1,7 +1,11 @@
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import Optional, List, Literal, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, PlainSerializer
+from typing import Annotated, Optional, List, Literal, Dict, Any
 from datetime import datetime, timezone, time
 import uuid
+from date_service import calendar_date_json
+
+# Fecha de calendario (ver date_service.CALENDAR_DATE_FIELDS): en JSON sin zona
+CalendarDate = Annotated[datetime, PlainSerializer(calendar_date_json, return_type=str, when_used="json")]
 
 # ============ USER MODELS ============
 class UserBase(BaseModel):
@@ -158,7 +162,7 @@ class VillaBase(BaseModel):
     
     # Información pública para la página web
     public_description: Optional[str] = None  # Descripción completa (modal)
-    public_images: List[str] = []  # URLs de imágenes y videos públicos (base64 o URLs) - hasta 20
+    public_images: List[str] = []  # URLs de imágenes y videos públicos (/api/media/...) - hasta 20
     default_public_image_index: Optional[int] = 0  # Índice de la imagen predeterminada para mostrar en catálogo (0-19)
     public_amenities: List[str] = []  # Amenidades a mostrar públicamente
     public_features: List[str] = []  # Características destacadas para web pública
@@ -250,7 +254,7 @@ class ReservationBase(BaseModel):
     event_type: Optional[str] = None  # Si es evento, qué tipo
     
     # Fechas y horarios
-    reservation_date: datetime
+    reservation_date: CalendarDate
     check_in_time: str = ""  # Opcional - puede estar vacío
     check_out_time: str = ""  # Opcional - puede estar vacío
     
@@ -300,7 +304,7 @@ class ReservationUpdate(BaseModel):
     villa_description: Optional[str] = None
     rental_type: Optional[Literal["pasadia", "amanecida", "evento"]] = None
     event_type: Optional[str] = None
-    reservation_date: Optional[datetime] = None
+    reservation_date: Optional[CalendarDate] = None
     check_in_time: Optional[str] = None
     check_out_time: Optional[str] = None
     guests: Optional[int] = None
@@ -526,7 +530,7 @@ class PaymentCreate(PaymentBase):
 class Payment(PaymentBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    payment_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    payment_date: CalendarDate = Field(default_factory=lambda: datetime.now(timezone.utc))
     created_by: str
 
 # ============ ABONO (PAYMENT TO RESERVATION/EXPENSE) MODELS ============
@@ -534,7 +538,7 @@ class AbonoBase(BaseModel):
     amount: float
     currency: Literal["DOP", "USD"] = "DOP"
     payment_method: Literal["efectivo", "deposito", "transferencia", "mixto"] = "efectivo"
-    payment_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    payment_date: CalendarDate = Field(default_factory=lambda: datetime.now(timezone.utc))
     notes: Optional[str] = None
 
 class AbonoCreate(AbonoBase):
@@ -554,7 +558,7 @@ class ExpenseBase(BaseModel):
     description: str
     amount: float
     currency: Literal["DOP", "USD"] = "DOP"
-    expense_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    expense_date: CalendarDate = Field(default_factory=lambda: datetime.now(timezone.utc))
     payment_status: Literal["pending", "partial", "paid"] = "pending"
     notes: Optional[str] = None
     related_reservation_id: Optional[str] = None  # Para gastos auto-generados por reservaciones
@@ -585,7 +589,7 @@ class ExpenseUpdate(BaseModel):
     description: Optional[str] = None
     amount: Optional[float] = None
     currency: Optional[Literal["DOP", "USD"]] = None
-    expense_date: Optional[datetime] = None
+    expense_date: Optional[CalendarDate] = None
     payment_status: Optional[Literal["pending", "partial", "paid"]] = None
     notes: Optional[str] = None
     expense_type: Optional[Literal["fijo", "variable", "unico"]] = None
@@ -619,13 +623,13 @@ class CommissionBase(BaseModel):
     villa_code: str
     villa_name: str
     customer_name: str
-    reservation_date: str
+    reservation_date: CalendarDate
     amount: float = 250.0  # Comisión default
     notes: Optional[str] = None
     paid: bool = False  # Si ya se pagó la comisión
-    paid_date: Optional[str] = None  # Fecha cuando se pagó
+    paid_date: Optional[datetime] = None  # Fecha cuando se pagó
     invoice_deleted: bool = False  # Si la factura asociada fue eliminada
-    invoice_deleted_date: Optional[str] = None  # Fecha cuando se eliminó la factura
+    invoice_deleted_date: Optional[datetime] = None  # Fecha cuando se eliminó la factura
 
 class CommissionCreate(CommissionBase):
     pass
@@ -640,9 +644,9 @@ class CommissionUpdate(BaseModel):
     amount: Optional[float] = None
     notes: Optional[str] = None
     paid: Optional[bool] = None
-    paid_date: Optional[str] = None
+    paid_date: Optional[datetime] = None
     invoice_deleted: Optional[bool] = None
-    invoice_deleted_date: Optional[str] = None
+    invoice_deleted_date: Optional[datetime] = None
 
 # ============ DASHBOARD MODELS ============
 # ============ QUOTE REQUEST MODELS ============
@@ -762,7 +766,8 @@ class LogoConfig(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     config_id: str = "main_logo"  # Solo un logo principal
-    logo_data: Optional[str] = None  # Base64 encoded image
+    logo_data: Optional[str] = None  # Base64 (legado, se migra a la tienda de archivos)
+    logo_url: Optional[str] = None  # /api/media/{id}
     logo_filename: Optional[str] = None
     logo_mimetype: Optional[str] = None
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
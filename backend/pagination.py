@@ -0,0 +1,95 @@
+"""
+Paginación por cursor (keyset) compartida por los endpoints de listas.
+Sin parámetros se devuelve la lista completa como antes; con limit/cursor
+se devuelve una página y el siguiente cursor viaja en X-Next-Cursor.
+"""
+import base64
+from typing import List, Optional
+from bson import json_util
+from fastapi import HTTPException, Query, Response
+from pydantic import BaseModel
+
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+PAGINATION_HEADERS = [NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER]
+
+
+class PageParams(BaseModel):
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    include_total: bool = False
+
+    @property
+    def is_paginated(self) -> bool:
+        return self.limit is not None or self.cursor is not None
+
+
+def get_page_params(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_total: bool = False
+) -> PageParams:
+    """FastAPI dependency with the common list query parameters"""
+    return PageParams(limit=limit, cursor=cursor, include_total=include_total)
+
+
+def encode_cursor(doc: dict, sort_field: str) -> str:
+    """Opaque cursor with the (sort_field, id) of the last document of a page"""
+    # json_util conserva el tipo (ej. fechas BSON) al decodificar el cursor
+    raw = json_util.dumps([doc.get(sort_field), doc.get("id")])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        value, last_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return value, last_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(cursor: str, sort_field: str, direction: int) -> dict:
+    """Documents strictly after the cursor for the (sort_field, id) ordering"""
+    value, last_id = decode_cursor(cursor)
+    op = "$gt" if direction > 0 else "$lt"
+    return {"$or": [
+        {sort_field: {op: value}},
+        {sort_field: value, "id": {op: last_id}}
+    ]}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    page: PageParams,
+    response: Response,
+    sort_field: str = "created_at",
+    direction: int = -1,
+    projection: Optional[dict] = None
+) -> List[dict]:
+    """
+    Run a list query ordered by (sort_field, id).
+    Callers that send no pagination parameters get every matching document.
+    """
+    projection = projection or {"_id": 0}
+    find_query = query
+    if page.cursor:
+        cursor_filter = keyset_filter(page.cursor, sort_field, direction)
+        find_query = {"$and": [query, cursor_filter]} if query else cursor_filter
+
+    cursor = collection.find(find_query, projection).sort([(sort_field, direction), ("id", direction)])
+
+    if page.is_paginated:
+        limit = page.limit or MAX_PAGE_SIZE
+        docs = await cursor.limit(limit + 1).to_list(limit + 1)
+        if len(docs) > limit:
+            docs = docs[:limit]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1], sort_field)
+    else:
+        docs = await cursor.to_list(None)
+
+    if page.include_total:
+        response.headers[TOTAL_COUNT_HEADER] = str(await collection.count_documents(query))
+
+    return docs
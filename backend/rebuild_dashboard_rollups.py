@@ -0,0 +1,32 @@
+"""
+Script para recalcular la colección dashboard_rollups desde cero
+Útil después de cargas masivas o si los totales del dashboard se desvían
+"""
+import asyncio
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from collection_versions import collection_versions
+from dashboard_service import rebuild_dashboard_rollups
+
+async def main():
+    mongo_url = os.getenv("MONGO_URL")
+    db_name = os.getenv("DB_NAME", "villa_management")
+    
+    if not mongo_url:
+        print("❌ ERROR: MONGO_URL no configurado")
+        return
+    
+    print(f"🔗 Conectando a MongoDB: {db_name}")
+    # Las escrituras del script cambian los ETags del backend en ejecución
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[collection_versions])
+    db = client[db_name]
+    collection_versions.start(db)
+    
+    documents = await rebuild_dashboard_rollups(db)
+    print(f"✅ dashboard_rollups reconstruido: {documents} documentos")
+    
+    await collection_versions.flush()
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
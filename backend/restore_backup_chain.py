@@ -0,0 +1,61 @@
+"""
+Script para restaurar un backup completo y, en orden, sus incrementales
+Uso: python restore_backup_chain.py completo.ndjson.gz incremental1.ndjson.gz ...
+Cada archivo se verifica antes de tocar la base de datos; si un incremental
+no continúa la cadena (falta uno o ya está aplicado) el proceso se detiene.
+"""
+import asyncio
+import os
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from collection_versions import collection_versions
+from backup_service import restore_backup, backfill_updated_at, RestoreProgress, RestoreError
+from invoice_service import sync_invoice_registry
+from media_service import migrate_inline_media
+from dashboard_service import rebuild_dashboard_rollups
+from search_service import backfill_search_keys
+
+async def main(paths):
+    mongo_url = os.getenv("MONGO_URL")
+    db_name = os.getenv("DB_NAME", "villa_management")
+
+    if not mongo_url:
+        print("❌ ERROR: MONGO_URL no configurado")
+        return 1
+    if not paths:
+        print("❌ Uso: python restore_backup_chain.py completo.ndjson.gz [incremental.ndjson.gz ...]")
+        return 1
+
+    print(f"🔗 Conectando a MongoDB: {db_name}")
+    # Las escrituras del script cambian los ETags del backend en ejecución
+    client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[collection_versions])
+    db = client[db_name]
+    collection_versions.start(db)
+
+    try:
+        for path in paths:
+            progress = RestoreProgress()
+            progress.start(os.path.basename(path))
+            with open(path, "rb") as fileobj:
+                result = await restore_backup(db, fileobj, progress)
+            kind = result["metadata"].get("kind", "full")
+            documents = sum(item["documents"] for item in result["restored"])
+            print(f"✅ {path} ({kind}): {documents} documentos, {result.get('deleted', 0)} eliminados")
+
+        # Mismo post-procesamiento que POST /api/backup/restore
+        await sync_invoice_registry(db)
+        await backfill_updated_at(db)
+        await migrate_inline_media(db)
+        await rebuild_dashboard_rollups(db)
+        await backfill_search_keys(db, only_missing=False)
+        print("✅ Cadena restaurada. Reinicie el backend para refrescar el catálogo público en caché")
+        return 0
+    except (ValueError, RestoreError) as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        await collection_versions.flush()
+        client.close()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
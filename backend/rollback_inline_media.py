@@ -0,0 +1,36 @@
+"""
+Script para revertir la migración de multimedia (inline_media_v2)
+Vuelve a poner en las villas y el logo las imágenes base64 originales
+guardadas en inline_media_backup
+"""
+import asyncio
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from collection_versions import collection_versions
+from media_service import rollback_inline_media
+
+async def main():
+    mongo_url = os.getenv("MONGO_URL")
+    db_name = os.getenv("DB_NAME", "villa_management")
+    
+    if not mongo_url:
+        print("❌ ERROR: MONGO_URL no configurado")
+        return
+    
+    print(f"🔗 Conectando a MongoDB: {db_name}")
+    # Las escrituras del script cambian los ETags del backend en ejecución
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[collection_versions])
+    db = client[db_name]
+    collection_versions.start(db)
+    
+    restored = await rollback_inline_media(db)
+    # Sin el marcador, la migración volvería a correr en el próximo arranque
+    await db.migrations.delete_one({"name": "inline_media_v2"})
+    print(f"✅ Multimedia base64 restaurada en {restored} documentos")
+    print("⚠️ Despliega una versión anterior antes de reiniciar el backend")
+    
+    await collection_versions.flush()
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,215 @@
+"""
+Servicio de Búsqueda
+Búsqueda con índices de texto de MongoDB (ordenada por relevancia) más
+llaves de prefijo normalizadas (minúsculas, sin acentos ni símbolos) para
+códigos de villa, documentos de identidad, teléfonos y números de factura.
+La entrada del usuario nunca se usa como expresión regular.
+"""
+import logging
+import re
+import unicodedata
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, TEXT, IndexModel, UpdateOne
+from pymongo.errors import OperationFailure
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger(__name__)
+
+SEARCH_KEYS_FIELD = "search_keys"
+MAX_SEARCH_LENGTH = 100
+MIN_PREFIX_LENGTH = 2
+
+# Un único índice de texto por colección (límite de MongoDB)
+TEXT_INDEXES: Dict[str, IndexModel] = {
+    "villas": IndexModel(
+        [("code", TEXT), ("name", TEXT), ("description", TEXT)],
+        name="villas_text",
+        weights={"code": 10, "name": 5, "description": 1},
+        default_language="spanish"
+    ),
+    "customers": IndexModel(
+        [("name", TEXT), ("email", TEXT), ("identification_document", TEXT)],
+        name="customers_text",
+        weights={"name": 5, "identification_document": 5, "email": 2},
+        default_language="spanish"
+    ),
+    "expenses": IndexModel(
+        [("description", TEXT), ("notes", TEXT)],
+        name="expenses_text",
+        weights={"description": 3, "notes": 1},
+        default_language="spanish"
+    ),
+}
+
+# Campos de los que se generan llaves de prefijo
+SEARCH_KEY_FIELDS: Dict[str, List[str]] = {
+    "villas": ["code", "name"],
+    "customers": ["name", "identification_document", "dni", "phone"],
+}
+
+SEARCH_KEYS_INDEX = IndexModel([(SEARCH_KEYS_FIELD, ASCENDING)], name=SEARCH_KEYS_FIELD)
+
+
+def normalize_text(value) -> str:
+    """Minúsculas y sin acentos: "Peña" -> "pena" """
+    text = unicodedata.normalize("NFKD", str(value or ""))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return text.lower().strip()
+
+
+def normalize_key(value) -> str:
+    """Llave compacta solo con letras y números: "ECPV-01" -> "ecpv01" """
+    return re.sub(r"[^a-z0-9]", "", normalize_text(value))
+
+
+def clean_search(search: Optional[str]) -> str:
+    """Recorta la búsqueda a un tamaño razonable"""
+    return (search or "").strip()[:MAX_SEARCH_LENGTH]
+
+
+def build_search_keys(collection_name: str, doc: dict) -> List[str]:
+    """
+    Llaves de prefijo de un documento: el valor completo compactado y cada
+    palabra por separado (para encontrar "pena" dentro de "María Peña")
+    """
+    keys = set()
+    for field in SEARCH_KEY_FIELDS.get(collection_name, []):
+        value = doc.get(field)
+        if not value:
+            continue
+        compact = normalize_key(value)
+        if compact:
+            keys.add(compact)
+        for word in normalize_text(value).split():
+            word_key = normalize_key(word)
+            if len(word_key) >= MIN_PREFIX_LENGTH:
+                keys.add(word_key)
+    return sorted(keys)
+
+
+def with_search_keys(collection_name: str, doc: dict) -> dict:
+    """Agrega search_keys a un documento antes de insertarlo/actualizarlo"""
+    doc[SEARCH_KEYS_FIELD] = build_search_keys(collection_name, doc)
+    return doc
+
+
+def prefix_filter(search: str, field: str = SEARCH_KEYS_FIELD) -> Optional[dict]:
+    """Prefijo anclado y escapado (usa el índice del campo)"""
+    key = normalize_key(search)
+    if len(key) < MIN_PREFIX_LENGTH:
+        return None
+    return {field: {"$regex": f"^{re.escape(key)}"}}
+
+
+def invoice_prefix_filter(search: str, field: str = "invoice_number") -> Optional[dict]:
+    """Prefijo anclado sobre números de factura ("FAC-16" -> ^16)"""
+    digits = re.sub(r"[^0-9]", "", search or "")
+    if not digits:
+        return None
+    return {field: {"$regex": f"^{digits}"}}
+
+
+async def find_reservation_ids_by_invoice(db: AsyncIOMotorDatabase, search: Optional[str], limit: int = 200) -> List[str]:
+    """Ids de reservaciones cuyo número de factura empieza con la búsqueda"""
+    invoice_filter = invoice_prefix_filter(clean_search(search))
+    if not invoice_filter:
+        return []
+    reservations = await db.reservations.find(invoice_filter, {"_id": 0, "id": 1}).limit(limit).to_list(limit)
+    return [r["id"] for r in reservations]
+
+
+def search_filter(collection_name: str, search: Optional[str]) -> Optional[dict]:
+    """
+    Filtro para combinar con otras condiciones en una lista paginada:
+    coincidencia de texto O prefijo de llave
+    """
+    search = clean_search(search)
+    if not search:
+        return None
+    text_clause = {"$text": {"$search": search}}
+    prefix = prefix_filter(search) if collection_name in SEARCH_KEY_FIELDS else None
+    if prefix:
+        return {"$or": [text_clause, prefix]}
+    return text_clause
+
+
+def combine_filters(*filters: Optional[dict]) -> dict:
+    clauses = [f for f in filters if f]
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+async def ranked_search(
+    db: AsyncIOMotorDatabase,
+    collection_name: str,
+    search: Optional[str],
+    base_query: Optional[dict] = None,
+    limit: int = 50
+) -> List[dict]:
+    """
+    Resultados ordenados por relevancia: primero coincidencias de prefijo
+    (códigos, documentos), luego coincidencias de texto por puntaje.
+    """
+    search = clean_search(search)
+    collection = db[collection_name]
+    results: List[dict] = []
+    seen = set()
+
+    def add(docs):
+        for doc in docs:
+            doc_id = doc.get("id")
+            if doc_id not in seen:
+                seen.add(doc_id)
+                doc.pop("score", None)
+                results.append(doc)
+
+    prefix = prefix_filter(search) if collection_name in SEARCH_KEY_FIELDS else None
+    if prefix:
+        add(await collection.find(combine_filters(base_query, prefix), {"_id": 0}).limit(limit).to_list(limit))
+
+    if search and len(results) < limit:
+        remaining = limit - len(results)
+        try:
+            cursor = collection.find(
+                combine_filters(base_query, {"$text": {"$search": search}}),
+                {"_id": 0, "score": {"$meta": "textScore"}}
+            ).sort([("score", {"$meta": "textScore"})]).limit(remaining + len(seen))
+            add(await cursor.to_list(remaining + len(seen)))
+        except OperationFailure as e:
+            # Sin índice de texto (ej. aún no creado): no romper la búsqueda
+            logger.warning(f"⚠️ Búsqueda de texto no disponible en {collection_name}: {e}")
+
+    return results[:limit]
+
+
+async def backfill_search_keys(db: AsyncIOMotorDatabase, only_missing: bool = True) -> int:
+    """
+    Genera search_keys en documentos que no los tienen. Después de una
+    importación o restauración (que pueden cambiar nombres y códigos sin
+    pasar por la API) se regeneran todos con only_missing=False.
+    """
+    query = {SEARCH_KEYS_FIELD: {"$exists": False}} if only_missing else {}
+    updated = 0
+    for collection_name, fields in SEARCH_KEY_FIELDS.items():
+        collection = db[collection_name]
+        projection = {"_id": 1, **{field: 1 for field in fields}}
+        batch = []
+        async for doc in collection.find(query, projection):
+            batch.append(UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {SEARCH_KEYS_FIELD: build_search_keys(collection_name, doc)}}
+            ))
+            if len(batch) >= 1000:
+                result = await collection.bulk_write(batch, ordered=False)
+                updated += result.modified_count
+                batch = []
+        if batch:
+            result = await collection.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+
+    if updated:
+        logger.info(f"🔎 search_keys generados para {updated} documentos")
+    return updated
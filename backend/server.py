@@ -1,11 +1,11 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Response, Query, Request
 from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from pathlib import Path
+import asyncio
 import os
 import logging
-import io
 import uuid
 from typing import List, Optional
 from datetime import datetime, timezone, timedelta
@@ -42,8 +42,31 @@ from auth import (
     verify_password, get_password_hash, create_access_token,
     get_current_user, require_admin
 )
-from database import Database, serialize_doc, serialize_docs, prepare_doc_for_insert, restore_datetimes
+from database import Database, serialize_doc, serialize_docs, prepare_doc_for_insert, restore_datetimes, run_migration_once, touch, delete_tracked
+from media_service import (
+    store_media, externalize_media, externalize_images, get_media_variant, stream_media,
+    media_urls, media_id_from_path, migrate_inline_media, served_content_type, MediaError,
+    CACHE_CONTROL, FALLBACK_CONTENT_TYPE, VARIANTS, ORIGINAL, MAX_MEDIA_SIZE
+)
+from fast_response import FastJSONResponse, trusted_list_response
+from http_middleware import CompressionMiddleware, ConditionalGetMiddleware
+from collection_versions import collection_versions
+from catalog_service import public_catalog_cache, invalidate_public_catalog, filter_catalog_by_zone
+from search_service import with_search_keys, search_filter, ranked_search, find_reservation_ids_by_invoice, backfill_search_keys
+from date_service import to_bson_date, fortnight_range, date_range, migrate_dates_to_bson
 from google_sheets_service import sheets_service
+from index_service import ensure_indexes, get_index_report
+from invoice_service import (
+    allocate_invoice_number, claim_invoice_number,
+    release_invoice_numbers, sync_invoice_registry
+)
+from expense_service import apply_abono_delta, set_expense_amount, with_expense_totals, backfill_expense_totals
+from settlement_service import settle_reservation_payables, settle_expense
+from pagination import PageParams, get_page_params, paginate, PAGINATION_HEADERS
+from dashboard_service import (
+    build_dashboard_stats, rebuild_dashboard_rollups, track_rollups,
+    RESERVATION_DATETIME_FIELDS
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -52,7 +75,7 @@ load_dotenv(ROOT_DIR / '.env')
 db = Database.get_db()
 
 # Create the main app
-app = FastAPI(title="Espacios Con Piscina - Sistema de Gestión")
+app = FastAPI(title="Espacios Con Piscina - Sistema de Gestión", default_response_class=FastJSONResponse)
 
 # Create API router
 api_router = APIRouter(prefix="/api")
@@ -66,73 +89,30 @@ logger = logging.getLogger(__name__)
 
 # ============ HELPER FUNCTIONS ============
 
-async def get_next_invoice_number() -> int:
-    """Get next available invoice number starting from 1600 - skips manually created numbers"""
-    counter = await db.invoice_counter.find_one({"counter_id": "main_counter"})
-    
-    if not counter:
-        # Initialize counter
-        counter_doc = {"counter_id": "main_counter", "current_number": 1600}
-        await db.invoice_counter.insert_one(counter_doc)
-        invoice_num = 1600
-    else:
-        invoice_num = counter["current_number"]
-    
-    # Verificar si el número ya existe en reservations o abonos (por factura manual de admin)
-    # Si existe, buscar el siguiente número disponible
-    max_attempts = 100  # Evitar bucle infinito
-    attempts = 0
-    
-    while attempts < max_attempts:
-        invoice_str = str(invoice_num)
-        
-        # Verificar en reservations
-        existing_reservation = await db.reservations.find_one({"invoice_number": invoice_str}, {"_id": 0})
-        
-        # Verificar en abonos de reservaciones
-        existing_res_abono = await db.reservation_abonos.find_one({"invoice_number": invoice_str}, {"_id": 0})
-        
-        # Verificar en abonos de gastos
-        existing_exp_abono = await db.expense_abonos.find_one({"invoice_number": invoice_str}, {"_id": 0})
-        
-        if not existing_reservation and not existing_res_abono and not existing_exp_abono:
-            # Número disponible encontrado
-            break
-        # Número ya existe, probar el siguiente
-        invoice_num += 1
-        attempts += 1
-    
-    # Actualizar contador al siguiente número después del encontrado
-    await db.invoice_counter.update_one(
-        {"counter_id": "main_counter"},
-        {"$set": {"current_number": invoice_num + 1}}
-    )
-    
-    return invoice_num
+async def get_next_invoice_number(source: str, ref_id: Optional[str] = None) -> int:
+    """Get next available invoice number starting from 1600 - skips manually created numbers.
+    Allocation is atomic: one $inc on the counter plus a unique insert in invoice_numbers"""
+    return int(await allocate_invoice_number(db, source, ref_id))
 
 def calculate_balance(total: float, paid: float, deposit: float = 0) -> float:
     """Calculate balance due - includes deposit in calculation"""
     return max(0, total + deposit - paid)
 
-async def validate_invoice_number_available(invoice_num: str) -> bool:
-    """Check if an invoice number is available (not used in reservations or abonos)"""
-    # Verificar en reservations
-    existing_reservation = await db.reservations.find_one({"invoice_number": invoice_num}, {"_id": 0})
-    if existing_reservation:
-        return False
-    
-    # Verificar en abonos de reservaciones
-    existing_res_abono = await db.reservation_abonos.find_one({"invoice_number": invoice_num}, {"_id": 0})
-    if existing_res_abono:
-        return False
-    
-    # Verificar en abonos de gastos
-    existing_exp_abono = await db.expense_abonos.find_one({"invoice_number": invoice_num}, {"_id": 0})
-    if existing_exp_abono:
-        return False
-    
-    return True
-
+async def get_customer_identifications(customer_ids, cache: Optional[dict] = None) -> dict:
+    """Map customer_id -> identification document with a single $in query.
+    Pass a dict as cache to reuse lookups within the same request"""
+    cache = {} if cache is None else cache
+    missing = list({cid for cid in customer_ids if cid and cid not in cache})
+    if missing:
+        for cid in missing:
+            cache[cid] = None
+        cursor = db.customers.find(
+            {"id": {"$in": missing}},
+            {"_id": 0, "id": 1, "identification_document": 1, "dni": 1}
+        )
+        async for customer in cursor:
+            cache[customer["id"]] = customer.get("identification_document") or customer.get("dni")
+    return cache
 
 # ============ AUTH ENDPOINTS ============
 
@@ -298,7 +278,7 @@ async def update_user(
     
     await db.users.update_one(
         {"id": user_id},
-        {"$set": update_data}
+        touch({"$set": update_data})
     )
     
     updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
@@ -311,8 +291,8 @@ async def delete_user(user_id: str, current_user: dict = Depends(require_admin))
     if user_id == current_user["id"]:
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
     
-    result = await db.users.delete_one({"id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "users", {"id": user_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
 
@@ -329,7 +309,7 @@ async def toggle_user_status(user_id: str, current_user: dict = Depends(require_
     new_status = not user.get("is_active", True)
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"is_active": new_status}}
+        touch({"$set": {"is_active": new_status}})
     )
     
     return {"message": f"User {'activated' if new_status else 'deactivated'} successfully", "is_active": new_status}
@@ -352,7 +332,7 @@ async def approve_user(user_id: str, current_user: dict = Depends(require_admin)
     
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"is_approved": True}}
+        touch({"$set": {"is_approved": True}})
     )
     
     return {"message": "User approved successfully", "is_approved": True}
@@ -360,8 +340,8 @@ async def approve_user(user_id: str, current_user: dict = Depends(require_admin)
 @api_router.patch("/users/{user_id}/reject")
 async def reject_user(user_id: str, current_user: dict = Depends(require_admin)):
     """Reject a pending user (delete account) (admin only)"""
-    result = await db.users.delete_one({"id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "users", {"id": user_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User rejected and deleted successfully"}
 
@@ -474,7 +454,7 @@ async def update_invoice_template(
     
     # Prepare update data
     update_dict = {k: v for k, v in template_data.model_dump(exclude_unset=True).items() if v is not None}
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
     
     if not existing_template:
         # Create new template
@@ -542,7 +522,7 @@ async def update_quotation_terms(
     
     # Prepare update data
     update_dict = {k: v for k, v in terms_data.model_dump(exclude_unset=True).items() if v is not None}
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
     update_dict["updated_by"] = current_user["id"]
     
     if not existing_terms:
@@ -575,8 +555,11 @@ async def get_logo(current_user: dict = Depends(get_current_user)):
     if not logo:
         return {"logo_data": None, "logo_filename": None}
     
+    # logo_data se mantiene por compatibilidad: ahora es la URL del archivo
+    logo_url = logo.get("logo_url") or logo.get("logo_data")
     return {
-        "logo_data": logo.get("logo_data"),
+        "logo_data": logo_url,
+        "logo_url": logo_url,
         "logo_filename": logo.get("logo_filename"),
         "logo_mimetype": logo.get("logo_mimetype")
     }
@@ -589,9 +572,14 @@ async def upload_logo(
     current_user: dict = Depends(require_admin)
 ):
     """Upload new logo (admin only)"""
+    try:
+        logo_url = await externalize_media(db, logo_data, created_by=current_user["id"])
+    except MediaError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
     logo_config = LogoConfig(
         config_id="main_logo",
-        logo_data=logo_data,
+        logo_url=logo_url,
         logo_filename=logo_filename,
         logo_mimetype=logo_mimetype,
         uploaded_by=current_user["id"]
@@ -599,9 +587,10 @@ async def upload_logo(
     
     doc = prepare_doc_for_insert(logo_config.model_dump())
     
+    doc.pop("logo_data", None)
     await db.logo_config.update_one(
         {"config_id": "main_logo"},
-        {"$set": doc},
+        {"$set": doc, "$unset": {"logo_data": ""}},
         upsert=True
     )
     
@@ -617,21 +606,83 @@ async def delete_logo(current_user: dict = Depends(require_admin)):
     
     return {"message": "Logo eliminado exitosamente"}
 
+# ============ MEDIA ENDPOINTS ============
+
+async def externalize_villa_images(images: Optional[List[str]], user_id: str) -> List[str]:
+    """externalize_images with rejected files (type/size) answered as 400/413"""
+    try:
+        return await externalize_images(db, images, user_id)
+    except MediaError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@api_router.post("/media")
+async def upload_media(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    """Upload an image or video; returns its URL and thumbnail/WebP variants"""
+    data = await file.read(MAX_MEDIA_SIZE + 1)
+    if not data:
+        raise HTTPException(status_code=400, detail="Archivo vacío")
+    try:
+        media = await store_media(db, data, file.content_type, filename=file.filename, created_by=current_user["id"])
+    except MediaError as e:
+        # 413 si excede el tamaño, 400 si el tipo no está permitido
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return media_urls(media)
+
+@api_router.get("/media/{media_id}")
+async def get_media(media_id: str, request: Request, variant: str = ORIGINAL):
+    """Stream a stored file (public, cacheable; the content of an id never changes).
+    media_id may carry the file extension (abc123.mp4)"""
+    if variant not in VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Variante inválida. Opciones: {', '.join(VARIANTS)}")
+    info = await get_media_variant(db, media_id_from_path(media_id), variant)
+    if not info:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    
+    etag = f'"{info["etag"]}"'
+    # nosniff: el navegador usa el Content-Type tal cual y no interpreta el archivo como HTML
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    media_type = served_content_type(info["content_type"])
+    if media_type == FALLBACK_CONTENT_TYPE:
+        # Archivos guardados antes de validar el tipo: solo como descarga
+        headers["Content-Disposition"] = "attachment"
+    headers["Content-Length"] = str(info["size"])
+    return StreamingResponse(stream_media(db, info), media_type=media_type, headers=headers)
+
 # ============ CUSTOMER ENDPOINTS ============
 
 @api_router.post("/customers", response_model=Customer)
 async def create_customer(customer_data: CustomerCreate, current_user: dict = Depends(get_current_user)):
     """Create a new customer"""
     customer = Customer(**customer_data.model_dump(), created_by=current_user["id"])
-    doc = prepare_doc_for_insert(customer.model_dump())
+    doc = with_search_keys("customers", prepare_doc_for_insert(customer.model_dump()))
     await db.customers.insert_one(doc)
     return customer
 
 @api_router.get("/customers", response_model=List[Customer])
-async def get_customers(current_user: dict = Depends(get_current_user)):
+async def get_customers(
+    response: Response,
+    search: Optional[str] = None,
+    page: PageParams = Depends(get_page_params),
+    current_user: dict = Depends(get_current_user)
+):
     """Get all customers ordered alphabetically by name"""
-    customers = await db.customers.find({}, {"_id": 0}).sort("name", 1).to_list(1000)
-    return [restore_datetimes(c, ["created_at"]) for c in customers]
+    query = search_filter("customers", search) or {}
+    
+    customers = await paginate(db.customers, query, page, response, sort_field="name", direction=1)
+    return trusted_list_response(customers, Customer, response)
+
+@api_router.get("/customers/search", response_model=List[Customer])
+async def search_customers(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: dict = Depends(get_current_user)
+):
+    """Search customers by name, document, phone or email ranked by relevance"""
+    customers = await ranked_search(db, "customers", q, limit=limit)
+    return trusted_list_response(customers, Customer)
 
 @api_router.get("/customers/{customer_id}", response_model=Customer)
 async def get_customer(customer_id: str, current_user: dict = Depends(get_current_user)):
@@ -656,8 +707,9 @@ async def update_customer(customer_id: str, customer_data: CustomerCreate, curre
     for key, value in update_dict.items():
         if isinstance(value, datetime):
             update_dict[key] = value.isoformat()
+    with_search_keys("customers", update_dict)
     
-    await db.customers.update_one({"id": customer_id}, {"$set": update_dict})
+    await db.customers.update_one({"id": customer_id}, touch({"$set": update_dict}))
     
     # Devolver el cliente actualizado
     updated_customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
@@ -666,8 +718,8 @@ async def update_customer(customer_id: str, customer_data: CustomerCreate, curre
 @api_router.delete("/customers/{customer_id}")
 async def delete_customer(customer_id: str, current_user: dict = Depends(require_admin)):
     """Delete a customer (admin only)"""
-    result = await db.customers.delete_one({"id": customer_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "customers", {"id": customer_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
     return {"message": "Customer deleted successfully"}
 
@@ -679,6 +731,7 @@ async def create_category(category_data: CategoryCreate, current_user: dict = De
     category = Category(**category_data.model_dump(), created_by=current_user["id"])
     doc = prepare_doc_for_insert(category.model_dump())
     await db.categories.insert_one(doc)
+    invalidate_public_catalog()
     return category
 
 @api_router.get("/categories", response_model=List[Category])
@@ -707,7 +760,8 @@ async def update_category(category_id: str, update_data: CategoryUpdate, current
     update_dict = {k: v for k, v in update_data.model_dump(exclude_unset=True).items() if v is not None}
     
     if update_dict:
-        await db.categories.update_one({"id": category_id}, {"$set": update_dict})
+        await db.categories.update_one({"id": category_id}, touch({"$set": update_dict}))
+        invalidate_public_catalog()
     
     updated = await db.categories.find_one({"id": category_id}, {"_id": 0})
     return restore_datetimes(updated, ["created_at"])
@@ -718,11 +772,12 @@ async def delete_category(category_id: str, current_user: dict = Depends(require
     # Remover category_id de todas las villas que la tengan asignada
     await db.villas.update_many(
         {"category_id": category_id},
-        {"$set": {"category_id": None}}
+        touch({"$set": {"category_id": None}})
     )
     
-    result = await db.categories.delete_one({"id": category_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "categories", {"id": category_id})
+    invalidate_public_catalog()
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Category not found")
     return {"message": "Category deleted successfully, villas unassigned"}
 
@@ -753,7 +808,7 @@ async def update_expense_category(category_id: str, update_data: ExpenseCategory
     update_dict = {k: v for k, v in update_data.model_dump(exclude_unset=True).items() if v is not None}
     
     if update_dict:
-        await db.expense_categories.update_one({"id": category_id}, {"$set": update_dict})
+        await db.expense_categories.update_one({"id": category_id}, touch({"$set": update_dict}))
     
     updated = await db.expense_categories.find_one({"id": category_id}, {"_id": 0})
     return restore_datetimes(updated, ["created_at"])
@@ -763,11 +818,11 @@ async def delete_expense_category(category_id: str, current_user: dict = Depends
     """Delete an expense category (admin only) - expenses quedan sin categoría"""
     await db.expenses.update_many(
         {"expense_category_id": category_id},
-        {"$set": {"expense_category_id": None}}
+        touch({"$set": {"expense_category_id": None}})
     )
     
-    result = await db.expense_categories.delete_one({"id": category_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "expense_categories", {"id": category_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Expense category not found")
     return {"message": "Expense category deleted successfully, expenses unassigned"}
 
@@ -789,10 +844,12 @@ async def create_villa(villa_data: VillaCreate, current_user: dict = Depends(get
         price["show_in_web"] = True
     for price in villa_dict.get("evento_prices", []):
         price["show_in_web"] = True
+    villa_dict["public_images"] = await externalize_villa_images(villa_dict.get("public_images"), current_user["id"])
     
     villa = Villa(**villa_dict, created_by=current_user["id"])
-    doc = prepare_doc_for_insert(villa.model_dump())
+    doc = with_search_keys("villas", prepare_doc_for_insert(villa.model_dump()))
     await db.villas.insert_one(doc)
+    invalidate_public_catalog()
     return villa
 
 def clean_villa_data(villa):
@@ -814,15 +871,12 @@ async def get_villas(
     if category_id:
         query["category_id"] = category_id
     
-    # Búsqueda por nombre o código
+    # Búsqueda por código o nombre: prefijos primero, luego por relevancia
     if search:
-        query["$or"] = [
-            {"code": {"$regex": search, "$options": "i"}},
-            {"name": {"$regex": search, "$options": "i"}}
-        ]
-    
-    villas = await db.villas.find(query, {"_id": 0}).to_list(1000)
-    return [restore_datetimes(clean_villa_data(v), ["created_at"]) for v in villas]
+        villas = await ranked_search(db, "villas", search, base_query=query, limit=1000)
+    else:
+        villas = await db.villas.find(query, {"_id": 0}).to_list(1000)
+    return trusted_list_response((clean_villa_data(v) for v in villas), Villa)
 
 @api_router.get("/villas/{villa_id}", response_model=Villa)
 async def get_villa(villa_id: str, current_user: dict = Depends(get_current_user)):
@@ -847,8 +901,11 @@ async def update_villa(villa_id: str, villa_data: VillaCreate, current_user: dic
         price["show_in_web"] = True
     for price in update_dict.get("evento_prices", []):
         price["show_in_web"] = True
+    update_dict["public_images"] = await externalize_villa_images(update_dict.get("public_images"), current_user["id"])
+    with_search_keys("villas", update_dict)
     
-    await db.villas.update_one({"id": villa_id}, {"$set": update_dict})
+    await db.villas.update_one({"id": villa_id}, touch({"$set": update_dict}))
+    invalidate_public_catalog()
     
     updated = await db.villas.find_one({"id": villa_id}, {"_id": 0})
     return restore_datetimes(updated, ["created_at"])
@@ -856,8 +913,9 @@ async def update_villa(villa_id: str, villa_data: VillaCreate, current_user: dic
 @api_router.delete("/villas/{villa_id}")
 async def delete_villa(villa_id: str, current_user: dict = Depends(require_admin)):
     """Delete a villa (admin only)"""
-    result = await db.villas.delete_one({"id": villa_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "villas", {"id": villa_id})
+    invalidate_public_catalog()
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Villa not found")
     return {"message": "Villa deleted successfully"}
 
@@ -930,7 +988,7 @@ async def update_extra_service(service_id: str, service_data: ExtraServiceCreate
         raise HTTPException(status_code=404, detail="Service not found")
     
     update_dict = service_data.model_dump()
-    await db.extra_services.update_one({"id": service_id}, {"$set": update_dict})
+    await db.extra_services.update_one({"id": service_id}, touch({"$set": update_dict}))
     
     updated = await db.extra_services.find_one({"id": service_id}, {"_id": 0})
     return restore_datetimes(updated, ["created_at"])
@@ -938,8 +996,8 @@ async def update_extra_service(service_id: str, service_data: ExtraServiceCreate
 @api_router.delete("/extra-services/{service_id}")
 async def delete_extra_service(service_id: str, current_user: dict = Depends(require_admin)):
     """Delete an extra service (admin only)"""
-    result = await db.extra_services.delete_one({"id": service_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "extra_services", {"id": service_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Service not found")
     return {"message": "Service deleted successfully"}
 
@@ -948,37 +1006,44 @@ async def delete_extra_service(service_id: str, current_user: dict = Depends(req
 @api_router.post("/reservations", response_model=Reservation)
 async def create_reservation(reservation_data: ReservationCreate, current_user: dict = Depends(get_current_user)):
     """Create a new reservation"""
+    reservation_id = str(uuid.uuid4())
+    
     # Si el usuario es admin y proporciona un invoice_number, usarlo
     # De lo contrario, obtener el siguiente número disponible
     if hasattr(reservation_data, 'invoice_number') and reservation_data.invoice_number is not None and current_user.get("role") == "admin":
         # Admin proporcionó un número manual - convertir a string
         invoice_number = str(reservation_data.invoice_number)
         
-        # Verificar si ya existe
-        existing = await db.reservations.find_one({"invoice_number": invoice_number}, {"_id": 0})
-        if existing:
+        # Reservar el número de forma atómica (falla si ya existe)
+        if not await claim_invoice_number(db, invoice_number, "reservation", reservation_id):
             raise HTTPException(status_code=400, detail=f"El número de factura {invoice_number} ya existe")
     else:
         # Obtener siguiente número automático disponible
-        invoice_number_int = await get_next_invoice_number()
+        invoice_number_int = await get_next_invoice_number("reservation", reservation_id)
         invoice_number = str(invoice_number_int)
     
-    # Calculate balance: Total + Depósito - Pagado
-    balance_due = calculate_balance(
-        reservation_data.total_amount, 
-        reservation_data.amount_paid,
-        reservation_data.deposit
-    )
-    
-    reservation = Reservation(
-        **reservation_data.model_dump(exclude={'invoice_number'}),
-        invoice_number=invoice_number,
-        balance_due=balance_due,
-        created_by=current_user["id"]
-    )
-    
-    doc = prepare_doc_for_insert(reservation.model_dump())
-    await db.reservations.insert_one(doc)
+    try:
+        # Calculate balance: Total + Depósito - Pagado
+        balance_due = calculate_balance(
+            reservation_data.total_amount, 
+            reservation_data.amount_paid,
+            reservation_data.deposit
+        )
+        
+        reservation = Reservation(
+            **reservation_data.model_dump(exclude={'invoice_number'}),
+            id=reservation_id,
+            invoice_number=invoice_number,
+            balance_due=balance_due,
+            created_by=current_user["id"]
+        )
+        
+        doc = prepare_doc_for_insert(reservation.model_dump())
+        await db.reservations.insert_one(doc)
+    except Exception:
+        # Sin reservación guardada el número queda libre para reintentar
+        await release_invoice_numbers(db, [invoice_number])
+        raise
     
     # AUTO-CREAR GASTO PARA PAGO AL PROPIETARIO (SIEMPRE, incluso si owner_price es 0)
     if reservation_data.villa_id:
@@ -1042,16 +1107,16 @@ async def create_reservation(reservation_data: ReservationCreate, current_user:
                 "description": description,
                 "amount": total_owner_payment,
                 "currency": reservation_data.currency,
-                "expense_date": reservation_data.reservation_date if isinstance(reservation_data.reservation_date, str) else reservation_data.reservation_date.isoformat(),
+                "expense_date": to_bson_date(reservation_data.reservation_date),
                 "payment_status": "pending",
                 "notes": ''.join(notes_parts),
                 "related_reservation_id": reservation.id,
                 "services_details": services_details if services_details else None,  # Nuevo campo
-                "created_at": datetime.now(timezone.utc).isoformat(),
+                "created_at": datetime.now(timezone.utc),
                 "created_by": current_user["id"]
             }
             
-            await db.expenses.insert_one(expense)
+            await db.expenses.insert_one(prepare_doc_for_insert(expense))
     
     # AUTO-CREAR GASTO CONTENEDOR PARA "SOLO SERVICIOS" (cuando NO hay villa)
     # Esto permite que los gastos de suplidores se vean en la vista principal
@@ -1096,16 +1161,16 @@ async def create_reservation(reservation_data: ReservationCreate, current_user:
             "description": description,
             "amount": total_services_cost,
             "currency": reservation_data.currency,
-            "expense_date": reservation_data.reservation_date if isinstance(reservation_data.reservation_date, str) else reservation_data.reservation_date.isoformat(),
+            "expense_date": to_bson_date(reservation_data.reservation_date),
             "payment_status": "pending",
             "notes": ''.join(notes_parts),
             "related_reservation_id": reservation.id,
             "services_details": services_details if services_details else None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": datetime.now(timezone.utc),
             "created_by": current_user["id"]
         }
         
-        await db.expenses.insert_one(expense)
+        await db.expenses.insert_one(prepare_doc_for_insert(expense))
     
     # AUTO-CREAR GASTOS PARA SUPLIDORES DE SERVICIOS ADICIONALES
     # Estos gastos se crean pero NO se muestran en la lista principal
@@ -1127,16 +1192,16 @@ async def create_reservation(reservation_data: ReservationCreate, current_user:
                     "description": f"Pago suplidor: {supplier_name} - {service_name} - Factura #{invoice_number}",
                     "amount": supplier_total,
                     "currency": reservation_data.currency,
-                    "expense_date": reservation_data.reservation_date if isinstance(reservation_data.reservation_date, str) else reservation_data.reservation_date.isoformat(),
+                    "expense_date": to_bson_date(reservation_data.reservation_date),
                     "payment_status": "pending",
                     "notes": f"Auto-generado. Cliente: {reservation_data.customer_name}. Cantidad: {quantity}",
                     "related_reservation_id": reservation.id,
                     "parent_expense_id": None,  # Se llenará después
-                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "created_at": datetime.now(timezone.utc),
                     "created_by": current_user["id"]
                 }
                 
-                await db.expenses.insert_one(supplier_expense)
+                await db.expenses.insert_one(prepare_doc_for_insert(supplier_expense))
     
     # Si hay owner_price > 0, crear/actualizar deuda al propietario de la villa
     if reservation_data.owner_price > 0 and reservation_data.villa_id:
@@ -1160,17 +1225,17 @@ async def create_reservation(reservation_data: ReservationCreate, current_user:
                     "amount_paid": 0,
                     "balance_due": reservation_data.owner_price,
                     "notes": f"Auto-generado para {villa['code']}",
-                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "created_at": datetime.now(timezone.utc),
                     "created_by": current_user["id"]
                 }
-                await db.villa_owners.insert_one(owner)
+                await db.villa_owners.insert_one(prepare_doc_for_insert(owner))
             else:
                 # Actualizar deuda existente
                 new_total = owner.get("total_owed", 0) + reservation_data.owner_price
                 new_balance = new_total - owner.get("amount_paid", 0)
                 await db.villa_owners.update_one(
                     {"id": owner["id"]},
-                    {"$set": {"total_owed": new_total, "balance_due": new_balance}}
+                    touch({"$set": {"total_owed": new_total, "balance_due": new_balance}})
                 )
     
     # AUTO-CREAR COMISIÓN PARA EL USUARIO
@@ -1187,7 +1252,7 @@ async def create_reservation(reservation_data: ReservationCreate, current_user:
             villa_code=villa_code,
             villa_name=villa_name,
             customer_name=reservation_data.customer_name,
-            reservation_date=reservation_data.reservation_date.isoformat() if isinstance(reservation_data.reservation_date, datetime) else reservation_data.reservation_date,
+            reservation_date=reservation_data.reservation_date,
             amount=250.0,  # Comisión por defecto
             notes=f"Comisión por reservación #{invoice_number}"
         )
@@ -1199,35 +1264,37 @@ async def create_reservation(reservation_data: ReservationCreate, current_user:
         # Si falla la comisión, no fallar la reservación
         print(f"Error creating commission: {e}")
     
+    # Reservación y gastos auto-generados entran al dashboard
+    await track_rollups(db, reservation_ids=[reservation_id])
+    
     return reservation
 
 @api_router.get("/reservations", response_model=List[Reservation])
 async def get_reservations(
+    response: Response,
     status: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    page: PageParams = Depends(get_page_params),
     current_user: dict = Depends(get_current_user)
 ):
     """Get all reservations with customer identification"""
     query = {}
     if status:
         query["status"] = status
+    if customer_id:
+        query["customer_id"] = customer_id
     
-    reservations = await db.reservations.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    datetime_fields = ["reservation_date", "created_at", "updated_at"]
+    reservations = await paginate(db.reservations, query, page, response)
     
-    # Enrich with customer identification document
-    enriched_reservations = []
+    # Enrich with customer identification document (one query for all customers on the page)
+    identifications = await get_customer_identifications(r.get("customer_id") for r in reservations)
     for r in reservations:
-        restored = restore_datetimes(r, datetime_fields)
-        
-        # Get customer identification if customer_id exists
-        if r.get("customer_id"):
-            customer = await db.customers.find_one({"id": r["customer_id"]}, {"_id": 0})
-            if customer:
-                restored["customer_identification_document"] = customer.get("identification_document") or customer.get("dni")
-        
-        enriched_reservations.append(restored)
+        if r.get("customer_id") in identifications:
+            r["customer_identification_document"] = identifications[r["customer_id"]]
     
-    return enriched_reservations
+    return trusted_list_response(
+        reservations, Reservation, response, extra_fields=["customer_identification_document"]
+    )
 
 @api_router.get("/reservations/{reservation_id}", response_model=Reservation)
 async def get_reservation(reservation_id: str, current_user: dict = Depends(get_current_user)):
@@ -1261,18 +1328,12 @@ async def update_reservation(
         paid = update_dict.get("amount_paid", existing["amount_paid"])
         deposit = update_dict.get("deposit", existing.get("deposit", 0))
         update_dict["balance_due"] = calculate_balance(total, paid, deposit)
-        update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
         
-        prepared_update = {}
-        for key, value in update_dict.items():
-            if isinstance(value, datetime):
-                prepared_update[key] = value.isoformat()
-            else:
-                prepared_update[key] = value
+        prepared_update = prepare_doc_for_insert(update_dict)
         
         await db.reservations.update_one(
             {"id": reservation_id},
-            {"$set": prepared_update}
+            touch({"$set": prepared_update})
         )
         
         # Manejar cambios en deposit_returned
@@ -1292,7 +1353,7 @@ async def update_reservation(
                     print(f"✅ [DEPOSITO] Actualizando gasto de devolución existente: {deposit_expense['id']}")
                     await db.expenses.update_one(
                         {"id": deposit_expense["id"]},
-                        {"$set": {"payment_status": "paid"}}
+                        touch({"$set": {"payment_status": "paid"}})
                     )
                 else:
                     # Crear nuevo gasto de devolución de depósito
@@ -1303,14 +1364,14 @@ async def update_reservation(
                         "amount": existing.get("deposit", 0),
                         "currency": existing.get("currency", "DOP"),
                         "category": "devolucion_deposito",
-                        "expense_date": datetime.now(timezone.utc).isoformat(),
+                        "expense_date": datetime.now(timezone.utc),
                         "payment_status": "paid",
                         "related_reservation_id": reservation_id,
                         "created_by": current_user["id"],
-                        "created_at": datetime.now(timezone.utc).isoformat(),
-                        "updated_at": datetime.now(timezone.utc).isoformat()
+                        "created_at": datetime.now(timezone.utc),
+                        "updated_at": datetime.now(timezone.utc)
                     }
-                    await db.expenses.insert_one(deposit_expense_data)
+                    await db.expenses.insert_one(prepare_doc_for_insert(deposit_expense_data))
                     print(f"✅ [DEPOSITO] Gasto de devolución creado")
             else:
                 # DESMARCAR como devuelto
@@ -1326,64 +1387,17 @@ async def update_reservation(
                     print(f"📝 [DEPOSITO] Actualizando gasto de devolución a pending")
                     await db.expenses.update_one(
                         {"id": deposit_expense["id"]},
-                        {"$set": {"payment_status": "pending"}}
+                        touch({"$set": {"payment_status": "pending"}})
                     )
             
-            # Recalcular estado del gasto propietario después de cambio en depósito
-            owner_expense = await db.expenses.find_one({
-                "related_reservation_id": reservation_id,
-                "category": "pago_propietario"
-            }, {"_id": 0})
-            
-            if owner_expense:
-                print(f"🔍 [DEPOSITO] Verificando estado del gasto del propietario")
-                # Verificar si todos los requisitos están cumplidos
-                owner_abonos = await db.expense_abonos.find({"expense_id": owner_expense["id"]}, {"_id": 0}).to_list(1000)
-                owner_total_paid = sum(a.get("amount", 0) for a in owner_abonos)
-                owner_paid = owner_total_paid >= owner_expense.get("amount", 0)
-                
-                # Verificar suplidores
-                supplier_expenses = await db.expenses.find({
-                    "related_reservation_id": reservation_id,
-                    "category": "pago_suplidor"
-                }, {"_id": 0}).to_list(1000)
-                
-                all_suppliers_paid = True
-                for supplier_expense in supplier_expenses:
-                    supplier_abonos = await db.expense_abonos.find({"expense_id": supplier_expense["id"]}, {"_id": 0}).to_list(1000)
-                    supplier_total_paid = sum(a.get("amount", 0) for a in supplier_abonos)
-                    if supplier_total_paid < supplier_expense.get("amount", 0):
-                        all_suppliers_paid = False
-                        break
-                
-                # Verificar estado ACTUAL del depósito (después del cambio)
-                deposit_expense_check = await db.expenses.find_one({
-                    "related_reservation_id": reservation_id,
-                    "category": "devolucion_deposito",
-                    "payment_status": "paid"
-                }, {"_id": 0})
-                deposit_returned = deposit_expense_check is not None
-                
-                # Actualizar estado del gasto del propietario
-                new_status = "paid" if (owner_paid and all_suppliers_paid and deposit_returned) else "pending"
-                print(f"📌 [DEPOSITO] Propietario: {owner_paid}, Suplidores: {all_suppliers_paid}, Depósito: {deposit_returned} → Estado: {new_status}")
-                
-                await db.expenses.update_one(
-                    {"id": owner_expense["id"]},
-                    {"$set": {"payment_status": new_status}}
-                )
-                print(f"✅ [DEPOSITO] Estado del gasto propietario actualizado a: {new_status}")
-        
         # Si se actualizó la fecha de reservación, actualizar también los gastos relacionados
         if "reservation_date" in update_dict:
-            new_date = update_dict["reservation_date"]
-            if isinstance(new_date, datetime):
-                new_date = new_date.isoformat()
+            new_date = to_bson_date(update_dict["reservation_date"])
             
             # Actualizar todos los gastos relacionados con esta reservación
             await db.expenses.update_many(
                 {"related_reservation_id": reservation_id},
-                {"$set": {"expense_date": new_date}}
+                touch({"$set": {"expense_date": new_date}})
             )
         
         # Si cambió owner_price (por horas/personas extras), actualizar gasto propietario
@@ -1401,49 +1415,9 @@ async def update_reservation(
                 
                 print(f"📝 [UPDATE_RESERVATION] Actualizando gasto propietario: {old_amount} → {new_amount}")
                 
-                # Actualizar el monto del gasto
-                await db.expenses.update_one(
-                    {"id": owner_expense["id"]},
-                    {"$set": {"amount": new_amount}}
-                )
-                
-                # Recalcular estado
-                owner_abonos = await db.expense_abonos.find({"expense_id": owner_expense["id"]}, {"_id": 0}).to_list(1000)
-                owner_total_paid = sum(a.get("amount", 0) for a in owner_abonos)
-                owner_paid = owner_total_paid >= new_amount
+                # Actualizar el monto del gasto (y su balance_due)
+                await set_expense_amount(db, owner_expense["id"], new_amount)
                 
-                # Verificar suplidores
-                supplier_expenses = await db.expenses.find({
-                    "related_reservation_id": reservation_id,
-                    "category": "pago_suplidor"
-                }, {"_id": 0}).to_list(1000)
-                
-                all_suppliers_paid = True
-                for supplier_expense in supplier_expenses:
-                    supplier_abonos = await db.expense_abonos.find({"expense_id": supplier_expense["id"]}, {"_id": 0}).to_list(1000)
-                    supplier_total_paid = sum(a.get("amount", 0) for a in supplier_abonos)
-                    if supplier_total_paid < supplier_expense.get("amount", 0):
-                        all_suppliers_paid = False
-                        break
-                
-                # Verificar depósito
-                deposit_returned = True
-                if existing.get("deposit", 0) > 0:
-                    deposit_expense = await db.expenses.find_one({
-                        "related_reservation_id": reservation_id,
-                        "category": "devolucion_deposito",
-                        "payment_status": "paid"
-                    }, {"_id": 0})
-                    deposit_returned = deposit_expense is not None
-                
-                # Actualizar estado
-                new_owner_status = "paid" if (owner_paid and all_suppliers_paid and deposit_returned) else "pending"
-                print(f"📌 [UPDATE_RESERVATION] Estado propietario: {new_owner_status} (Owner: {owner_paid}, Supp: {all_suppliers_paid}, Dep: {deposit_returned})")
-                
-                await db.expenses.update_one(
-                    {"id": owner_expense["id"]},
-                    {"$set": {"payment_status": new_owner_status}}
-                )
                 print(f"✅ [UPDATE_RESERVATION] Gasto propietario actualizado")
         
         # Si se agregaron/modificaron servicios extras, procesar gastos de suplidores
@@ -1483,25 +1457,8 @@ async def update_reservation(
                         if old_amount != new_supplier_cost:
                             print(f"📝 [UPDATE_RESERVATION] Actualizando gasto suplidor {supplier_name}: {old_amount} → {new_supplier_cost}")
                             
-                            await db.expenses.update_one(
-                                {"id": existing_expense["id"]},
-                                {"$set": {
-                                    "amount": new_supplier_cost,
-                                    "updated_at": datetime.now(timezone.utc).isoformat()
-                                }}
-                            )
-                            
-                            # Recalcular estado del gasto suplidor
-                            supplier_abonos = await db.expense_abonos.find({"expense_id": existing_expense["id"]}, {"_id": 0}).to_list(1000)
-                            supplier_total_paid = sum(a.get("amount", 0) for a in supplier_abonos)
-                            supplier_paid = supplier_total_paid >= new_supplier_cost
-                            
-                            new_supplier_status = "paid" if supplier_paid else "pending"
-                            await db.expenses.update_one(
-                                {"id": existing_expense["id"]},
-                                {"$set": {"payment_status": new_supplier_status}}
-                            )
-                            print(f"✅ [UPDATE_RESERVATION] Gasto suplidor actualizado, nuevo estado: {new_supplier_status}")
+                            await set_expense_amount(db, existing_expense["id"], new_supplier_cost)
+                            print(f"✅ [UPDATE_RESERVATION] Gasto suplidor actualizado")
                     else:
                         # Crear nuevo gasto para suplidor
                         print(f"📝 [UPDATE_RESERVATION] Creando nuevo gasto para suplidor: {supplier_name}")
@@ -1512,65 +1469,20 @@ async def update_reservation(
                             "amount": new_supplier_cost,
                             "currency": existing.get("currency", "DOP"),
                             "category": "pago_suplidor",
-                            "expense_date": existing.get("reservation_date") if isinstance(existing.get("reservation_date"), str) else datetime.now(timezone.utc).isoformat(),
+                            "expense_date": to_bson_date(existing.get("reservation_date")) or datetime.now(timezone.utc),
                             "payment_status": "pending",
                             "related_reservation_id": reservation_id,
                             "created_by": current_user["id"],
-                            "created_at": datetime.now(timezone.utc).isoformat(),
-                            "updated_at": datetime.now(timezone.utc).isoformat()
+                            "created_at": datetime.now(timezone.utc),
+                            "updated_at": datetime.now(timezone.utc)
                         }
                         
-                        await db.expenses.insert_one(supplier_expense)
+                        await db.expenses.insert_one(prepare_doc_for_insert(supplier_expense))
                         print(f"✅ [UPDATE_RESERVATION] Gasto de suplidor creado: {supplier_expense['id']}")
             
-            # Recalcular estado del gasto propietario
-            owner_expense = await db.expenses.find_one({
-                "related_reservation_id": reservation_id,
-                "category": "pago_propietario"
-            }, {"_id": 0})
-            
-            if owner_expense:
-                print(f"🔄 [UPDATE_RESERVATION] Recalculando estado del gasto propietario...")
-                
-                # Verificar si propietario está pagado
-                owner_abonos = await db.expense_abonos.find({"expense_id": owner_expense["id"]}, {"_id": 0}).to_list(1000)
-                owner_total_paid = sum(a.get("amount", 0) for a in owner_abonos)
-                owner_paid = owner_total_paid >= owner_expense.get("amount", 0)
-                
-                # Verificar si todos los suplidores están pagados
-                all_supplier_expenses = await db.expenses.find({
-                    "related_reservation_id": reservation_id,
-                    "category": "pago_suplidor"
-                }, {"_id": 0}).to_list(1000)
-                
-                all_suppliers_paid = True
-                for supplier_expense in all_supplier_expenses:
-                    supplier_abonos = await db.expense_abonos.find({"expense_id": supplier_expense["id"]}, {"_id": 0}).to_list(1000)
-                    supplier_total_paid = sum(a.get("amount", 0) for a in supplier_abonos)
-                    if supplier_total_paid < supplier_expense.get("amount", 0):
-                        all_suppliers_paid = False
-                        print(f"❌ [UPDATE_RESERVATION] Suplidor sin pagar: {supplier_expense.get('description')}")
-                        break
-                
-                # Verificar si depósito fue devuelto
-                deposit_returned = True
-                if existing.get("deposit", 0) > 0:
-                    deposit_expense = await db.expenses.find_one({
-                        "related_reservation_id": reservation_id,
-                        "category": "devolucion_deposito",
-                        "payment_status": "paid"
-                    }, {"_id": 0})
-                    deposit_returned = deposit_expense is not None
-                
-                # Actualizar estado del propietario
-                new_owner_status = "paid" if (owner_paid and all_suppliers_paid and deposit_returned) else "pending"
-                print(f"📌 [UPDATE_RESERVATION] Nuevo estado propietario: {new_owner_status} (Owner: {owner_paid}, Supp: {all_suppliers_paid}, Dep: {deposit_returned})")
-                
-                await db.expenses.update_one(
-                    {"id": owner_expense["id"]},
-                    {"$set": {"payment_status": new_owner_status}}
-                )
-                print(f"✅ [UPDATE_RESERVATION] Estado propietario actualizado")
+        # Recalcular estados de propietario/suplidores/depósito en una sola pasada
+        await settle_reservation_payables(db, reservation_id)
+        await track_rollups(db, reservation_ids=[reservation_id])
     
     updated = await db.reservations.find_one({"id": reservation_id}, {"_id": 0})
     return restore_datetimes(updated, ["reservation_date", "created_at", "updated_at"])
@@ -1578,25 +1490,32 @@ async def update_reservation(
 @api_router.delete("/reservations/{reservation_id}")
 async def delete_reservation(reservation_id: str, current_user: dict = Depends(require_admin)):
     """Delete a reservation (admin only) - También elimina gasto asociado si existe"""
+    reservation = await db.reservations.find_one({"id": reservation_id}, {"_id": 0, "invoice_number": 1})
+    abono_numbers = await db.reservation_abonos.distinct("invoice_number", {"reservation_id": reservation_id})
+    
     # Eliminar gasto auto-generado asociado a esta reservación
-    await db.expenses.delete_many({"related_reservation_id": reservation_id})
+    await delete_tracked(db, "expenses", {"related_reservation_id": reservation_id}, many=True)
     
     # Eliminar abonos de la reservación
-    await db.reservation_abonos.delete_many({"reservation_id": reservation_id})
+    await delete_tracked(db, "reservation_abonos", {"reservation_id": reservation_id}, many=True)
     
     # Marcar comisión como eliminada (NO eliminar)
     await db.commissions.update_many(
         {"reservation_id": reservation_id},
-        {"$set": {
+        touch({"$set": {
             "invoice_deleted": True,
-            "invoice_deleted_date": datetime.now(timezone.utc).isoformat()
-        }}
+            "invoice_deleted_date": datetime.now(timezone.utc)
+        }})
     )
     
     # Eliminar la reservación
-    result = await db.reservations.delete_one({"id": reservation_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "reservations", {"id": reservation_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Reservation not found")
+    
+    # Liberar números de factura de la reservación y sus abonos
+    await release_invoice_numbers(db, [reservation.get("invoice_number")] + abono_numbers)
+    await track_rollups(db, reservation_ids=[reservation_id])
     return {"message": "Reservation and related expenses deleted successfully, commission marked as deleted"}
 
 # ============ ABONOS TO RESERVATIONS ============
@@ -1608,6 +1527,8 @@ async def add_abono_to_reservation(reservation_id: str, abono_data: AbonoCreate,
     if not reservation:
         raise HTTPException(status_code=404, detail="Reservation not found")
     
+    abono_id = str(uuid.uuid4())
+    
     # Handle invoice_number generation
     if abono_data.invoice_number:
         # Admin provided manual invoice number - validate it's available
@@ -1615,23 +1536,28 @@ async def add_abono_to_reservation(reservation_id: str, abono_data: AbonoCreate,
             raise HTTPException(status_code=403, detail="Only admins can specify manual invoice numbers")
         
         invoice_num_str = str(abono_data.invoice_number)
-        is_available = await validate_invoice_number_available(invoice_num_str)
+        is_available = await claim_invoice_number(db, invoice_num_str, "reservation_abono", abono_id)
         if not is_available:
             raise HTTPException(status_code=400, detail=f"Invoice number {invoice_num_str} is already in use")
         invoice_number = invoice_num_str
     else:
         # Auto-generate invoice number for employee/admin
-        invoice_number = str(await get_next_invoice_number())
+        invoice_number = str(await get_next_invoice_number("reservation_abono", abono_id))
     
-    # Create abono record with invoice_number
-    abono_dict = abono_data.model_dump()
-    abono_dict["invoice_number"] = invoice_number  
-    abono = Abono(**abono_dict, created_by=current_user["id"])
-    abono_doc = prepare_doc_for_insert(abono.model_dump())
-    
-    # Store in reservation_abonos collection
-    abono_doc["reservation_id"] = reservation_id
-    await db.reservation_abonos.insert_one(abono_doc)
+    try:
+        # Create abono record with invoice_number
+        abono_dict = abono_data.model_dump()
+        abono_dict["invoice_number"] = invoice_number  
+        abono = Abono(**abono_dict, id=abono_id, created_by=current_user["id"])
+        abono_doc = prepare_doc_for_insert(abono.model_dump())
+        
+        # Store in reservation_abonos collection
+        abono_doc["reservation_id"] = reservation_id
+        await db.reservation_abonos.insert_one(abono_doc)
+    except Exception:
+        # Sin abono guardado el número queda libre para reintentar
+        await release_invoice_numbers(db, [invoice_number])
+        raise
     
     # Update reservation amount_paid and balance_due: Total + Depósito - Pagado
     new_amount_paid = reservation.get("amount_paid", 0) + abono_data.amount
@@ -1643,12 +1569,12 @@ async def add_abono_to_reservation(reservation_id: str, abono_data: AbonoCreate,
     
     await db.reservations.update_one(
         {"id": reservation_id},
-        {"$set": {
+        touch({"$set": {
             "amount_paid": new_amount_paid,
-            "balance_due": new_balance_due,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
+            "balance_due": new_balance_due
+        }})
     )
+    await track_rollups(db, reservation_ids=[reservation_id])
     
     return abono
 
@@ -1667,7 +1593,8 @@ async def delete_reservation_abono(reservation_id: str, abono_id: str, current_u
         raise HTTPException(status_code=404, detail="Abono not found")
     
     # Delete the abono
-    await db.reservation_abonos.delete_one({"reservation_id": reservation_id, "id": abono_id})
+    await delete_tracked(db, "reservation_abonos", {"reservation_id": reservation_id, "id": abono_id})
+    await release_invoice_numbers(db, [abono_to_delete.get("invoice_number")])
     
     # Recalculate reservation balance: Total + Depósito - Pagado
     reservation = await db.reservations.find_one({"id": reservation_id}, {"_id": 0})
@@ -1686,11 +1613,12 @@ async def delete_reservation_abono(reservation_id: str, abono_id: str, current_u
         
         await db.reservations.update_one(
             {"id": reservation_id},
-            {"$set": {
+            touch({"$set": {
                 "amount_paid": new_amount_paid,
                 "balance_due": new_balance_due
-            }}
+            }})
         )
+        await track_rollups(db, reservation_ids=[reservation_id])
     
     return {"message": "Abono deleted successfully"}
 
@@ -1735,8 +1663,10 @@ async def create_quotation(quotation_data: QuotationCreate, current_user: dict =
 
 @api_router.get("/quotations", response_model=List[Quotation])
 async def get_quotations(
+    response: Response,
     status: Optional[str] = None,
     customer_id: Optional[str] = None,
+    page: PageParams = Depends(get_page_params),
     current_user: dict = Depends(get_current_user)
 ):
     """Get all quotations"""
@@ -1746,8 +1676,8 @@ async def get_quotations(
     if customer_id:
         query["customer_id"] = customer_id
     
-    quotations = await db.quotations.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return quotations
+    quotations = await paginate(db.quotations, query, page, response)
+    return trusted_list_response(quotations, Quotation, response)
 
 @api_router.get("/quotations/{quotation_id}", response_model=Quotation)
 async def get_quotation(quotation_id: str, current_user: dict = Depends(get_current_user)):
@@ -1765,13 +1695,12 @@ async def update_quotation(quotation_id: str, quotation_data: QuotationUpdate, c
         raise HTTPException(status_code=404, detail="Quotation not found")
     
     update_data = {k: v for k, v in quotation_data.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     update_data = prepare_doc_for_insert(update_data)
     
     await db.quotations.update_one(
         {"id": quotation_id},
-        {"$set": update_data}
+        touch({"$set": update_data})
     )
     
     # If quotation was converted to invoice, sync changes to invoice
@@ -1795,7 +1724,7 @@ async def update_quotation(quotation_id: str, quotation_data: QuotationUpdate, c
         if "event_type" in update_data:
             invoice_update["event_type"] = update_data["event_type"]
         if "quotation_date" in update_data:
-            invoice_update["reservation_date"] = update_data["quotation_date"]
+            invoice_update["reservation_date"] = to_bson_date(update_data["quotation_date"])
         if "check_in_time" in update_data:
             invoice_update["check_in_time"] = update_data["check_in_time"]
         if "check_out_time" in update_data:
@@ -1842,11 +1771,11 @@ async def update_quotation(quotation_id: str, quotation_data: QuotationUpdate, c
             invoice_update["internal_notes"] = update_data["internal_notes"]
         
         if invoice_update:
-            invoice_update["updated_at"] = datetime.now(timezone.utc).isoformat()
             await db.reservations.update_one(
                 {"id": invoice_id},
-                {"$set": invoice_update}
+                touch({"$set": invoice_update})
             )
+            await track_rollups(db, reservation_ids=[invoice_id])
     
     updated = await db.quotations.find_one({"id": quotation_id}, {"_id": 0})
     return updated
@@ -1854,8 +1783,8 @@ async def update_quotation(quotation_id: str, quotation_data: QuotationUpdate, c
 @api_router.delete("/quotations/{quotation_id}")
 async def delete_quotation(quotation_id: str, current_user: dict = Depends(require_admin)):
     """Delete a quotation (admin only)"""
-    result = await db.quotations.delete_one({"id": quotation_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "quotations", {"id": quotation_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Quotation not found")
     return {"message": "Quotation deleted successfully"}
 
@@ -1889,15 +1818,8 @@ async def convert_quotation_to_invoice(quotation_id: str, current_user: dict = D
         customer_id = new_customer.id
     
     # Generate invoice number
-    last_reservation = await db.reservations.find_one(
-        sort=[("created_at", -1)],
-        projection={"invoice_number": 1, "_id": 0}
-    )
-    
-    if last_reservation:
-        invoice_number = str(int(last_reservation["invoice_number"]) + 1)
-    else:
-        invoice_number = "1600"
+    reservation_id = str(uuid.uuid4())
+    invoice_number = str(await get_next_invoice_number("reservation", reservation_id))
     
     # Calculate balance
     balance_due = calculate_balance(
@@ -1907,6 +1829,7 @@ async def convert_quotation_to_invoice(quotation_id: str, current_user: dict = D
     )
     
     reservation = Reservation(
+        id=reservation_id,
         customer_id=customer_id,  # Use the created or existing customer_id
         customer_name=quotation["customer_name"],
         villa_id=quotation.get("villa_id"),
@@ -2002,12 +1925,12 @@ async def convert_quotation_to_invoice(quotation_id: str, current_user: dict = D
     # Mark quotation as converted
     await db.quotations.update_one(
         {"id": quotation_id},
-        {"$set": {
+        touch({"$set": {
             "status": "converted",
-            "converted_to_invoice_id": reservation.id,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
+            "converted_to_invoice_id": reservation.id
+        }})
     )
+    await track_rollups(db, reservation_ids=[reservation.id])
     
     return reservation
 
@@ -2051,8 +1974,10 @@ async def create_conduce(conduce_data: ConduceCreate, current_user: dict = Depen
 
 @api_router.get("/conduces", response_model=List[Conduce])
 async def get_conduces(
+    response: Response,
     status: Optional[str] = None,
     recipient_type: Optional[str] = None,
+    page: PageParams = Depends(get_page_params),
     current_user: dict = Depends(get_current_user)
 ):
     """Get all conduces"""
@@ -2062,8 +1987,8 @@ async def get_conduces(
     if recipient_type:
         query["recipient_type"] = recipient_type
     
-    conduces = await db.conduces.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return conduces
+    conduces = await paginate(db.conduces, query, page, response)
+    return trusted_list_response(conduces, Conduce, response)
 
 @api_router.get("/conduces/{conduce_id}", response_model=Conduce)
 async def get_conduce(conduce_id: str, current_user: dict = Depends(get_current_user)):
@@ -2081,13 +2006,12 @@ async def update_conduce(conduce_id: str, conduce_data: ConduceUpdate, current_u
         raise HTTPException(status_code=404, detail="Conduce not found")
     
     update_data = {k: v for k, v in conduce_data.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     update_data = prepare_doc_for_insert(update_data)
     
     await db.conduces.update_one(
         {"id": conduce_id},
-        {"$set": update_data}
+        touch({"$set": update_data})
     )
     
     updated = await db.conduces.find_one({"id": conduce_id}, {"_id": 0})
@@ -2096,24 +2020,30 @@ async def update_conduce(conduce_id: str, conduce_data: ConduceUpdate, current_u
 @api_router.delete("/conduces/{conduce_id}")
 async def delete_conduce(conduce_id: str, current_user: dict = Depends(require_admin)):
     """Delete a conduce (admin only)"""
-    result = await db.conduces.delete_one({"id": conduce_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "conduces", {"id": conduce_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Conduce not found")
     return {"message": "Conduce deleted successfully"}
 
 # ============ COMMISSION ENDPOINTS ============
 
 @api_router.get("/commissions", response_model=List[Commission])
-async def get_commissions(current_user: dict = Depends(require_admin)):
+async def get_commissions(
+    response: Response,
+    user_id: Optional[str] = None,
+    page: PageParams = Depends(get_page_params),
+    current_user: dict = Depends(require_admin)
+):
     """Get all commissions (admin only)"""
-    commissions = await db.commissions.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return [restore_datetimes(c, ["created_at"]) for c in commissions]
+    query = {"user_id": user_id} if user_id else {}
+    commissions = await paginate(db.commissions, query, page, response)
+    return trusted_list_response(commissions, Commission, response)
 
 @api_router.get("/commissions/user/{user_id}", response_model=List[Commission])
 async def get_user_commissions(user_id: str, current_user: dict = Depends(require_admin)):
     """Get commissions for a specific user (admin only)"""
     commissions = await db.commissions.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return [restore_datetimes(c, ["created_at"]) for c in commissions]
+    return trusted_list_response(commissions, Commission)
 
 @api_router.get("/commissions/stats")
 async def get_commission_stats(current_user: dict = Depends(require_admin)):
@@ -2182,7 +2112,7 @@ async def update_commission(
     update_data = {k: v for k, v in commission_update.model_dump().items() if v is not None}
     
     if update_data:
-        await db.commissions.update_one({"id": commission_id}, {"$set": update_data})
+        await db.commissions.update_one({"id": commission_id}, touch({"$set": prepare_doc_for_insert(update_data)}))
     
     updated = await db.commissions.find_one({"id": commission_id}, {"_id": 0})
     return restore_datetimes(updated, ["created_at"])
@@ -2190,8 +2120,8 @@ async def update_commission(
 @api_router.delete("/commissions/{commission_id}")
 async def delete_commission(commission_id: str, current_user: dict = Depends(require_admin)):
     """Delete a commission (admin only)"""
-    result = await db.commissions.delete_one({"id": commission_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "commissions", {"id": commission_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Commission not found")
     return {"message": "Commission deleted successfully"}
 
@@ -2202,11 +2132,11 @@ async def mark_commission_paid(commission_id: str, current_user: dict = Depends(
     if not existing:
         raise HTTPException(status_code=404, detail="Commission not found")
     
-    paid_date = datetime.now(timezone.utc).isoformat()
+    paid_date = datetime.now(timezone.utc)
     
     await db.commissions.update_one(
         {"id": commission_id},
-        {"$set": {"paid": True, "paid_date": paid_date}}
+        touch({"$set": {"paid": True, "paid_date": paid_date}})
     )
     
     return {"message": "Commission marked as paid", "paid_date": paid_date}
@@ -2220,7 +2150,7 @@ async def mark_commission_unpaid(commission_id: str, current_user: dict = Depend
     
     await db.commissions.update_one(
         {"id": commission_id},
-        {"$set": {"paid": False, "paid_date": None}}
+        touch({"$set": {"paid": False, "paid_date": None}})
     )
     
     return {"message": "Commission marked as unpaid"}
@@ -2234,36 +2164,19 @@ async def pay_fortnight_commissions(
     current_user: dict = Depends(require_admin)
 ):
     """Pay all unpaid commissions for a user in a specific fortnight"""
-    # Determinar rango de fechas según quincena
-    if fortnight == 1:
-        start_day = 1
-        end_day = 14
-    else:  # fortnight == 2
-        start_day = 15
-        # Último día del mes
-        if month == 2:
-            end_day = 28 if year % 4 != 0 else 29
-        elif month in [4, 6, 9, 11]:
-            end_day = 30
-        else:
-            end_day = 31
+    # Determinar rango de fechas según quincena (1: días 1-14, 2: del 15 a fin de mes)
+    start_date, end_date = fortnight_range(year, month, fortnight)
     
-    start_date = f"{year}-{month:02d}-{start_day:02d}"
-    end_date = f"{year}-{month:02d}-{end_day:02d}"
-    
-    paid_date = datetime.now(timezone.utc).isoformat()
+    paid_date = datetime.now(timezone.utc)
     
     # Actualizar todas las comisiones no pagadas del usuario en esa quincena
     result = await db.commissions.update_many(
         {
             "user_id": user_id,
             "paid": False,
-            "reservation_date": {
-                "$gte": start_date,
-                "$lte": end_date
-            }
+            "reservation_date": date_range(start_date, end_date)
         },
-        {"$set": {"paid": True, "paid_date": paid_date}}
+        touch({"$set": {"paid": True, "paid_date": paid_date}})
     )
     
     return {
@@ -2283,10 +2196,14 @@ async def create_owner(owner_data: VillaOwnerCreate, current_user: dict = Depend
     return owner
 
 @api_router.get("/owners", response_model=List[VillaOwner])
-async def get_owners(current_user: dict = Depends(get_current_user)):
+async def get_owners(
+    response: Response,
+    page: PageParams = Depends(get_page_params),
+    current_user: dict = Depends(get_current_user)
+):
     """Get all villa owners"""
-    owners = await db.villa_owners.find({}, {"_id": 0}).to_list(1000)
-    return [restore_datetimes(o, ["created_at"]) for o in owners]
+    owners = await paginate(db.villa_owners, {}, page, response, direction=1)
+    return trusted_list_response(owners, VillaOwner, response)
 
 @api_router.get("/owners/{owner_id}", response_model=VillaOwner)
 async def get_owner(owner_id: str, current_user: dict = Depends(get_current_user)):
@@ -2306,7 +2223,7 @@ async def update_owner(owner_id: str, update_data: VillaOwnerUpdate, current_use
     update_dict = {k: v for k, v in update_data.model_dump(exclude_unset=True).items() if v is not None}
     
     if update_dict:
-        await db.villa_owners.update_one({"id": owner_id}, {"$set": update_dict})
+        await db.villa_owners.update_one({"id": owner_id}, touch({"$set": update_dict}))
     
     updated = await db.villa_owners.find_one({"id": owner_id}, {"_id": 0})
     return restore_datetimes(updated, ["created_at"])
@@ -2314,8 +2231,8 @@ async def update_owner(owner_id: str, update_data: VillaOwnerUpdate, current_use
 @api_router.delete("/owners/{owner_id}")
 async def delete_owner(owner_id: str, current_user: dict = Depends(require_admin)):
     """Delete an owner (admin only)"""
-    result = await db.villa_owners.delete_one({"id": owner_id})
-    if result.deleted_count == 0:
+    deleted = await delete_tracked(db, "villa_owners", {"id": owner_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Owner not found")
     return {"message": "Owner deleted successfully"}
 
@@ -2335,7 +2252,7 @@ async def create_owner_payment(owner_id: str, payment_data: PaymentCreate, curre
     
     await db.villa_owners.update_one(
         {"id": owner_id},
-        {"$set": {"amount_paid": new_amount_paid, "balance_due": new_balance_due}}
+        touch({"$set": {"amount_paid": new_amount_paid, "balance_due": new_balance_due}})
     )
     
     return payment
@@ -2358,7 +2275,7 @@ async def update_owner_amounts(owner_id: str, total_owed: float, current_user: d
     
     await db.villa_owners.update_one(
         {"id": owner_id},
-        {"$set": {"total_owed": total_owed, "balance_due": balance_due}}
+        touch({"$set": {"total_owed": total_owed, "balance_due": balance_due}})
     )
     
     return {"message": "Amounts updated successfully", "balance_due": balance_due}
@@ -2369,15 +2286,19 @@ async def update_owner_amounts(owner_id: str, total_owed: float, current_user: d
 async def create_expense(expense_data: ExpenseCreate, current_user: dict = Depends(get_current_user)):
     """Create a new expense"""
     expense = Expense(**expense_data.model_dump(), created_by=current_user["id"])
+    expense.balance_due = expense.amount
     doc = prepare_doc_for_insert(expense.model_dump())
     await db.expenses.insert_one(doc)
+    await track_rollups(db, expense_ids=[expense.id])
     return expense
 
 @api_router.get("/expenses", response_model=List[Expense])
 async def get_expenses(
+    response: Response,
     category: Optional[str] = None,
     category_id: Optional[str] = None,
     search: Optional[str] = None,
+    page: PageParams = Depends(get_page_params),
     current_user: dict = Depends(get_current_user)
 ):
     """Get all expenses with optional filters and search, including balance_due calculation"""
@@ -2389,13 +2310,11 @@ async def get_expenses(
     
     # Advanced search: invoice, villa, customer, owner
     if search:
-        # Search in description and notes
-        search_query = {
-            "$or": [
-                {"description": {"$regex": search, "$options": "i"}},
-                {"notes": {"$regex": search, "$options": "i"}}
-            ]
-        }
+        # Texto en descripción/notas o número de factura de la reservación
+        search_query = search_filter("expenses", search)
+        reservation_ids = await find_reservation_ids_by_invoice(db, search)
+        if reservation_ids:
+            search_query = {"$or": [search_query, {"related_reservation_id": {"$in": reservation_ids}}]}
         
         # If query already has conditions, combine with $and
         if query:
@@ -2403,20 +2322,10 @@ async def get_expenses(
         else:
             query = search_query
     
-    expenses = await db.expenses.find(query, {"_id": 0}).sort("expense_date", -1).to_list(1000)
+    expenses = await paginate(db.expenses, query, page, response, sort_field="expense_date")
     
-    # Calculate balance_due for each expense based on abonos
-    for expense in expenses:
-        expense_id = expense.get("id")
-        # Get all abonos for this expense
-        abonos = await db.expense_abonos.find({"expense_id": expense_id}, {"_id": 0}).to_list(1000)
-        total_paid = sum(a.get("amount", 0) for a in abonos)
-        
-        # Calculate balance_due: original amount - total paid
-        expense["total_paid"] = total_paid
-        expense["balance_due"] = expense.get("amount", 0) - total_paid
-    
-    return [restore_datetimes(e, ["expense_date", "created_at"]) for e in expenses]
+    # total_paid/balance_due se mantienen en el documento al agregar/eliminar abonos
+    return trusted_list_response((with_expense_totals(e) for e in expenses), Expense, response)
 
 @api_router.get("/expenses/{expense_id}", response_model=Expense)
 async def get_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
@@ -2425,15 +2334,7 @@ async def get_expense(expense_id: str, current_user: dict = Depends(get_current_
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     
-    # Calculate balance_due based on abonos
-    abonos = await db.expense_abonos.find({"expense_id": expense_id}, {"_id": 0}).to_list(1000)
-    total_paid = sum(a.get("amount", 0) for a in abonos)
-    
-    # Calculate balance_due: original amount - total paid
-    expense["total_paid"] = total_paid
-    expense["balance_due"] = expense.get("amount", 0) - total_paid
-    
-    return restore_datetimes(expense, ["expense_date", "created_at"])
+    return restore_datetimes(with_expense_totals(expense), ["expense_date", "created_at"])
 
 @api_router.put("/expenses/{expense_id}", response_model=Expense)
 async def update_expense(expense_id: str, update_data: ExpenseUpdate, current_user: dict = Depends(get_current_user)):
@@ -2445,17 +2346,23 @@ async def update_expense(expense_id: str, update_data: ExpenseUpdate, current_us
     update_dict = {k: v for k, v in update_data.model_dump(exclude_unset=True).items() if v is not None}
     
     if update_dict:
-        prepared_update = {}
-        for key, value in update_dict.items():
-            if isinstance(value, datetime):
-                prepared_update[key] = value.isoformat()
-            else:
-                prepared_update[key] = value
+        prepared_update = prepare_doc_for_insert(update_dict)
         
-        await db.expenses.update_one({"id": expense_id}, {"$set": prepared_update})
+        if "amount" in prepared_update:
+            # Recalcular balance_due junto con el nuevo monto
+            amount = prepared_update.pop("amount")
+            await set_expense_amount(db, expense_id, amount, prepared_update)
+            
+            # El nuevo monto puede cambiar el estado de pago
+            updated = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
+            await settle_expense(db, with_expense_totals(updated))
+        else:
+            await db.expenses.update_one({"id": expense_id}, touch({"$set": prepared_update}))
+        
+        await track_rollups(db, expense_ids=[expense_id])
     
     updated = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
-    return restore_datetimes(updated, ["expense_date", "created_at"])
+    return restore_datetimes(with_expense_totals(updated), ["expense_date", "created_at"])
 
 @api_router.delete("/expenses/{expense_id}")
 async def delete_expense(expense_id: str, current_user: dict = Depends(require_admin)):
@@ -2465,11 +2372,18 @@ async def delete_expense(expense_id: str, current_user: dict = Depends(require_a
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     
-    # Eliminar abonos asociados
-    await db.expense_abonos.delete_many({"expense_id": expense_id})
+    # Eliminar abonos asociados y liberar sus números de factura
+    abono_numbers = await db.expense_abonos.distinct("invoice_number", {"expense_id": expense_id})
+    await delete_tracked(db, "expense_abonos", {"expense_id": expense_id}, many=True)
+    await release_invoice_numbers(db, abono_numbers)
     
     # Eliminar el gasto
-    result = await db.expenses.delete_one({"id": expense_id})
+    await delete_tracked(db, "expenses", {"id": expense_id})
+    
+    # Eliminar un suplidor o la devolución del depósito puede liberar el pago del propietario
+    if expense.get("related_reservation_id"):
+        await settle_reservation_payables(db, expense["related_reservation_id"])
+    await track_rollups(db, expense_ids=[expense_id])
     return {"message": "Expense deleted successfully"}
 
 # ============ ABONOS TO EXPENSES ============
@@ -2488,6 +2402,8 @@ async def add_abono_to_expense(expense_id: str, abono_data: AbonoCreate, current
     
     print(f"✅ [ADD_ABONO] Expense encontrado: {expense.get('description')}, categoria: {expense.get('category')}")
     
+    abono_id = str(uuid.uuid4())
+    
     # Handle invoice_number generation
     if abono_data.invoice_number:
         # Admin provided manual invoice number - validate it's available
@@ -2495,150 +2411,42 @@ async def add_abono_to_expense(expense_id: str, abono_data: AbonoCreate, current
             raise HTTPException(status_code=403, detail="Only admins can specify manual invoice numbers")
         
         invoice_num_str = str(abono_data.invoice_number)
-        is_available = await validate_invoice_number_available(invoice_num_str)
+        is_available = await claim_invoice_number(db, invoice_num_str, "expense_abono", abono_id)
         if not is_available:
             raise HTTPException(status_code=400, detail=f"Invoice number {invoice_num_str} is already in use")
         invoice_number = invoice_num_str
     else:
         # Auto-generate invoice number for employee/admin
-        invoice_number = str(await get_next_invoice_number())
+        invoice_number = str(await get_next_invoice_number("expense_abono", abono_id))
     
     print(f"📄 [ADD_ABONO] Invoice number asignado: {invoice_number}")
     
-    # Create abono record with invoice_number
-    abono_dict = abono_data.model_dump()
-    abono_dict["invoice_number"] = invoice_number  
-    abono = Abono(**abono_dict, created_by=current_user["id"])
-    abono_doc = prepare_doc_for_insert(abono.model_dump())
-    
-    # Store in expense_abonos collection
-    abono_doc["expense_id"] = expense_id
-    print(f"💾 [ADD_ABONO] Guardando abono en DB...")
-    await db.expense_abonos.insert_one(abono_doc)
+    try:
+        # Create abono record with invoice_number
+        abono_dict = abono_data.model_dump()
+        abono_dict["invoice_number"] = invoice_number  
+        abono = Abono(**abono_dict, id=abono_id, created_by=current_user["id"])
+        abono_doc = prepare_doc_for_insert(abono.model_dump())
+        
+        # Store in expense_abonos collection
+        abono_doc["expense_id"] = expense_id
+        print(f"💾 [ADD_ABONO] Guardando abono en DB...")
+        await db.expense_abonos.insert_one(abono_doc)
+    except Exception:
+        # Sin abono guardado el número queda libre para reintentar
+        await release_invoice_numbers(db, [invoice_number])
+        raise
     print(f"✅ [ADD_ABONO] Abono guardado exitosamente")
     
-    # Get total abonos for this expense
-    all_abonos = await db.expense_abonos.find({"expense_id": expense_id}, {"_id": 0}).to_list(1000)
-    total_paid = sum(a.get("amount", 0) for a in all_abonos)
-    print(f"📊 [ADD_ABONO] Total abonos: {len(all_abonos)}, Total pagado: {total_paid}, Monto expense: {expense.get('amount', 0)}")
-    
-    # Check payment status based on expense category
-    print(f"🔍 [ADD_ABONO] Verificando estado de pago, categoria: {expense.get('category')}")
-    if expense.get("category") == "pago_propietario":
-        print(f"💼 [ADD_ABONO] Es pago propietario, revisando gastos relacionados...")
-        # For owner payments, check if all related expenses are paid
-        supplier_expenses = []
-        if expense.get("related_reservation_id"):
-            supplier_expenses = await db.expenses.find({
-                "related_reservation_id": expense.get("related_reservation_id"),
-                "category": "pago_suplidor"
-            }, {"_id": 0}).to_list(1000)
-        
-        print(f"📋 [ADD_ABONO] Supplier expenses encontrados: {len(supplier_expenses)}")
-        
-        # Check if all supplier expenses are paid
-        all_suppliers_paid = True
-        for supplier_expense in supplier_expenses:
-            supplier_abonos = await db.expense_abonos.find({"expense_id": supplier_expense["id"]}, {"_id": 0}).to_list(1000)
-            supplier_total_paid = sum(a.get("amount", 0) for a in supplier_abonos)
-            if supplier_total_paid < supplier_expense.get("amount", 0):
-                all_suppliers_paid = False
-                print(f"❌ [ADD_ABONO] Suplidor {supplier_expense.get('description')} AÚN DEBE: {supplier_expense.get('amount', 0) - supplier_total_paid}")
-                break
-        
-        # Check if deposit was returned (if applicable)
-        deposit_returned = True
-        if expense.get("related_reservation_id"):
-            reservation = await db.reservations.find_one({"id": expense.get("related_reservation_id")}, {"_id": 0})
-            if reservation and reservation.get("deposit", 0) > 0:
-                deposit_expense = await db.expenses.find_one({
-                    "related_reservation_id": expense.get("related_reservation_id"),
-                    "category": "devolucion_deposito",
-                    "payment_status": "paid"
-                }, {"_id": 0})
-                deposit_returned = deposit_expense is not None
-                print(f"💵 [ADD_ABONO] Depósito devuelto: {deposit_returned}")
-        
-        # ONLY mark owner payment as 'paid' if ALL conditions met
-        # For owner payments, status remains 'pending' until all conditions are satisfied
-        owner_paid = total_paid >= expense.get("amount", 0)
-        if owner_paid and all_suppliers_paid and deposit_returned:
-            new_status = "paid"
-        else:
-            new_status = "pending"
-        print(f"📌 [ADD_ABONO] Propietario pagado: {owner_paid}, Suplidores pagados: {all_suppliers_paid}, Depósito devuelto: {deposit_returned}")
-        print(f"✅ [ADD_ABONO] Nuevo estado propietario: {new_status}")
-    else:
-        # For supplier payments and other expenses, check for partial payments
-        if total_paid >= expense.get("amount", 0):
-            new_status = "paid"
-        elif total_paid > 0:
-            new_status = "partial"
-        else:
-            new_status = "pending"
-        print(f"✅ [ADD_ABONO] Nuevo estado suplidor: {new_status}")
-        
-        # Si es un pago de suplidor, también recalcular estado del propietario
-        if expense.get("category") == "pago_suplidor" and expense.get("related_reservation_id"):
-            print(f"🔄 [ADD_ABONO] Recalculando estado del propietario después de pagar suplidor...")
-            
-            owner_expense = await db.expenses.find_one({
-                "related_reservation_id": expense.get("related_reservation_id"),
-                "category": "pago_propietario"
-            }, {"_id": 0})
-            
-            if owner_expense:
-                # Verificar si propietario está pagado
-                owner_abonos = await db.expense_abonos.find({"expense_id": owner_expense["id"]}, {"_id": 0}).to_list(1000)
-                owner_total_paid = sum(a.get("amount", 0) for a in owner_abonos)
-                owner_paid = owner_total_paid >= owner_expense.get("amount", 0)
-                
-                # Verificar si TODOS los suplidores están pagados
-                supplier_expenses = await db.expenses.find({
-                    "related_reservation_id": expense.get("related_reservation_id"),
-                    "category": "pago_suplidor"
-                }, {"_id": 0}).to_list(1000)
-                
-                all_suppliers_paid = True
-                for supp_exp in supplier_expenses:
-                    supp_abonos = await db.expense_abonos.find({"expense_id": supp_exp["id"]}, {"_id": 0}).to_list(1000)
-                    supp_total_paid = sum(a.get("amount", 0) for a in supp_abonos)
-                    if supp_total_paid < supp_exp.get("amount", 0):
-                        all_suppliers_paid = False
-                        print(f"❌ [ADD_ABONO] Suplidor {supp_exp.get('description')} AÚN PENDIENTE")
-                        break
-                
-                # Verificar depósito
-                deposit_returned = True
-                reservation = await db.reservations.find_one({"id": expense.get("related_reservation_id")}, {"_id": 0})
-                if reservation and reservation.get("deposit", 0) > 0:
-                    deposit_expense = await db.expenses.find_one({
-                        "related_reservation_id": expense.get("related_reservation_id"),
-                        "category": "devolucion_deposito",
-                        "payment_status": "paid"
-                    }, {"_id": 0})
-                    deposit_returned = deposit_expense is not None
-                
-                # Actualizar estado del propietario
-                # For owner payments, status remains 'pending' until all conditions are satisfied
-                if owner_paid and all_suppliers_paid and deposit_returned:
-                    owner_new_status = "paid"
-                else:
-                    owner_new_status = "pending"
-                print(f"📌 [ADD_ABONO] Estado propietario: Owner={owner_paid}, Supp={all_suppliers_paid}, Dep={deposit_returned} → {owner_new_status}")
-                
-                await db.expenses.update_one(
-                    {"id": owner_expense["id"]},
-                    {"$set": {"payment_status": owner_new_status}}
-                )
-                print(f"✅ [ADD_ABONO] Estado propietario actualizado a: {owner_new_status}")
+    # Actualizar total pagado del gasto de forma atómica
+    expense = await apply_abono_delta(db, expense_id, abono_data.amount) or expense
+    total_paid = expense.get("total_paid", 0)
+    print(f"📊 [ADD_ABONO] Total pagado: {total_paid}, Monto expense: {expense.get('amount', 0)}")
     
-    print(f"💾 [ADD_ABONO] Actualizando estado en BD...")
-    await db.expenses.update_one(
-        {"id": expense_id},
-        {"$set": {"payment_status": new_status}}
-    )
+    # Recalcular estado del gasto (y del propietario si es parte de una reservación)
+    new_status = await settle_expense(db, expense)
     print(f"✅ [ADD_ABONO] Estado actualizado a: {new_status}")
+    await track_rollups(db, expense_ids=[expense_id])
     
     return abono
 
@@ -2654,145 +2462,20 @@ async def delete_expense_abono(expense_id: str, abono_id: str, current_user: dic
     print(f"🗑️ [DELETE_ABONO] Eliminando abono {abono_id} del expense {expense_id}")
     
     # Delete the abono
-    result = await db.expense_abonos.delete_one({"expense_id": expense_id, "id": abono_id})
-    if result.deleted_count == 0:
+    deleted_abono = await db.expense_abonos.find_one_and_delete({"expense_id": expense_id, "id": abono_id}, {"_id": 0})
+    if not deleted_abono:
         raise HTTPException(status_code=404, detail="Abono not found")
+    await release_invoice_numbers(db, [deleted_abono.get("invoice_number")])
     
     print(f"✅ [DELETE_ABONO] Abono eliminado, recalculando estado...")
     
     # Recalculate expense status using same logic as add_abono
-    expense = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
+    expense = await apply_abono_delta(db, expense_id, -deleted_abono.get("amount", 0))
     if expense:
-        all_abonos = await db.expense_abonos.find({"expense_id": expense_id}, {"_id": 0}).to_list(1000)
-        total_paid = sum(a.get("amount", 0) for a in all_abonos)
-        
-        print(f"🔍 [DELETE_ABONO] Verificando estado, categoria: {expense.get('category')}")
-        
-        if expense.get("category") == "pago_propietario":
-            print(f"💼 [DELETE_ABONO] Es pago propietario, revisando todos los requisitos...")
-            
-            # Check if all supplier expenses are paid
-            supplier_expenses = []
-            if expense.get("related_reservation_id"):
-                supplier_expenses = await db.expenses.find({
-                    "related_reservation_id": expense.get("related_reservation_id"),
-                    "category": "pago_suplidor"
-                }, {"_id": 0}).to_list(1000)
-            
-            all_suppliers_paid = True
-            for supplier_expense in supplier_expenses:
-                supplier_abonos = await db.expense_abonos.find({"expense_id": supplier_expense["id"]}, {"_id": 0}).to_list(1000)
-                supplier_total_paid = sum(a.get("amount", 0) for a in supplier_abonos)
-                if supplier_total_paid < supplier_expense.get("amount", 0):
-                    all_suppliers_paid = False
-                    print(f"❌ [DELETE_ABONO] Suplidor {supplier_expense.get('description')} AÚN DEBE: {supplier_expense.get('amount', 0) - supplier_total_paid}")
-                    break
-            
-            # Check if deposit was returned
-            deposit_returned = True
-            if expense.get("related_reservation_id"):
-                reservation = await db.reservations.find_one({"id": expense.get("related_reservation_id")}, {"_id": 0})
-                if reservation and reservation.get("deposit", 0) > 0:
-                    deposit_expense = await db.expenses.find_one({
-                        "related_reservation_id": expense.get("related_reservation_id"),
-                        "category": "devolucion_deposito",
-                        "payment_status": "paid"
-                    }, {"_id": 0})
-                    deposit_returned = deposit_expense is not None
-                    print(f"💵 [DELETE_ABONO] Depósito devuelto: {deposit_returned}")
-            
-            # ONLY mark owner payment as 'paid' if ALL conditions met
-            # For owner payments, status remains 'pending' until all conditions are satisfied
-            owner_paid = total_paid >= expense.get("amount", 0)
-            if owner_paid and all_suppliers_paid and deposit_returned:
-                new_status = "paid"
-            else:
-                new_status = "pending"
-            print(f"📌 [DELETE_ABONO] Propietario pagado: {owner_paid}, Suplidores: {all_suppliers_paid}, Depósito: {deposit_returned}")
-            print(f"✅ [DELETE_ABONO] Nuevo estado propietario: {new_status}")
-            
-            # También actualizar el estado del gasto propietario después de eliminar cualquier abono de suplidor o depósito
-            await db.expenses.update_one(
-                {"id": expense_id},
-                {"$set": {"payment_status": new_status}}
-            )
-        elif expense.get("category") == "pago_suplidor":
-            # Si eliminamos abono de un suplidor, también debemos recalcular el estado del propietario
-            print(f"🛎️ [DELETE_ABONO] Es pago suplidor, actualizando estado del suplidor y del propietario...")
-            
-            # Actualizar estado del suplidor
-            if total_paid >= expense.get("amount", 0):
-                new_status = "paid"
-            elif total_paid > 0:
-                new_status = "partial"
-            else:
-                new_status = "pending"
-            await db.expenses.update_one(
-                {"id": expense_id},
-                {"$set": {"payment_status": new_status}}
-            )
-            print(f"✅ [DELETE_ABONO] Estado suplidor actualizado: {new_status}")
-            
-            # Ahora actualizar el estado del propietario
-            if expense.get("related_reservation_id"):
-                owner_expense = await db.expenses.find_one({
-                    "related_reservation_id": expense.get("related_reservation_id"),
-                    "category": "pago_propietario"
-                }, {"_id": 0})
-                
-                if owner_expense:
-                    print(f"🔄 [DELETE_ABONO] Recalculando estado del propietario...")
-                    
-                    # Verificar propietario pagado
-                    owner_abonos = await db.expense_abonos.find({"expense_id": owner_expense["id"]}, {"_id": 0}).to_list(1000)
-                    owner_total_paid = sum(a.get("amount", 0) for a in owner_abonos)
-                    owner_paid = owner_total_paid >= owner_expense.get("amount", 0)
-                    
-                    # Verificar suplidores
-                    supplier_expenses = await db.expenses.find({
-                        "related_reservation_id": expense.get("related_reservation_id"),
-                        "category": "pago_suplidor"
-                    }, {"_id": 0}).to_list(1000)
-                    
-                    all_suppliers_paid = True
-                    for supp_exp in supplier_expenses:
-                        supp_abonos = await db.expense_abonos.find({"expense_id": supp_exp["id"]}, {"_id": 0}).to_list(1000)
-                        supp_total_paid = sum(a.get("amount", 0) for a in supp_abonos)
-                        if supp_total_paid < supp_exp.get("amount", 0):
-                            all_suppliers_paid = False
-                            break
-                    
-                    # Verificar depósito
-                    deposit_returned = True
-                    reservation = await db.reservations.find_one({"id": expense.get("related_reservation_id")}, {"_id": 0})
-                    if reservation and reservation.get("deposit", 0) > 0:
-                        deposit_expense = await db.expenses.find_one({
-                            "related_reservation_id": expense.get("related_reservation_id"),
-                            "category": "devolucion_deposito",
-                            "payment_status": "paid"
-                        }, {"_id": 0})
-                        deposit_returned = deposit_expense is not None
-                    
-                    # Actualizar estado del propietario
-                    # For owner payments, status remains 'pending' until all conditions are satisfied
-                    if owner_paid and all_suppliers_paid and deposit_returned:
-                        owner_new_status = "paid"
-                    else:
-                        owner_new_status = "pending"
-                    print(f"📌 [DELETE_ABONO] Estado propietario: {owner_new_status} (Owner: {owner_paid}, Supp: {all_suppliers_paid}, Dep: {deposit_returned})")
-                    
-                    await db.expenses.update_one(
-                        {"id": owner_expense["id"]},
-                        {"$set": {"payment_status": owner_new_status}}
-                    )
-        else:
-            # For other expense types, simple check
-            new_status = "paid" if total_paid >= expense.get("amount", 0) else "pending"
-            await db.expenses.update_one(
-                {"id": expense_id},
-                {"$set": {"payment_status": new_status}}
-            )
-            print(f"✅ [DELETE_ABONO] Estado actualizado: {new_status}")
+        print(f"📊 [DELETE_ABONO] Total pagado: {expense.get('total_paid', 0)}, Monto expense: {expense.get('amount', 0)}")
+        new_status = await settle_expense(db, expense)
+        print(f"✅ [DELETE_ABONO] Estado actualizado: {new_status}")
+        await track_rollups(db, expense_ids=[expense_id])
     
     return {"message": "Abono deleted successfully"}
 
@@ -2800,104 +2483,24 @@ async def delete_expense_abono(expense_id: str, abono_id: str, current_user: dic
 
 @api_router.get("/dashboard/stats", response_model=DashboardStats)
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    """Get dashboard statistics"""
-    all_reservations = await db.reservations.find({}, {"_id": 0}).to_list(10000)
-    
-    total_reservations = len(all_reservations)
-    # Solo contar como pendiente si balance_due > 0 Y tiene campos requeridos
-    pending_reservations = len([
-        r for r in all_reservations 
-        if r.get("balance_due", 0) > 0 
-        and all(key in r for key in ['check_in_time', 'check_out_time', 'base_price', 'subtotal'])
-    ])
-    
-    total_revenue_dop = sum(r.get("amount_paid", 0) for r in all_reservations if r.get("currency") == "DOP")
-    total_revenue_usd = sum(r.get("amount_paid", 0) for r in all_reservations if r.get("currency") == "USD")
-    
-    pending_payments_dop = sum(r.get("balance_due", 0) for r in all_reservations if r.get("currency") == "DOP")
-    pending_payments_usd = sum(r.get("balance_due", 0) for r in all_reservations if r.get("currency") == "USD")
-    
-    all_expenses = await db.expenses.find({}, {"_id": 0}).to_list(10000)
-    total_expenses_dop = sum(e.get("amount", 0) for e in all_expenses if e.get("currency") == "DOP")
-    total_expenses_usd = sum(e.get("amount", 0) for e in all_expenses if e.get("currency") == "USD")
-    
-    all_owners = await db.villa_owners.find({}, {"_id": 0}).to_list(1000)
-    total_owners = len(all_owners)
-    owners_balance_due_dop = sum(o.get("balance_due", 0) for o in all_owners)
-    owners_balance_due_usd = 0
-    
-    # Obtener reservaciones recientes - filtrar las que tengan todos los campos requeridos
-    recent_reservations_raw = await db.reservations.find({}, {"_id": 0}).sort("created_at", -1).limit(5).to_list(5)
-    recent_reservations = []
-    for r in recent_reservations_raw:
-        # Solo agregar si tiene campos críticos
-        if all(key in r for key in ['check_in_time', 'check_out_time', 'base_price', 'subtotal']):
-            recent_reservations.append(restore_datetimes(r, ["reservation_date", "created_at", "updated_at"]))
-    
-    # Obtener reservaciones con pagos pendientes - filtrar las que tengan todos los campos requeridos
-    pending_payment_reservations_raw = await db.reservations.find(
-        {"balance_due": {"$gt": 0}},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(10).to_list(10)
-    pending_payment_reservations = []
-    for r in pending_payment_reservations_raw:
-        # Solo agregar si tiene campos críticos
-        if all(key in r for key in ['check_in_time', 'check_out_time', 'base_price', 'subtotal']):
-            pending_payment_reservations.append(restore_datetimes(r, ["reservation_date", "created_at", "updated_at"]))
-    
-    # Calcular compromisos del mes actual
-    from datetime import datetime, timezone
-    now = datetime.now(timezone.utc)
-    current_month = now.month
-    current_year = now.year
-    
-    # Obtener todos los gastos con categoría "compromiso" del mes actual
-    commitments = []
-    for expense in all_expenses:
-        if expense.get("category") == "compromiso":
-            expense_date = expense.get("expense_date")
-            if isinstance(expense_date, str):
-                expense_date = datetime.fromisoformat(expense_date.replace('Z', '+00:00'))
-            if expense_date and expense_date.month == current_month and expense_date.year == current_year:
-                commitments.append(expense)
-    
-    commitments_count = len(commitments)
-    commitments_total_dop = sum(c.get("amount", 0) for c in commitments if c.get("currency") == "DOP")
-    commitments_total_usd = sum(c.get("amount", 0) for c in commitments if c.get("currency") == "USD")
-    commitments_paid_count = len([c for c in commitments if c.get("payment_status") == "paid"])
-    commitments_pending_count = len([c for c in commitments if c.get("payment_status") == "pending"])
-    
-    # Contar compromisos vencidos (pendientes con fecha pasada)
-    commitments_overdue_count = 0
-    for commitment in commitments:
-        if commitment.get("payment_status") == "pending":
-            expense_date = commitment.get("expense_date")
-            if isinstance(expense_date, str):
-                expense_date = datetime.fromisoformat(expense_date.replace('Z', '+00:00'))
-            if expense_date and expense_date.date() < now.date():
-                commitments_overdue_count += 1
-    
-    return DashboardStats(
-        total_reservations=total_reservations,
-        pending_reservations=pending_reservations,
-        total_revenue_dop=total_revenue_dop,
-        total_revenue_usd=total_revenue_usd,
-        pending_payments_dop=pending_payments_dop,
-        pending_payments_usd=pending_payments_usd,
-        total_expenses_dop=total_expenses_dop,
-        total_expenses_usd=total_expenses_usd,
-        total_owners=total_owners,
-        owners_balance_due_dop=owners_balance_due_dop,
-        owners_balance_due_usd=owners_balance_due_usd,
-        recent_reservations=recent_reservations,
-        pending_payment_reservations=pending_payment_reservations,
-        commitments_count=commitments_count,
-        commitments_total_dop=commitments_total_dop,
-        commitments_total_usd=commitments_total_usd,
-        commitments_paid_count=commitments_paid_count,
-        commitments_pending_count=commitments_pending_count,
-        commitments_overdue_count=commitments_overdue_count
-    )
+    """Get dashboard statistics - computed inside MongoDB with $facet"""
+    stats = await build_dashboard_stats(db)
+    stats["recent_reservations"] = [
+        restore_datetimes(r, RESERVATION_DATETIME_FIELDS) for r in stats["recent_reservations"]
+    ]
+    stats["pending_payment_reservations"] = [
+        restore_datetimes(r, RESERVATION_DATETIME_FIELDS) for r in stats["pending_payment_reservations"]
+    ]
+    return DashboardStats(**stats)
+
+@api_router.post("/dashboard/rollups/rebuild")
+async def rebuild_dashboard(current_user: dict = Depends(require_admin)):
+    """Recalculate dashboard_rollups from scratch (admin only)"""
+    try:
+        documents = await rebuild_dashboard_rollups(db)
+        return {"message": "Dashboard recalculado exitosamente", "documents": documents}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al recalcular dashboard: {str(e)}")
 
 # ============ HEALTH CHECK ============
 
@@ -2907,120 +2510,110 @@ async def health_check():
     return {"status": "healthy", "service": "espacios-con-piscina-api"}
 
 # ============ BACKUP/RESTORE SYSTEM ============
-import json
-from bson import json_util
+from backup_service import (
+    stream_backup, stream_incremental_backup, backup_filename, restore_backup, restore_progress,
+    reset_backup_chain, backfill_updated_at, BackupError, RestoreError, BACKUP_COLLECTIONS
+)
+from backup_scheduler import backup_scheduler
 
 @api_router.get("/backup/download")
-async def download_full_backup(current_user: dict = Depends(require_admin)):
-    """Descargar backup completo de toda la base de datos"""
-    try:
-        backup_data = {
-            "backup_date": datetime.now(timezone.utc).isoformat(),
-            "app_version": "1.0",
-            "collections": {}
-        }
-        
-        # Colecciones a respaldar
-        collections_to_backup = [
-            "users", "customers", "categories", "expense_categories",
-            "villas", "extra_services", "reservations", "villa_owners",
-            "expenses", "reservation_abonos", "expense_abonos",
-            "invoice_counter", "invoice_templates", "logo_config"
-        ]
-        
-        for collection_name in collections_to_backup:
-            collection = db[collection_name]
-            # Obtener todos los documentos
-            documents = await collection.find({}, {"_id": 0}).to_list(None)
-            backup_data["collections"][collection_name] = documents
-        
-        # Convertir a JSON
-        json_str = json.dumps(backup_data, indent=2, default=json_util.default, ensure_ascii=False)
-        
-        # Crear nombre de archivo con fecha
-        filename = f"espacios_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        
-        # Retornar como descarga
-        return StreamingResponse(
-            io.BytesIO(json_str.encode('utf-8')),
-            media_type="application/json",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al crear backup: {str(e)}")
+async def download_full_backup(mode: str = "full", current_user: dict = Depends(require_admin)):
+    """Descargar backup (NDJSON comprimido, generado en streaming)
+    mode=full: todo; mode=incremental: lo modificado y eliminado desde el último backup"""
+    if mode == "full":
+        stream = stream_backup(db)
+    elif mode == "incremental":
+        try:
+            stream = await stream_incremental_backup(db)
+        except BackupError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        raise HTTPException(status_code=400, detail="mode debe ser 'full' o 'incremental'")
+    return StreamingResponse(
+        stream,
+        media_type="application/gzip",
+        headers={"Content-Disposition": f"attachment; filename={backup_filename(mode)}"}
+    )
 
 @api_router.post("/backup/restore")
 async def restore_from_backup(file: UploadFile = File(...), current_user: dict = Depends(require_admin)):
-    """Restaurar backup completo - CUIDADO: Sobrescribe datos existentes"""
-    try:
-        # Leer archivo
-        content = await file.read()
-        backup_data = json.loads(content.decode('utf-8'))
-        
-        if "collections" not in backup_data:
-            raise HTTPException(status_code=400, detail="Formato de backup inválido")
-        
-        restored_collections = []
-        errors = []
+    """Restaurar backup completo - CUIDADO: Sobrescribe datos existentes
+    Se carga en colecciones de staging, se verifica y solo entonces se intercambia.
+    Los incrementales se aplican sobre el completo restaurado, en orden"""
+    if restore_progress.lock.locked():
+        raise HTTPException(status_code=409, detail="Ya hay una restauración en curso")
+    
+    async with restore_progress.lock:
+        restore_progress.start(file.filename)
+        try:
+            # Se lee del archivo temporal de la subida, por lotes (NDJSON .gz o JSON anterior)
+            result = await restore_backup(db, file.file, restore_progress)
+        except (ValueError, RestoreError) as e:
+            restore_progress.finish("failed", str(e))
+            raise HTTPException(status_code=400, detail=f"Backup inválido, no se modificó ningún dato: {str(e)}")
+        except Exception as e:
+            restore_progress.finish("failed", str(e))
+            raise HTTPException(status_code=500, detail=f"Error al restaurar backup: {str(e)}")
         
-        for collection_name, documents in backup_data["collections"].items():
-            try:
-                collection = db[collection_name]
-                
-                if documents:  # Solo si hay documentos
-                    # Eliminar datos existentes (CUIDADO!)
-                    await collection.delete_many({})
-                    
-                    # Insertar documentos del backup
-                    if documents:
-                        await collection.insert_many(documents)
-                    
-                    restored_collections.append({
-                        "collection": collection_name,
-                        "documents": len(documents)
-                    })
-            except Exception as e:
-                errors.append({
-                    "collection": collection_name,
-                    "error": str(e)
-                })
+        try:
+            restore_progress.update(phase="post-processing", collection=None)
+            # Backups antiguos no incluyen invoice_numbers: reconstruir el registro
+            await sync_invoice_registry(db)
+            # Backups antiguos guardan las fechas como string y no tienen updated_at
+            await backfill_updated_at(db)
+            # Backups anteriores a total_paid traen abonos sin totales en el gasto
+            await backfill_expense_totals(db)
+            await migrate_inline_media(db)
+            await rebuild_dashboard_rollups(db)
+            await backfill_search_keys(db, only_missing=False)
+            invalidate_public_catalog()
+            restore_progress.finish("completed")
+        except Exception as e:
+            restore_progress.finish("failed", str(e))
+            raise HTTPException(status_code=500, detail=f"Datos restaurados, pero falló el post-procesamiento: {str(e)}")
         
         return {
             "message": "Backup restaurado exitosamente",
-            "restored": restored_collections,
-            "errors": errors if errors else None,
-            "backup_date": backup_data.get("backup_date", "Desconocida")
+            "restored": result["restored"],
+            "deleted": result.get("deleted", 0),
+            "errors": None,
+            "backup_date": result["metadata"].get("backup_date") or "Desconocida"
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al restaurar backup: {str(e)}")
+
+@api_router.get("/backup/restore/status")
+async def get_restore_status(current_user: dict = Depends(require_admin)):
+    """Progress of the running (or last) backup restore"""
+    return restore_progress.as_dict()
 
 @api_router.get("/backup/info")
 async def get_backup_info(current_user: dict = Depends(require_admin)):
-    """Obtener información de estadísticas de la base de datos para backup"""
+    """Obtener información de estadísticas de la base de datos para backup
+    y el estado de los backups programados"""
     try:
-        collections_info = []
-        
-        collection_names = [
-            "users", "customers", "categories", "expense_categories",
-            "villas", "extra_services", "reservations", "villa_owners",
-            "expenses", "reservation_abonos", "expense_abonos"
+        # Conteos desde los metadatos de cada colección, todos a la vez
+        counts = await asyncio.gather(*(
+            db[collection_name].estimated_document_count() for collection_name in BACKUP_COLLECTIONS
+        ))
+        collections_info = [
+            {"name": collection_name, "count": count}
+            for collection_name, count in zip(BACKUP_COLLECTIONS, counts)
         ]
         
-        for collection_name in collection_names:
-            collection = db[collection_name]
-            count = await collection.count_documents({})
-            collections_info.append({
-                "name": collection_name,
-                "count": count
-            })
-        
         return {
             "total_collections": len(collections_info),
-            "collections": collections_info
+            "collections": collections_info,
+            "scheduled_backups": await asyncio.to_thread(backup_scheduler.status)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener info: {str(e)}")
 
+@api_router.post("/backup/snapshots/run")
+async def run_backup_snapshot(current_user: dict = Depends(require_admin)):
+    """Escribir ahora un backup en el directorio de backups programados (en segundo plano)"""
+    if not backup_scheduler.trigger(db):
+        raise HTTPException(status_code=409, detail="Ya hay un backup programado en curso")
+    return {"message": "Backup iniciado", "status_url": "/api/backup/info"}
+
 @api_router.post("/system/reset-all")
 async def reset_all_data(admin_code: str, current_user: dict = Depends(require_admin)):
     """BORRAR TODO - Elimina todos los datos de todas las colecciones (excepto admin)
@@ -3038,7 +2631,8 @@ async def reset_all_data(admin_code: str, current_user: dict = Depends(require_a
             "customers", "categories", "expense_categories",
             "villas", "extra_services", "reservations", "villa_owners",
             "expenses", "reservation_abonos", "expense_abonos",
-            "invoice_counter", "invoice_templates", "logo_config"
+            "invoice_counter", "invoice_numbers", "invoice_templates", "logo_config",
+            "dashboard_rollups", "dashboard_rollup_sources"
         ]
         
         for collection_name in collections_to_clear:
@@ -3049,6 +2643,10 @@ async def reset_all_data(admin_code: str, current_user: dict = Depends(require_a
                 "deleted": result.deleted_count
             })
         
+        invalidate_public_catalog()
+        # Los borrados masivos no dejan tombstones: el próximo incremental necesita un completo
+        await reset_backup_chain(db)
+        
         # NO eliminar usuarios - se mantienen todos (admin y empleados)
         deleted_summary.append({
             "collection": "users",
@@ -3065,10 +2663,29 @@ async def reset_all_data(admin_code: str, current_user: dict = Depends(require_a
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al resetear sistema: {str(e)}")
 
+@api_router.get("/system/indexes")
+async def get_indexes_report(current_user: dict = Depends(require_admin)):
+    """Reporte de índices de MongoDB: faltantes y sin uso (admin only)"""
+    try:
+        return await get_index_report(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener índices: {str(e)}")
+
+@api_router.post("/system/indexes")
+async def rebuild_indexes(current_user: dict = Depends(require_admin)):
+    """Crear los índices faltantes del registro (admin only)"""
+    try:
+        return await ensure_indexes(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al crear índices: {str(e)}")
+
 # ============ EXPORT/IMPORT ENDPOINTS ============
-from export_service import create_excel_template, export_data_to_excel
-from import_service import import_customers, import_villas, import_reservations, import_expenses
-import pandas as pd
+from export_service import (
+    create_excel_template, export_data_to_csv, export_data_to_excel, export_data_to_parquet, iter_file,
+    build_export_query, EXPORT_FORMATS
+)
+from import_jobs import import_job_runner, get_import_job
+from workbook_reader import shutdown_workbook_pool
 
 @api_router.get("/export/template")
 async def download_template(current_user: dict = Depends(get_current_user)):
@@ -3087,16 +2704,31 @@ async def download_template(current_user: dict = Depends(get_current_user)):
     )
 
 @api_router.get("/export/{data_type}")
-async def export_data(data_type: str, current_user: dict = Depends(get_current_user)):
-    """Exportar datos existentes a Excel"""
+async def export_data(
+    data_type: str,
+    format: str = "xlsx",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    currency: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Exportar datos existentes a Excel, CSV o Parquet.
+    start_date/end_date (YYYY-MM-DD, incluidos) y currency filtran en MongoDB.
+    """
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Solo administradores pueden exportar datos")
     
     valid_types = ["customers", "villas", "reservations", "expenses"]
     if data_type not in valid_types:
         raise HTTPException(status_code=400, detail=f"Tipo inválido. Debe ser: {', '.join(valid_types)}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido. Debe ser: {', '.join(EXPORT_FORMATS)}")
     
-    excel_file = await export_data_to_excel(db, data_type)
+    try:
+        query = build_export_query(data_type, start_date, end_date, currency)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     type_names = {
         "customers": "Clientes",
@@ -3104,21 +2736,44 @@ async def export_data(data_type: str, current_user: dict = Depends(get_current_u
         "reservations": "Reservaciones",
         "expenses": "Gastos"
     }
+    headers = {
+        "Content-Disposition": f"attachment; filename={type_names[data_type]}_Export.{format}"
+    }
+    
+    if format == "csv":
+        csv_file = await export_data_to_csv(db, data_type, query)
+        return StreamingResponse(iter_file(csv_file), media_type="text/csv; charset=utf-8", headers=headers)
+    
+    if format == "parquet":
+        try:
+            parquet_file = await export_data_to_parquet(db, data_type, query)
+        except RuntimeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return StreamingResponse(iter_file(parquet_file), media_type="application/vnd.apache.parquet", headers=headers)
+    
+    excel_file = await export_data_to_excel(db, data_type, query)
     
     return StreamingResponse(
-        excel_file,
+        iter_file(excel_file),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={
-            "Content-Disposition": f"attachment; filename={type_names[data_type]}_Export.xlsx"
-        }
+        headers=headers
     )
 
+def _job_response(job: dict) -> dict:
+    return {
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/api/import/jobs/{job['id']}",
+        "summary": f"⏳ Importación en proceso: {job['filename']}"
+    }
+
 @api_router.post("/import/excel")
 async def import_from_excel(
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)
 ):
-    """Importar datos desde archivo Excel completo"""
+    """Importar datos desde archivo Excel completo (trabajo en segundo plano)"""
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Solo administradores pueden importar datos")
     
@@ -3126,76 +2781,23 @@ async def import_from_excel(
         raise HTTPException(status_code=400, detail="El archivo debe ser Excel (.xlsx o .xls)")
     
     try:
-        # Leer archivo Excel
         contents = await file.read()
-        excel_file = pd.ExcelFile(contents)
-        
-        results = {
-            'customers': {'created': 0, 'updated': 0, 'errors': []},
-            'villas': {'created': 0, 'updated': 0, 'errors': []},
-            'reservations': {'created': 0, 'updated': 0, 'expenses_created': 0, 'errors': []},
-            'expenses': {'created': 0, 'updated': 0, 'errors': []}
-        }
-        
-        # Importar Clientes
-        if '👥 Clientes' in excel_file.sheet_names:
-            df_customers = pd.read_excel(contents, sheet_name='👥 Clientes', skiprows=[1])  # Skip fila de ejemplo
-            df_customers = df_customers[~df_customers['Nombre Completo*'].astype(str).str.contains('Juan Pérez', na=False)]
-            if not df_customers.empty:
-                created, updated, errors = await import_customers(df_customers, db)
-                results['customers'] = {'created': created, 'updated': updated, 'errors': errors}
-        
-        # Importar Villas
-        if '🏠 Villas' in excel_file.sheet_names:
-            df_villas = pd.read_excel(contents, sheet_name='🏠 Villas', skiprows=[1])
-            df_villas = df_villas[~df_villas['Código Villa*'].astype(str).str.contains('ECPVSH', na=False)]
-            if not df_villas.empty:
-                created, updated, errors = await import_villas(df_villas, db)
-                results['villas'] = {'created': created, 'updated': updated, 'errors': errors}
-        
-        # Importar Reservaciones (y crear gastos automáticos - OPCIÓN A)
-        if '🎫 Reservaciones' in excel_file.sheet_names:
-            df_reservations = pd.read_excel(contents, sheet_name='🎫 Reservaciones', skiprows=[1])
-            df_reservations = df_reservations[~df_reservations['Número Factura*'].astype(str).str.contains('5815', na=False)]
-            if not df_reservations.empty:
-                res_created, res_updated, exp_created, errors = await import_reservations(df_reservations, db)
-                results['reservations'] = {
-                    'created': res_created, 
-                    'updated': res_updated, 
-                    'expenses_created': exp_created,
-                    'errors': errors
-                }
-        
-        # Importar Gastos adicionales
-        if '💰 Gastos' in excel_file.sheet_names:
-            df_expenses = pd.read_excel(contents, sheet_name='💰 Gastos', skiprows=[1])
-            df_expenses = df_expenses[~df_expenses['Descripción*'].astype(str).str.contains('Pago de luz', na=False)]
-            if not df_expenses.empty:
-                created, updated, errors = await import_expenses(df_expenses, db)
-                results['expenses'] = {'created': created, 'updated': updated, 'errors': errors}
-        
-        # Generar resumen
-        summary = f"""
-✅ IMPORTACIÓN COMPLETADA
-
-👥 Clientes: {results['customers']['created']} creados, {results['customers']['updated']} actualizados
-🏠 Villas: {results['villas']['created']} creadas, {results['villas']['updated']} actualizadas
-🎫 Reservaciones: {results['reservations']['created']} creadas, {results['reservations']['updated']} actualizadas
-💰 Gastos Propietario: {results['reservations']['expenses_created']} creados automáticamente
-💰 Gastos Adicionales: {results['expenses']['created']} creados
-
-Total errores: {sum(len(r.get('errors', [])) for r in results.values())}
-        """
-        
-        return {
-            "success": True,
-            "summary": summary,
-            "details": results
-        }
-        
+        job = await import_job_runner.submit(db, "excel", file.filename, contents, current_user)
+        return _job_response(job)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al procesar archivo: {str(e)}")
 
+@api_router.get("/import/jobs/{job_id}")
+async def get_import_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Estado, avance, contadores y errores de una importación"""
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores pueden importar datos")
+    
+    job = await get_import_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Importación no encontrada")
+    return job
+
 
 
 # ============ HIERARCHICAL EXPORT/IMPORT ENDPOINTS ============
@@ -3219,6 +2821,16 @@ from hierarchical_import_service import (
     import_reservations
 )
 
+# Importación síncrona (solo dry_run) por tipo de archivo
+HIERARCHICAL_IMPORTERS = {
+    "customers": (import_customers, "Clientes"),
+    "villa-categories": (import_villa_categories, "Categorías de Villas"),
+    "villas": (import_villas, "Villas"),
+    "services": (import_services, "Servicios Extra"),
+    "expense-categories": (import_expense_categories, "Categorías de Gastos"),
+    "reservations": (import_reservations, "Reservaciones"),
+}
+
 
 @api_router.get("/import/templates/info")
 async def get_templates_info(current_user: dict = Depends(get_current_user)):
@@ -3235,7 +2847,7 @@ async def download_customers_template(current_user: dict = Depends(get_current_u
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Solo administradores pueden descargar plantillas")
     
-    template = generate_customers_template()
+    template = await generate_customers_template()
     
     return StreamingResponse(
         template,
@@ -3251,7 +2863,7 @@ async def download_villa_categories_template(current_user: dict = Depends(get_cu
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Solo administradores pueden descargar plantillas")
     
-    template = generate_villa_categories_template()
+    template = await generate_villa_categories_template()
     
     return StreamingResponse(
         template,
@@ -3283,7 +2895,7 @@ async def download_services_template(current_user: dict = Depends(get_current_us
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Solo administradores pueden descargar plantillas")
     
-    template = generate_services_template()
+    template = await generate_services_template()
     
     return StreamingResponse(
         template,
@@ -3299,7 +2911,7 @@ async def download_expense_categories_template(current_user: dict = Depends(get_
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Solo administradores pueden descargar plantillas")
     
-    template = generate_expense_categories_template()
+    template = await generate_expense_categories_template()
     
     return StreamingResponse(
         template,
@@ -3325,36 +2937,20 @@ async def download_reservations_template(current_user: dict = Depends(get_curren
         }
     )
 
-# Include router in app
-@api_router.post("/import/customers")
-async def import_customers_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
-    """PASO 1: Importar clientes desde Excel"""
-    if current_user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Solo administradores pueden importar")
-    
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Archivo debe ser Excel (.xlsx o .xls)")
-    
-    try:
-        content = await file.read()
-        result = await import_customers(content, db)
-        
-        summary = f"""✅ Importación de Clientes completada:
+def _dry_run_response(title: str, result: dict) -> dict:
+    """Respuesta de una importación con dry_run: solo el reporte de validación"""
+    summary = f"""🔎 Validación de {title} (sin cambios):
 
 📊 Total procesado: {result['total']} filas
-✅ Creados: {result['created']}
-🔄 Actualizados: {result['updated']}
+✅ Válidas: {result.get('valid', 0)}
 ❌ Errores: {len(result['errors'])}
 
 {chr(10).join(result['errors'][:10]) if result['errors'] else ''}
 """
-        return {"success": True, "summary": summary, "result": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al importar: {str(e)}")
+    return {"success": True, "summary": summary, "result": result}
 
-@api_router.post("/import/villa-categories")
-async def import_villa_categories_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
-    """PASO 2: Importar categorías de villas desde Excel"""
+async def _import_entity(kind: str, file: UploadFile, dry_run: bool, current_user: dict) -> dict:
+    """dry_run valida en la misma solicitud; si no, la importación se encola"""
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Solo administradores pueden importar")
     
@@ -3363,124 +2959,45 @@ async def import_villa_categories_file(file: UploadFile = File(...), current_use
     
     try:
         content = await file.read()
-        result = await import_villa_categories(content, db)
-        
-        summary = f"""✅ Importación de Categorías de Villas completada:
-
-📊 Total procesado: {result['total']} filas
-✅ Creados: {result['created']}
-🔄 Actualizados: {result['updated']}
-❌ Errores: {len(result['errors'])}
-
-{chr(10).join(result['errors'][:10]) if result['errors'] else ''}
-"""
-        return {"success": True, "summary": summary, "result": result}
+        if dry_run:
+            importer, title = HIERARCHICAL_IMPORTERS[kind]
+            result = await importer(content, db, dry_run=True)
+            return _dry_run_response(title, result)
+        job = await import_job_runner.submit(db, kind, file.filename, content, current_user)
+        return _job_response(job)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al importar: {str(e)}")
 
-@api_router.post("/import/villas")
-async def import_villas_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
-    """PASO 3: Importar villas desde Excel"""
-    if current_user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Solo administradores pueden importar")
-    
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Archivo debe ser Excel (.xlsx o .xls)")
-    
-    try:
-        content = await file.read()
-        result = await import_villas(content, db)
-        
-        summary = f"""✅ Importación de Villas completada:
+# Include router in app
+@api_router.post("/import/customers")
+async def import_customers_file(file: UploadFile = File(...), dry_run: bool = False, current_user: dict = Depends(get_current_user)):
+    """PASO 1: Importar clientes desde Excel"""
+    return await _import_entity("customers", file, dry_run, current_user)
 
-📊 Total procesado: {result['total']} filas
-✅ Creados: {result['created']}
-🔄 Actualizados: {result['updated']}
-❌ Errores: {len(result['errors'])}
+@api_router.post("/import/villa-categories")
+async def import_villa_categories_file(file: UploadFile = File(...), dry_run: bool = False, current_user: dict = Depends(get_current_user)):
+    """PASO 2: Importar categorías de villas desde Excel"""
+    return await _import_entity("villa-categories", file, dry_run, current_user)
 
-{chr(10).join(result['errors'][:10]) if result['errors'] else ''}
-"""
-        return {"success": True, "summary": summary, "result": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al importar: {str(e)}")
+@api_router.post("/import/villas")
+async def import_villas_file(file: UploadFile = File(...), dry_run: bool = False, current_user: dict = Depends(get_current_user)):
+    """PASO 3: Importar villas desde Excel"""
+    return await _import_entity("villas", file, dry_run, current_user)
 
 @api_router.post("/import/services")
-async def import_services_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+async def import_services_file(file: UploadFile = File(...), dry_run: bool = False, current_user: dict = Depends(get_current_user)):
     """PASO 4: Importar servicios extra desde Excel"""
-    if current_user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Solo administradores pueden importar")
-    
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Archivo debe ser Excel (.xlsx o .xls)")
-    
-    try:
-        content = await file.read()
-        result = await import_services(content, db)
-        
-        summary = f"""✅ Importación de Servicios Extra completada:
-
-📊 Total procesado: {result['total']} filas
-✅ Creados: {result['created']}
-🔄 Actualizados: {result['updated']}
-❌ Errores: {len(result['errors'])}
-
-{chr(10).join(result['errors'][:10]) if result['errors'] else ''}
-"""
-        return {"success": True, "summary": summary, "result": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al importar: {str(e)}")
+    return await _import_entity("services", file, dry_run, current_user)
 
 @api_router.post("/import/expense-categories")
-async def import_expense_categories_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+async def import_expense_categories_file(file: UploadFile = File(...), dry_run: bool = False, current_user: dict = Depends(get_current_user)):
     """PASO 5: Importar categorías de gastos desde Excel"""
-    if current_user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Solo administradores pueden importar")
-    
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Archivo debe ser Excel (.xlsx o .xls)")
-    
-    try:
-        content = await file.read()
-        result = await import_expense_categories(content, db)
-        
-        summary = f"""✅ Importación de Categorías de Gastos completada:
-
-📊 Total procesado: {result['total']} filas
-✅ Creados: {result['created']}
-🔄 Actualizados: {result['updated']}
-❌ Errores: {len(result['errors'])}
-
-{chr(10).join(result['errors'][:10]) if result['errors'] else ''}
-"""
-        return {"success": True, "summary": summary, "result": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al importar: {str(e)}")
+    return await _import_entity("expense-categories", file, dry_run, current_user)
 
 @api_router.post("/import/reservations")
-async def import_reservations_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+async def import_reservations_file(file: UploadFile = File(...), dry_run: bool = False, current_user: dict = Depends(get_current_user)):
     """PASO 6: Importar reservaciones desde Excel"""
-    if current_user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Solo administradores pueden importar")
-    
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Archivo debe ser Excel (.xlsx o .xls)")
-    
-    try:
-        content = await file.read()
-        result = await import_reservations(content, db)
-        
-        summary = f"""✅ Importación de Reservaciones completada:
-
-📊 Total procesado: {result['total']} filas
-✅ Creados: {result['created']}
-🔄 Actualizados: {result['updated']}
-❌ Errores: {len(result['errors'])}
-
-{chr(10).join(result['errors'][:10]) if result['errors'] else ''}
-"""
-        return {"success": True, "summary": summary, "result": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al importar: {str(e)}")
+    return await _import_entity("reservations", file, dry_run, current_user)
 
 # ============ CMS ENDPOINTS FOR PUBLIC WEBSITE ============
 
@@ -3518,12 +3035,11 @@ async def update_website_content(
         
         # Update existing
         update_data = content_update.model_dump(exclude_unset=True)
-        update_data["updated_at"] = datetime.now(timezone.utc)
         update_data["updated_by"] = current_user["id"]
         
         await db.website_content.update_one(
             {"section": section},
-            {"$set": prepare_doc_for_insert(update_data)}
+            touch({"$set": prepare_doc_for_insert(update_data)})
         )
         
         updated = await db.website_content.find_one({"section": section}, {"_id": 0})
@@ -3574,7 +3090,7 @@ async def update_website_image(
         update_data = image_update.model_dump(exclude_unset=True)
         await db.website_images.update_one(
             {"id": image_id},
-            {"$set": prepare_doc_for_insert(update_data)}
+            touch({"$set": prepare_doc_for_insert(update_data)})
         )
         
         updated = await db.website_images.find_one({"id": image_id}, {"_id": 0})
@@ -3591,8 +3107,8 @@ async def delete_website_image(
 ):
     """Delete website image (admin only)"""
     try:
-        result = await db.website_images.delete_one({"id": image_id})
-        if result.deleted_count == 0:
+        deleted = await delete_tracked(db, "website_images", {"id": image_id})
+        if deleted == 0:
             raise HTTPException(status_code=404, detail="Imagen no encontrada")
         return {"message": "Imagen eliminada exitosamente"}
     except HTTPException:
@@ -3654,11 +3170,10 @@ async def update_public_service(
             raise HTTPException(status_code=404, detail="Servicio no encontrado")
         
         update_data = service_update.model_dump(exclude_unset=True)
-        update_data["updated_at"] = datetime.now(timezone.utc)
         
         await db.public_services.update_one(
             {"id": service_id},
-            {"$set": prepare_doc_for_insert(update_data)}
+            touch({"$set": prepare_doc_for_insert(update_data)})
         )
         
         updated = await db.public_services.find_one({"id": service_id}, {"_id": 0})
@@ -3675,8 +3190,8 @@ async def delete_public_service(
 ):
     """Delete public service (admin only)"""
     try:
-        result = await db.public_services.delete_one({"id": service_id})
-        if result.deleted_count == 0:
+        deleted = await delete_tracked(db, "public_services", {"id": service_id})
+        if deleted == 0:
             raise HTTPException(status_code=404, detail="Servicio no encontrado")
         return {"message": "Servicio eliminado exitosamente"}
     except HTTPException:
@@ -3727,11 +3242,10 @@ async def update_chatbot_question(
             raise HTTPException(status_code=404, detail="Pregunta no encontrada")
         
         update_data = question_update.model_dump(exclude_unset=True)
-        update_data["updated_at"] = datetime.now(timezone.utc)
         
         await db.chatbot_questions.update_one(
             {"id": question_id},
-            {"$set": prepare_doc_for_insert(update_data)}
+            touch({"$set": prepare_doc_for_insert(update_data)})
         )
         
         updated = await db.chatbot_questions.find_one({"id": question_id}, {"_id": 0})
@@ -3748,8 +3262,8 @@ async def delete_chatbot_question(
 ):
     """Delete chatbot question (admin only)"""
     try:
-        result = await db.chatbot_questions.delete_one({"id": question_id})
-        if result.deleted_count == 0:
+        deleted = await delete_tracked(db, "chatbot_questions", {"id": question_id})
+        if deleted == 0:
             raise HTTPException(status_code=404, detail="Pregunta no encontrada")
         return {"message": "Pregunta eliminada exitosamente"}
     except HTTPException:
@@ -3796,7 +3310,7 @@ async def update_quotation_status(
     try:
         result = await db.client_quotations.update_one(
             {"id": quotation_id},
-            {"$set": {"status": status, "updated_at": datetime.now(timezone.utc)}}
+            touch({"$set": {"status": status}})
         )
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Cotización no encontrada")
@@ -3809,94 +3323,13 @@ async def update_quotation_status(
 # Public Villas Endpoint (for website catalog)
 @api_router.get("/public/villas")
 async def get_public_villas(zone: Optional[str] = None):
-    """Get villas for public website catalog"""
+    """Get villas for public website catalog (served from the in-process cache)"""
     try:
-        # Get ALL categories first (sin límite)
-        all_categories = await db.categories.find({}, {"_id": 0}).to_list(None)
-        
-        # Initialize with all categories (empty arrays for now)
-        categorized_villas = {}
-        for category in all_categories:
-            categorized_villas[category["name"]] = []
-        
-        # Get ALL villas (sin límite de 100)
-        villas = await db.villas.find({}, {"_id": 0}).to_list(None)
-        
-        # Add "Sin Categoría" if there are villas without category
-        categorized_villas["Sin Categoría"] = []
-        
-        # Group villas by category
-        for villa in villas:
-            # Determine zone name
-            zone_name = "Sin Categoría"
-            if villa.get("category_id"):
-                category = await db.categories.find_one({"id": villa["category_id"]}, {"_id": 0})
-                if category:
-                    zone_name = category["name"]
-            
-            # Filter by zone if specified
-            if zone and zone_name != zone:
-                continue
-            
-            # Ensure zone exists in dict (in case of new categories)
-            if zone_name not in categorized_villas:
-                categorized_villas[zone_name] = []
-            
-            # Only include public-facing data (NO PRICES, NO INTERNAL INFO)
-            public_villa = {
-                "id": villa["id"],
-                "code": villa["code"],  # SOLO CÓDIGO
-                "zone": zone_name,
-                
-                # Controles de visibilidad
-                "catalog_show_price": villa.get("catalog_show_price", False),
-                "catalog_show_pasadia": villa.get("catalog_show_pasadia", False),
-                "catalog_show_amanecida": villa.get("catalog_show_amanecida", False),
-                
-                # Información de catálogo - Pasadía
-                "catalog_description_pasadia": villa.get("catalog_description_pasadia", ""),
-                "catalog_price_pasadia": villa.get("catalog_price_pasadia"),
-                "catalog_currency_pasadia": villa.get("catalog_currency_pasadia", "RD$"),
-                
-                # Información de catálogo - Amanecida
-                "catalog_description_amanecida": villa.get("catalog_description_amanecida", ""),
-                "catalog_price_amanecida": villa.get("catalog_price_amanecida"),
-                "catalog_currency_amanecida": villa.get("catalog_currency_amanecida", "RD$"),
-                
-                # Descripciones detalladas (modal)
-                "public_description_pasadia": villa.get("public_description_pasadia", ""),
-                "public_description_amanecida": villa.get("public_description_amanecida", ""),
-                
-                # Capacidades
-                "max_guests": villa.get("max_guests", 0),  # Capacidad (fallback)
-                "max_guests_pasadia": villa.get("public_max_guests_pasadia"),
-                "max_guests_amanecida": villa.get("public_max_guests_amanecida"),
-                "has_pasadia": villa.get("has_pasadia", False),
-                "has_amanecida": villa.get("has_amanecida", False),
-                "check_in_time_pasadia": villa.get("check_in_time_pasadia"),
-                "check_out_time_pasadia": villa.get("check_out_time_pasadia"),
-                "check_in_time_amanecida": villa.get("check_in_time_amanecida"),
-                "check_out_time_amanecida": villa.get("check_out_time_amanecida"),
-                
-                # Multimedia y características
-                "images": villa.get("public_images", []),  # Imágenes y videos públicos
-                "default_public_image_index": villa.get("default_public_image_index", 0),  # Índice de imagen predeterminada
-                "amenities": villa.get("public_amenities", []),  # Amenidades públicas
-                "features": villa.get("public_features", []),  # Características públicas
-                
-                # Precios flexibles por modalidad
-                "pasadia_prices": villa.get("pasadia_prices", []),
-                "amanecida_prices": villa.get("amanecida_prices", []),
-                "evento_prices": villa.get("evento_prices", [])
-                # NO incluir: name, prices, owner_price, category_id, etc.
-            }
-            categorized_villas[zone_name].append(public_villa)
-        
-        # Remove "Sin Categoría" if empty
-        if len(categorized_villas["Sin Categoría"]) == 0:
-            del categorized_villas["Sin Categoría"]
-        
-        return categorized_villas
+        if zone:
+            catalog = await public_catalog_cache.get(db)
+            return filter_catalog_by_zone(catalog, zone)
+        body = await public_catalog_cache.get_body(db)
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener villas públicas: {str(e)}")
 
@@ -4023,7 +3456,8 @@ async def update_villa_public_info(
         if "public_description" in public_data:
             update_fields["public_description"] = public_data["public_description"]
         if "public_images" in public_data:
-            update_fields["public_images"] = public_data["public_images"][:20]  # Limitar a 20
+            # Limitar a 20; las imágenes base64 se guardan aparte y queda solo su URL
+            update_fields["public_images"] = await externalize_villa_images(public_data["public_images"][:20], current_user["id"])
         if "default_public_image_index" in public_data:
             update_fields["default_public_image_index"] = public_data["default_public_image_index"]
         if "public_amenities" in public_data:
@@ -4071,8 +3505,9 @@ async def update_villa_public_info(
         
         await db.villas.update_one(
             {"id": villa_id},
-            {"$set": update_fields}
+            touch({"$set": update_fields})
         )
+        invalidate_public_catalog()
         
         return {"message": "Información pública actualizada exitosamente"}
     except HTTPException:
@@ -4124,7 +3559,7 @@ async def create_quote_request(request: QuoteRequestCreate):
         }
         
         # 1. Guardar en MongoDB (prioritario)
-        await db.quote_requests.insert_one(quote_doc)
+        await db.quote_requests.insert_one(prepare_doc_for_insert(quote_doc))
         logger.info(f"✅ Solicitud guardada en MongoDB: {request.nombre}")
         
         # 2. Intentar guardar en Google Sheets (opcional)
@@ -4171,23 +3606,90 @@ public_web_path = os.path.join(os.path.dirname(__file__), "public-web-build")
 if os.path.exists(public_web_path):
     app.mount("/public-site", StaticFiles(directory=public_web_path, html=True), name="public-website")
 
+# Compresión y GET condicional (ETag/304); CORS queda como el más externo
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+app.add_middleware(ConditionalGetMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=PAGINATION_HEADERS + ["ETag"]
 )
 
 
 # Startup event
 @app.on_event("startup")
 async def startup_event():
+    # Publicar en MongoDB las versiones de colecciones de este proceso (ETags entre workers)
+    collection_versions.start(db)
+    
+    # Crear/verificar índices de MongoDB (idempotente)
+    try:
+        await ensure_indexes(db)
+    except Exception as e:
+        logger.error(f"❌ Error al verificar índices: {str(e)}")
+    
+    # Backfill del registro de números de factura (solo la primera vez)
+    try:
+        if await db.invoice_numbers.estimated_document_count() == 0:
+            await sync_invoice_registry(db)
+    except Exception as e:
+        logger.error(f"❌ Error al sincronizar números de factura: {str(e)}")
+    
+    # Migración de fechas string -> Date de BSON (reanudable)
+    try:
+        await run_migration_once(db, "bson_dates_v1", migrate_dates_to_bson)
+    except Exception as e:
+        logger.error(f"❌ Error al migrar fechas: {str(e)}")
+    
+    # Backfill único de total_paid/balance_due en gastos
+    try:
+        await run_migration_once(db, "expense_totals_v1", backfill_expense_totals)
+    except Exception as e:
+        logger.error(f"❌ Error al recalcular totales de gastos: {str(e)}")
+    
+    # Construcción inicial de dashboard_rollups (v2: con dashboard_rollup_sources)
+    try:
+        await run_migration_once(db, "dashboard_rollups_v2", rebuild_dashboard_rollups)
+    except Exception as e:
+        logger.error(f"❌ Error al construir dashboard_rollups: {str(e)}")
+    
+    # updated_at en todos los documentos (base de los backups incrementales)
+    try:
+        await run_migration_once(db, "updated_at_v1", backfill_updated_at)
+    except Exception as e:
+        logger.error(f"❌ Error al completar updated_at: {str(e)}")
+    
+    # Imágenes base64 dentro de villas/logo -> tienda de archivos
+    try:
+        await run_migration_once(db, "inline_media_v2", migrate_inline_media)
+    except Exception as e:
+        logger.error(f"❌ Error al migrar multimedia: {str(e)}")
+    
+    # Llaves de búsqueda para documentos creados antes del índice de búsqueda
+    try:
+        await backfill_search_keys(db)
+    except Exception as e:
+        logger.error(f"❌ Error al generar llaves de búsqueda: {str(e)}")
+    
+    # Backups programados en disco (tarea en segundo plano)
+    backup_scheduler.start(db)
+    
+    # Importaciones en segundo plano (retoma las interrumpidas)
+    import_job_runner.start(db)
+    
     # Google Sheets se conectará cuando sea necesario (lazy loading)
     logger.info("✅ Backend iniciado. Google Sheets se conectará al recibir la primera solicitud.")
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
+    await backup_scheduler.stop()
+    await import_job_runner.stop()
+    shutdown_workbook_pool()
+    await collection_versions.flush()
     Database.close_db()
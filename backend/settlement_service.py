@@ -0,0 +1,127 @@
+"""
+Servicio de Liquidación de Reservaciones
+Calcula en una sola agregación el estado de los pagos asociados a una
+reservación (propietario, suplidores y devolución de depósito) y guarda
+los estados resultantes con un único bulk_write
+"""
+import logging
+from typing import Any, Dict, Optional
+from pymongo import UpdateOne
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import touch
+
+logger = logging.getLogger(__name__)
+
+OWNER_CATEGORY = "pago_propietario"
+SUPPLIER_CATEGORY = "pago_suplidor"
+DEPOSIT_CATEGORY = "devolucion_deposito"
+PAYABLE_CATEGORIES = [OWNER_CATEGORY, SUPPLIER_CATEGORY, DEPOSIT_CATEGORY]
+
+
+def expense_payment_status(total_paid: float, amount: float) -> str:
+    """Estado de un gasto según lo abonado: paid | partial | pending"""
+    if total_paid >= amount:
+        return "paid"
+    if total_paid > 0:
+        return "partial"
+    return "pending"
+
+
+def _payables_pipeline(reservation_id: str) -> list:
+    return [
+        {"$match": {"related_reservation_id": reservation_id, "category": {"$in": PAYABLE_CATEGORIES}}},
+        {"$lookup": {
+            "from": "expense_abonos",
+            "localField": "id",
+            "foreignField": "expense_id",
+            "as": "abonos"
+        }},
+        {"$group": {
+            "_id": "$related_reservation_id",
+            "payables": {"$push": {
+                "id": "$id",
+                "category": "$category",
+                "amount": {"$ifNull": ["$amount", 0]},
+                "payment_status": "$payment_status",
+                "total_paid": {"$sum": "$abonos.amount"}
+            }}
+        }}
+    ]
+
+
+async def settle_reservation_payables(db: AsyncIOMotorDatabase, reservation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Recalcula el estado de los gastos de una reservación:
+    - Suplidores: paid / partial / pending según sus abonos
+    - Propietario: paid solo si su gasto, TODOS los suplidores y la
+      devolución del depósito (si hay depósito) están saldados
+    La devolución de depósito se marca manualmente y no se modifica aquí.
+    Returns: resumen del cálculo o None si la reservación no tiene gastos
+    """
+    result = await db.expenses.aggregate(_payables_pipeline(reservation_id)).to_list(1)
+    if not result:
+        return None
+    payables = result[0]["payables"]
+
+    reservation = await db.reservations.find_one({"id": reservation_id}, {"_id": 0, "deposit": 1})
+    has_deposit = bool(reservation) and (reservation.get("deposit") or 0) > 0
+
+    suppliers = [p for p in payables if p["category"] == SUPPLIER_CATEGORY]
+    owners = [p for p in payables if p["category"] == OWNER_CATEGORY]
+
+    suppliers_paid = all(s["total_paid"] >= s["amount"] for s in suppliers)
+    deposit_returned = not has_deposit or any(
+        p["category"] == DEPOSIT_CATEGORY and p.get("payment_status") == "paid" for p in payables
+    )
+
+    new_statuses = {}
+    for supplier in suppliers:
+        new_statuses[supplier["id"]] = expense_payment_status(supplier["total_paid"], supplier["amount"])
+    owner_paid = False
+    for owner in owners:
+        owner_paid = owner["total_paid"] >= owner["amount"]
+        # El propietario queda 'pending' hasta que se cumplan todas las condiciones
+        new_statuses[owner["id"]] = "paid" if (owner_paid and suppliers_paid and deposit_returned) else "pending"
+
+    current = {p["id"]: p.get("payment_status") for p in payables}
+    operations = [
+        UpdateOne({"id": expense_id}, touch({"$set": {"payment_status": status}}))
+        for expense_id, status in new_statuses.items()
+        if current.get(expense_id) != status
+    ]
+    if operations:
+        await db.expenses.bulk_write(operations, ordered=False)
+
+    logger.info(
+        f"📌 Liquidación reservación {reservation_id}: propietario={owner_paid}, "
+        f"suplidores={suppliers_paid}, depósito={deposit_returned}, {len(operations)} estados actualizados"
+    )
+    return {
+        "owner_paid": owner_paid,
+        "suppliers_paid": suppliers_paid,
+        "deposit_returned": deposit_returned,
+        "statuses": new_statuses,
+        "updated": len(operations)
+    }
+
+
+async def settle_expense(db: AsyncIOMotorDatabase, expense: dict) -> str:
+    """
+    Recalcula el estado de un gasto después de un cambio de dinero.
+    Los gastos de una reservación se liquidan en conjunto; el resto
+    solo depende de sus propios abonos.
+    Returns: el nuevo payment_status del gasto
+    """
+    reservation_id = expense.get("related_reservation_id")
+    if reservation_id and expense.get("category") in (OWNER_CATEGORY, SUPPLIER_CATEGORY):
+        summary = await settle_reservation_payables(db, reservation_id)
+        if summary and expense["id"] in summary["statuses"]:
+            return summary["statuses"][expense["id"]]
+
+    new_status = expense_payment_status(expense.get("total_paid") or 0, expense.get("amount", 0))
+    await db.expenses.update_one({"id": expense["id"]}, touch({"$set": {"payment_status": new_status}}))
+
+    # La devolución del depósito condiciona el estado del propietario
+    if reservation_id and expense.get("category") == DEPOSIT_CATEGORY:
+        await settle_reservation_payables(db, reservation_id)
+    return new_status
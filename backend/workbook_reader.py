@@ -0,0 +1,90 @@
+"""
+Lectura de libros Excel fuera del event loop
+openpyxl es CPU puro: leer un libro grande en el proceso de la API bloquea
+todas las demás peticiones. read_workbook abre el archivo una sola vez en un
+ProcessPoolExecutor, lee todas las hojas pedidas en esa pasada y devuelve
+cada hoja como arrays de columnas (numpy) que se reconstruyen en DataFrame
+en el proceso principal.
+
+Este módulo solo importa pandas: es lo que cargan los procesos del pool.
+
+Variables de entorno:
+    WORKBOOK_WORKERS   procesos de lectura (por defecto 2)
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+WORKBOOK_WORKERS = int(os.environ.get("WORKBOOK_WORKERS", "2"))
+
+# (hoja, skiprows, opcional)
+SheetSpec = Tuple[str, Optional[List[int]], bool]
+# (nombres de columna, un array por columna); None si la hoja opcional no existe
+SheetColumns = Optional[Tuple[List[str], List[np.ndarray]]]
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def parse_workbook(content: bytes, sheets: Sequence[SheetSpec]) -> Dict[str, SheetColumns]:
+    """Se ejecuta en el proceso del pool: un solo ExcelFile para todas las hojas"""
+    parsed: Dict[str, SheetColumns] = {}
+    with pd.ExcelFile(BytesIO(content)) as excel_file:
+        for name, skiprows, optional in sheets:
+            if name not in excel_file.sheet_names:
+                if optional:
+                    parsed[name] = None
+                    continue
+                raise ValueError(f"No se encontró la hoja '{name}'")
+            df = excel_file.parse(name, skiprows=skiprows)
+            # Por posición: un Excel puede repetir encabezados
+            parsed[name] = (list(df.columns), [df.iloc[:, i].to_numpy() for i in range(df.shape[1])])
+    return parsed
+
+
+def _to_frame(columns: List[str], arrays: List[np.ndarray]) -> pd.DataFrame:
+    df = pd.DataFrame(dict(enumerate(arrays)))
+    df.columns = columns
+    return df
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: el proceso de la API tiene hilos (motor, to_thread) que fork no copia bien
+        _pool = ProcessPoolExecutor(max_workers=WORKBOOK_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def read_workbook(content: bytes, sheets: Sequence[SheetSpec]) -> Dict[str, Optional[pd.DataFrame]]:
+    """{hoja: DataFrame} leyendo el libro una sola vez en el pool de procesos"""
+    global _pool
+    loop = asyncio.get_running_loop()
+    try:
+        parsed = await loop.run_in_executor(_get_pool(), parse_workbook, content, list(sheets))
+    except BrokenProcessPool:
+        # Un proceso murió (p. ej. memoria): la siguiente lectura crea un pool nuevo
+        logger.error("❌ El pool de lectura de Excel se cayó, se recreará")
+        _pool = None
+        raise
+    return {name: _to_frame(*columns) if columns is not None else None for name, columns in parsed.items()}
+
+
+async def read_sheet(content: bytes, sheet_name: str) -> pd.DataFrame:
+    frames = await read_workbook(content, [(sheet_name, None, False)])
+    return frames[sheet_name]
+
+
+def shutdown_workbook_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
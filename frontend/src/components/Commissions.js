@@ -675,7 +675,7 @@ function Commissions() {
                       )}
                     </td>
                     <td className="px-4 py-3 text-sm text-gray-900">
-                      {commission.reservation_date}
+                      {commission.reservation_date?.substring(0, 10)}
                     </td>
                     <td className="px-4 py-3 text-sm text-gray-900 font-medium">
                       {commission.user_name}
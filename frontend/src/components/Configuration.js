@@ -133,6 +133,34 @@ function Configuration() {
     }
   };
 
+  const downloadBackup = async (mode) => {
+    try {
+      const token = localStorage.getItem('token');
+      const response = await fetch(`${API_URL}/api/backup/download?mode=${mode}`, {
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
+      
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.detail || 'Error al descargar backup');
+      }
+      
+      const blob = await response.blob();
+      const url = window.URL.createObjectURL(blob);
+      const a = document.createElement('a');
+      a.href = url;
+      a.download = response.headers.get('Content-Disposition')?.split('filename=')[1] || 'backup.ndjson.gz';
+      document.body.appendChild(a);
+      a.click();
+      a.remove();
+      window.URL.revokeObjectURL(url);
+      
+      alert('✅ Backup descargado exitosamente! Guárdalo en un lugar seguro.');
+    } catch (err) {
+      alert('❌ Error al descargar backup: ' + err.message);
+    }
+  };
+
   const downloadTemplate = async (templateKey, filename) => {
     try {
       setLoadingTemplates(true);
@@ -163,6 +191,25 @@ function Configuration() {
     }
   };
 
+  // Las importaciones corren en segundo plano: consultar el trabajo hasta que termine
+  const waitForImportJob = async (statusUrl) => {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+      const response = await fetch(`${API_URL}${statusUrl}`, {
+        headers: {
+          'Authorization': `Bearer ${localStorage.getItem('token')}`
+        }
+      });
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(errorData.detail || 'Error al consultar la importación');
+      }
+      const job = await response.json();
+      if (job.status === 'completed') return job;
+      if (job.status === 'failed') throw new Error(job.error || 'La importación falló');
+    }
+  };
+
   const handleImportFile = async (templateKey, file) => {
     if (!file) return;
     
@@ -189,7 +236,8 @@ function Configuration() {
       }
       
       const result = await response.json();
-      alert(`✅ Importación exitosa!\n\n${result.summary || result.message}`);
+      const job = result.status_url ? await waitForImportJob(result.status_url) : result;
+      alert(`✅ Importación exitosa!\n\n${job.summary || job.message}`);
       
       // Recargar info de plantillas para actualizar contadores
       await fetchTemplatesInfo();
@@ -315,34 +363,17 @@ function Configuration() {
               Incluye: Usuarios, Clientes, Villas, Reservaciones, Gastos, Categorías, Configuraciones, etc.
             </p>
             <button
-              onClick={async () => {
-                try {
-                  const token = localStorage.getItem('token');
-                  const response = await fetch(`${API_URL}/api/backup/download`, {
-                    headers: { 'Authorization': `Bearer ${token}` }
-                  });
-                  
-                  if (!response.ok) throw new Error('Error al descargar backup');
-                  
-                  const blob = await response.blob();
-                  const url = window.URL.createObjectURL(blob);
-                  const a = document.createElement('a');
-                  a.href = url;
-                  a.download = response.headers.get('Content-Disposition')?.split('filename=')[1] || 'backup.json';
-                  document.body.appendChild(a);
-                  a.click();
-                  a.remove();
-                  window.URL.revokeObjectURL(url);
-                  
-                  alert('✅ Backup descargado exitosamente! Guárdalo en un lugar seguro.');
-                } catch (err) {
-                  alert('❌ Error al descargar backup: ' + err.message);
-                }
-              }}
+              onClick={() => downloadBackup('full')}
               className="w-full px-4 py-3 bg-green-600 text-white rounded-lg hover:bg-green-700 font-semibold"
             >
               📥 Descargar Backup Ahora
             </button>
+            <button
+              onClick={() => downloadBackup('incremental')}
+              className="w-full mt-2 px-4 py-2 bg-white text-green-700 border-2 border-green-600 rounded-lg hover:bg-green-50 font-semibold text-sm"
+            >
+              📥 Descargar Incremental (cambios desde el último backup)
+            </button>
           </div>
 
           {/* Restore Backup */}
@@ -356,7 +387,7 @@ function Configuration() {
             </p>
             <input
               type="file"
-              accept=".json"
+              accept=".json,.gz,.ndjson"
               onChange={async (e) => {
                 const file = e.target.files[0];
                 if (!file) return;
@@ -762,7 +793,8 @@ function Configuration() {
                     }
                     
                     const result = await response.json();
-                    alert(result.summary);
+                    const job = await waitForImportJob(result.status_url);
+                    alert(job.summary);
                     await fetchTemplatesInfo();
                     e.target.value = '';
                   } catch (err) {
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useAuth } from '../context/AuthContext';
 import { Button } from './ui/button';
 import { Home, Users, FileText, DollarSign, Building, Menu, X, LogOut, Tag, UserCog, Settings, Receipt, TrendingUp, ClipboardList, Truck } from 'lucide-react';
+import { mediaSrc } from '../lib/media';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || '';
 
@@ -26,7 +27,7 @@ const Layout = ({ children, currentView, setCurrentView }) => {
       if (response.ok) {
         const data = await response.json();
         if (data.logo_data) {
-          setLogo(data.logo_data);
+          setLogo(mediaSrc(data.logo_data));
         }
       }
     } catch (err) {
@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import { mediaSrc, IMAGE_TYPES } from '../lib/media';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || '';
 
@@ -28,7 +29,7 @@ function LogoUploader() {
       const data = await response.json();
       if (data.logo_data) {
         setLogo(data);
-        setLogoPreview(data.logo_data);
+        setLogoPreview(mediaSrc(data.logo_data));
       }
     } catch (err) {
       setError(err.message);
@@ -42,8 +43,8 @@ function LogoUploader() {
     if (!file) return;
 
     // Validar tipo de archivo
-    if (!file.type.startsWith('image/')) {
-      setError('Por favor selecciona una imagen válida');
+    if (!IMAGE_TYPES.includes(file.type)) {
+      setError('Por favor selecciona una imagen JPG, PNG, GIF o WebP');
       return;
     }
 
@@ -186,7 +187,7 @@ function LogoUploader() {
           <input
             id="logo-input"
             type="file"
-            accept="image/*"
+            accept={IMAGE_TYPES.join(',')}
             onChange={handleFileChange}
             className="block w-full text-sm text-gray-500
               file:mr-4 file:py-2 file:px-4
@@ -197,7 +198,7 @@ function LogoUploader() {
               cursor-pointer"
           />
           <p className="text-xs text-gray-500 mt-1">
-            Formatos: JPG, PNG, GIF. Tamaño máximo: 2MB
+            Formatos: JPG, PNG, GIF, WebP. Tamaño máximo: 2MB
           </p>
         </div>
 
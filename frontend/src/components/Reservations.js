@@ -9,6 +9,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from
 import { Plus, Edit, Trash2, Printer, Search, X, ChevronDown, ChevronUp, FileText } from 'lucide-react';
 import { useAuth } from '../context/AuthContext';
 import CustomerDialog from './CustomerDialog';
+import { mediaSrc } from '../lib/media';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || '';
 
@@ -133,7 +134,7 @@ const Reservations = () => {
       if (response.ok) {
         const data = await response.json();
         if (data.logo_data) {
-          setLogo(data.logo_data);
+          setLogo(mediaSrc(data.logo_data));
         }
       }
     } catch (err) {
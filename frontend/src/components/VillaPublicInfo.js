@@ -1,6 +1,7 @@
 import React, { useState } from 'react';
 import { X, Loader } from 'lucide-react';
 import { Button } from './ui/button';
+import { mediaSrc, isVideoMedia, MEDIA_TYPES } from '../lib/media';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || '';
 
@@ -26,7 +27,7 @@ const VillaPublicInfo = ({ villa, onClose, onUpdate }) => {
 
     for (let file of files) {
       // Verificar que sea imagen o video
-      if (!file.type.startsWith('image/') && !file.type.startsWith('video/')) {
+      if (!MEDIA_TYPES.includes(file.type)) {
         alert(`${file.name} no es una imagen o video válido`);
         continue;
       }
@@ -197,7 +198,7 @@ const VillaPublicInfo = ({ villa, onClose, onUpdate }) => {
           </div>
           <input
             type="file"
-            accept="image/*,video/*"
+            accept={MEDIA_TYPES.join(',')}
             multiple
             onChange={handleImageUpload}
             disabled={publicData.public_images.length >= 20}
@@ -211,10 +212,10 @@ const VillaPublicInfo = ({ villa, onClose, onUpdate }) => {
           <div style={{ display: 'grid', gridTemplateColumns: 'repeat(auto-fill, minmax(150px, 1fr))', gap: '10px', marginTop: '10px' }}>
             {publicData.public_images.map((media, idx) => (
               <div key={idx} style={{ position: 'relative', border: publicData.default_public_image_index === idx ? '3px solid gold' : 'none', borderRadius: '5px' }}>
-                {media.startsWith('data:video') ? (
-                  <video src={media} style={{ width: '100%', height: '150px', objectFit: 'cover', borderRadius: '5px' }} controls />
+                {isVideoMedia(media) ? (
+                  <video src={mediaSrc(media)} style={{ width: '100%', height: '150px', objectFit: 'cover', borderRadius: '5px' }} controls />
                 ) : (
-                  <img src={media} alt={`Villa ${idx + 1}`} style={{ width: '100%', height: '150px', objectFit: 'cover', borderRadius: '5px' }} />
+                  <img src={mediaSrc(media)} alt={`Villa ${idx + 1}`} style={{ width: '100%', height: '150px', objectFit: 'cover', borderRadius: '5px' }} />
                 )}
                 <button
                   onClick={() => removeImage(idx)}
@@ -0,0 +1,26 @@
+// El backend guarda los archivos multimedia como rutas relativas
+// (/api/media/{id}.{ext}); el sitio se sirve desde otro origen, así que hay
+// que anteponer la URL del backend. Los data URL y URLs absolutas se dejan igual.
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || '';
+
+// Tipos que acepta el backend (se validan de nuevo allí con los bytes del archivo)
+export const IMAGE_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/webp'];
+export const VIDEO_TYPES = ['video/mp4', 'video/quicktime', 'video/webm', 'video/ogg'];
+export const MEDIA_TYPES = [...IMAGE_TYPES, ...VIDEO_TYPES];
+
+const VIDEO_EXTENSIONS = ['mp4', 'mov', 'webm', 'ogg', 'ogv', 'm4v', 'avi', 'mkv'];
+
+export function mediaSrc(value) {
+  if (typeof value === 'string' && value.startsWith('/api/')) {
+    return `${BACKEND_URL}${value}`;
+  }
+  return value;
+}
+
+export function isVideoMedia(value) {
+  if (typeof value !== 'string') return false;
+  if (value.startsWith('data:')) return value.startsWith('data:video');
+  const path = value.split('?')[0];
+  const extension = path.includes('.') ? path.split('.').pop().toLowerCase() : '';
+  return VIDEO_EXTENSIONS.includes(extension);
+}
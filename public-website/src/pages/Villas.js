@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { useCart } from '../context/CartContext';
+import { mediaSrc, isVideoMedia } from '../lib/media';
 
 const Villas = () => {
   const { addToCart } = useCart();
@@ -137,14 +138,14 @@ const Villas = () => {
                       {/* Carrusel de imágenes */}
                       {hasImages ? (
                         <div style={{ position: 'relative', height: '160px', overflow: 'hidden' }}>
-                          {currentImage.startsWith('data:video') ? (
+                          {isVideoMedia(currentImage) ? (
                             <video 
-                              src={currentImage}
+                              src={mediaSrc(currentImage)}
                               style={{ width: '100%', height: '160px', objectFit: 'cover' }}
                             />
                           ) : (
                             <img 
-                              src={currentImage} 
+                              src={mediaSrc(currentImage)} 
                               alt={villa.code}
                               className="card-image"
                               style={{ width: '100%', height: '160px', objectFit: 'cover' }}
@@ -485,15 +486,15 @@ const Villas = () => {
             {/* Carrusel de imágenes grande */}
             {selectedVilla.images && selectedVilla.images.length > 0 && (
               <div style={{ position: 'relative', height: '400px', background: '#000' }}>
-                {selectedVilla.images[currentImageIndex[selectedVilla.id] || 0].startsWith('data:video') ? (
+                {isVideoMedia(selectedVilla.images[currentImageIndex[selectedVilla.id] || 0]) ? (
                   <video 
-                    src={selectedVilla.images[currentImageIndex[selectedVilla.id] || 0]}
+                    src={mediaSrc(selectedVilla.images[currentImageIndex[selectedVilla.id] || 0])}
                     controls
                     style={{ width: '100%', height: '400px', objectFit: 'contain' }}
                   />
                 ) : (
                   <img 
-                    src={selectedVilla.images[currentImageIndex[selectedVilla.id] || 0]}
+                    src={mediaSrc(selectedVilla.images[currentImageIndex[selectedVilla.id] || 0])}
                     alt={selectedVilla.code}
                     style={{ width: '100%', height: '400px', objectFit: 'contain' }}
                   />